@@ -1,4 +1,4 @@
 from api.api.resources.user import UserResource, UserList
-from api.api.resources.site import SiteList
+from api.api.resources.site import SiteList, SiteExport, SiteAggregates
 
-__all__ = ["UserResource", "UserList", "SiteList"]
+__all__ = ["UserResource", "UserList", "SiteList", "SiteExport", "SiteAggregates"]
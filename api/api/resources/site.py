@@ -1,24 +1,160 @@
+import math
+
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required
 from api.api.schemas import SiteSchema
-from api.models import Site
-from api.commons.pagination import paginate
+from api.models import Site, SiteRollup
+from api import rollups
+from api.commons import geo
+from api.commons.export import stream_export
+from api.commons.pagination import paginate, paginate_cursor
+from api.commons.serialization import RowSerializer, dumps
+from api.extensions import db, response_cache
+from marshmallow import ValidationError
+
+from flask import Response, current_app, request
+
+
+SITE_COLUMNS = [
+    Site.__table__.columns[name] for name in SiteSchema().fields
+]
+SITE_SERIALIZER = RowSerializer(SITE_COLUMNS)
+ROLLUP_COLUMNS = [
+    SiteRollup.country,
+    SiteRollup.key,
+    SiteRollup.site_count,
+    SiteRollup.available,
+    SiteRollup.used,
+    SiteRollup.updated,
+]
+ROLLUP_SERIALIZER = RowSerializer(ROLLUP_COLUMNS)
+
+
+def parse_floats(name, count):
+    """Parse a query parameter of `count` comma separated finite floats."""
+    try:
+        values = [float(value) for value in request.args[name].split(",")]
+    except ValueError:
+        values = []
+    if len(values) != count or not all(math.isfinite(value) for value in values):
+        raise ValidationError({name: [f"Must be {count} comma separated numbers."]})
+    return values
+
+
+def check_coordinate(name, latitude, longitude):
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValidationError({name: ["Coordinates out of range."]})
 
-from flask import request
+
+def filter_spatial(query):
+    """Apply the `?bbox` and `?near` / `?radius_km` filters to a site query.
+
+    `bbox` is `min_lon,min_lat,max_lon,max_lat`, with `min_lon > max_lon` for
+    a box crossing the antimeridian. `near` is `lat,lon` and `radius_km` the
+    great circle distance from it.
+    """
+    if "bbox" in request.args:
+        min_lon, min_lat, max_lon, max_lat = parse_floats("bbox", 4)
+        check_coordinate("bbox", min_lat, min_lon)
+        check_coordinate("bbox", max_lat, max_lon)
+        if min_lat > max_lat:
+            raise ValidationError({"bbox": ["min_lat is greater than max_lat."]})
+        boxes = geo.split_bbox(min_lat, min_lon, max_lat, max_lon)
+        query = query.filter(geo.bbox_filter(Site, boxes))
+    if "near" in request.args:
+        latitude, longitude = parse_floats("near", 2)
+        check_coordinate("near", latitude, longitude)
+        if "radius_km" not in request.args:
+            raise ValidationError({"radius_km": ["Required with near."]})
+        (radius_km,) = parse_floats("radius_km", 1)
+        if radius_km <= 0:
+            raise ValidationError({"radius_km": ["Must be a positive number."]})
+        query = query.filter(geo.radius_filter(Site, latitude, longitude, radius_km))
+    return query
 
 
 class SiteList(Resource):
     """Get all Sites."""
-    method_decorators = [jwt_required()]
+    method_decorators = [response_cache.cached("sites"), jwt_required()]
 
     def get(self):
         """Get all Sites.
 
         Optionally, accepts a query parameter `?admin_area`, if specified
-        only lists sites within the admin area.
+        only lists sites within the admin area. Sites can also be filtered by
+        `?bbox=min_lon,min_lat,max_lon,max_lat` or by distance with
+        `?near=lat,lon&radius_km=`, see `filter_spatial`.
+
+        Passing `?cursor` (empty for the first page) switches to keyset
+        pagination ordered by site ID, following the returned `next` link
+        pages through all sites in constant time per page. Add `?count=false`
+        to also skip counting the total.
+
+        Responses are cached until the next `load_sites` run, and honour
+        `If-None-Match` and `If-Modified-Since`.
+
+        Sites are selected as plain column rows and serialized by
+        `SITE_SERIALIZER`, the output is the same as dumping with `SiteSchema`.
         """
-        schema = SiteSchema(many=True)
-        query = Site.query
+        query = db.session.query(*SITE_COLUMNS)
         if admin_area := request.args.get('admin_area'):
-            return paginate(query.filter_by(admin_area=admin_area), schema)
-        return paginate(query, schema)
+            query = query.filter(Site.admin_area == admin_area)
+        query = filter_spatial(query)
+        if 'cursor' in request.args:
+            result = paginate_cursor(query, SITE_SERIALIZER, Site.id)
+        else:
+            result = paginate(query, SITE_SERIALIZER)
+        return Response(dumps(result), mimetype="application/json")
+
+
+class SiteExport(Resource):
+    """Export Sites."""
+    method_decorators = [jwt_required()]
+
+    def get(self):
+        """Export Sites as NDJSON or CSV.
+
+        Accepts a query parameter `?format`, `ndjson` (default) or `csv`, and
+        the optional filters `?admin_area`, `?country` and the spatial filters
+        of `SiteList`. Every matching site
+        is streamed in ID order, fetched `EXPORT_BATCH_SIZE` rows at a time.
+        """
+        query = db.session.query(*SITE_COLUMNS)
+        if admin_area := request.args.get('admin_area'):
+            query = query.filter(Site.admin_area == admin_area)
+        if country := request.args.get('country'):
+            query = query.filter(Site.country == country)
+        query = filter_spatial(query)
+        return stream_export(
+            query.order_by(Site.id),
+            request.args.get('format', 'ndjson'),
+            current_app.config.get("EXPORT_BATCH_SIZE"),
+        )
+
+
+class SiteAggregates(Resource):
+    """Get Site aggregates."""
+    method_decorators = [jwt_required()]
+
+    def get(self):
+        """Get station counts and bike totals.
+
+        Accepts a query parameter `?level`, `admin_area` (default) or
+        `country`, and an optional `?country` filter. Aggregates are read from
+        the `SiteRollup` table, so reads cost the same however many stations
+        there are. Rollups are rebuilt when `load_sites` publishes a run, so
+        they show the last completed load: changes made while a load is in
+        progress only appear once it finishes.
+        """
+        level = request.args.get('level', 'admin_area')
+        if level not in rollups.LEVELS:
+            raise ValidationError(
+                {"level": [f"Must be one of: {', '.join(rollups.LEVELS)}."]}
+            )
+        query = db.session.query(*ROLLUP_COLUMNS).filter(SiteRollup.level == level)
+        if country := request.args.get('country'):
+            query = query.filter(SiteRollup.country == country)
+        query = query.order_by(SiteRollup.country, SiteRollup.key)
+        return Response(
+            dumps(paginate(query, ROLLUP_SERIALIZER)), mimetype="application/json"
+        )
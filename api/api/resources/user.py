@@ -5,6 +5,7 @@ from api.api.schemas import UserSchema
 from api.models import User
 from api.extensions import db
 from api.commons.pagination import paginate
+from api.auth.helpers import invalidate_user
 
 
 class UserResource(Resource):
@@ -90,6 +91,7 @@ class UserResource(Resource):
         user = schema.load(request.json, instance=user)
 
         db.session.commit()
+        invalidate_user(user_id)
 
         return {"msg": "user updated", "user": schema.dump(user)}
 
@@ -97,6 +99,7 @@ class UserResource(Resource):
         user = User.query.get_or_404(user_id)
         db.session.delete(user)
         db.session.commit()
+        invalidate_user(user_id)
 
         return {"msg": "user deleted"}
 
@@ -8,3 +8,4 @@ class SiteSchema(ma.SQLAlchemyAutoSchema):
         model = Site
         sqla_session = db.session
         load_instance = True
+        exclude = ("geohash",)
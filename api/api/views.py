@@ -2,7 +2,7 @@ from flask import Blueprint, current_app, jsonify
 from flask_restful import Api
 from marshmallow import ValidationError
 
-from api.api.resources.site import SiteList
+from api.api.resources.site import SiteList, SiteExport, SiteAggregates
 from api.extensions import apispec
 from api.api.resources import UserResource, UserList
 from api.api.schemas import UserSchema
@@ -15,6 +15,8 @@ api = Api(blueprint)
 api.add_resource(UserResource, "/users/<int:user_id>", endpoint="user_by_id")
 api.add_resource(UserList, "/users", endpoint="users")
 api.add_resource(SiteList, "/sites", endpoint="sites")
+api.add_resource(SiteExport, "/sites/export", endpoint="sites_export")
+api.add_resource(SiteAggregates, "/sites/aggregates", endpoint="site_aggregates")
 
 
 @blueprint.before_app_first_request
@@ -23,6 +25,8 @@ def register_views():
     apispec.spec.path(view=UserResource, app=current_app)
     apispec.spec.path(view=UserList, app=current_app)
     apispec.spec.path(view=SiteList, app=current_app)
+    apispec.spec.path(view=SiteExport, app=current_app)
+    apispec.spec.path(view=SiteAggregates, app=current_app)
 
 
 @blueprint.errorhandler(ValidationError)
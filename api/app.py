@@ -5,6 +5,7 @@ from api.extensions import apispec
 from api.extensions import db
 from api.extensions import jwt
 from api.extensions import migrate
+from api.extensions import response_cache
 
 
 def create_app(testing=False):
@@ -27,6 +28,7 @@ def configure_extensions(app):
     db.init_app(app)
     jwt.init_app(app)
     migrate.init_app(app, db)
+    response_cache.init_app(app)
 
 
 def configure_apispec(app):
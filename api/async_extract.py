@@ -0,0 +1,164 @@
+"""Asynchronous extraction engine.
+
+An asyncio/httpx alternative to the grequests based extraction. URLs are
+fetched continuously, bounded by a concurrency semaphore, over one shared
+keep-alive connection pool. Requests are rate limited per host, and a host
+that answers HTTP 429 is backed off before it is requested again. Responses
+are handed to a synchronous callback (e.g. `cb_extract.process`) as soon as
+they arrive, so one slow URL never holds back the others.
+"""
+import asyncio
+import collections
+import typing
+import urllib.parse
+
+import click
+import httpx
+from flask import current_app
+
+from api import cb_extract
+from api import checkpoints
+from api import dlq
+
+
+class Response:
+    """Response adapter.
+
+    Exposes an `httpx.Response` through the subset of the `requests` response
+    interface used by the extraction pipeline.
+    """
+
+    def __init__(self, response: httpx.Response):
+        self._response = response
+        self.url = str(response.request.url)
+        self.status_code = response.status_code
+        self.ok = response.is_success
+        self.headers = response.headers
+
+    @property
+    def text(self) -> str:
+        return self._response.text
+
+    def json(self) -> typing.Any:
+        return self._response.json()
+
+
+class HostRateLimiter:
+    """Per host rate limiter.
+
+    Spaces requests to the same host at least `1 / rate` seconds apart. A rate
+    of zero disables spacing, but `backoff` still applies.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next_slot = collections.defaultdict(float)
+        self._locks = collections.defaultdict(asyncio.Lock)
+
+    async def acquire(self, host: str):
+        """Wait until a request to `host` is allowed."""
+        async with self._locks[host]:
+            loop = asyncio.get_running_loop()
+            delay = self._next_slot[host] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot[host] = loop.time() + self.interval
+
+    def backoff(self, host: str, delay: float):
+        """Hold back all requests to `host` for `delay` seconds."""
+        loop = asyncio.get_running_loop()
+        self._next_slot[host] = max(self._next_slot[host], loop.time() + delay)
+
+
+def retry_after(response: httpx.Response, attempt: int) -> float:
+    """Seconds to back off after a 429.
+
+    Honours a numeric `Retry-After` header, otherwise backs off exponentially.
+    """
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return 2.0 ** attempt
+
+
+async def fetch(
+    client: httpx.AsyncClient,
+    limiter: HostRateLimiter,
+    url: str,
+    max_retries: int,
+) -> typing.Optional[Response]:
+    """Fetch a URL.
+
+    Retries up to `max_retries` times on HTTP 429, after which the throttled
+    response is returned as is. Transport failures add the URL to the dead
+    letter queue and return `None`.
+    """
+    host = urllib.parse.urlsplit(url).netloc
+    attempt = 0
+    while True:
+        await limiter.acquire(host)
+        try:
+            response = await client.get(url)
+        except httpx.HTTPError as e:
+            click.echo(f"Request failed for {url}, reason:{e!r}")
+            dlq.add_to_dlq(url, e)
+            checkpoints.mark_failed(url, repr(e))
+            return None
+        if response.status_code != 429 or attempt >= max_retries:
+            return Response(response)
+        attempt += 1
+        delay = retry_after(response, attempt)
+        click.echo(f"Throttled by {host}, backing off {delay}s")
+        limiter.backoff(host, delay)
+
+
+async def extract(
+    urls: typing.Iterable[str],
+    on_response: typing.Callable[[Response], typing.Any],
+    concurrency: int = 20,
+    rate_per_host: float = 0.0,
+    timeout: float = 1.0,
+    max_retries: int = 3,
+    transport: typing.Optional[httpx.AsyncBaseTransport] = None,
+):
+    """Extract URLs.
+
+    Fetches every URL with at most `concurrency` requests in flight, calling
+    `on_response` with each response as it completes.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = HostRateLimiter(rate_per_host)
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+
+    async with httpx.AsyncClient(
+        limits=limits, timeout=timeout, transport=transport
+    ) as client:
+
+        async def worker(url: str):
+            async with semaphore:
+                response = await fetch(client, limiter, url, max_retries)
+            if response is not None:
+                on_response(response)
+
+        await asyncio.gather(*(worker(url) for url in urls))
+
+
+def extract_sites(urls: typing.Iterable[str], timeout: float = 1.0):
+    """Extract Citybike sites.
+
+    Runs the asynchronous engine over `urls`, processing each response with
+    `cb_extract.process`. Concurrency, per host rate and retries are read from
+    `EXTRACT_CONCURRENCY`, `EXTRACT_RATE_PER_HOST` and `EXTRACT_MAX_RETRIES`.
+    """
+    asyncio.run(
+        extract(
+            urls,
+            cb_extract.process,
+            concurrency=current_app.config.get("EXTRACT_CONCURRENCY"),
+            rate_per_host=current_app.config.get("EXTRACT_RATE_PER_HOST"),
+            timeout=timeout,
+            max_retries=current_app.config.get("EXTRACT_MAX_RETRIES"),
+        )
+    )
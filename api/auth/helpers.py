@@ -2,14 +2,27 @@
 
 Heavily inspired by
 https://github.com/vimalloc/flask-jwt-extended/blob/master/examples/blocklist_database.py
+
+Token revoked status and users are cached in process for
+`TOKEN_BLOCKLIST_CACHE_TTL_SECONDS` and `USER_CACHE_TTL_SECONDS`, so an
+authenticated request usually needs no database round trip at all. Changes
+made through this process invalidate the caches straight away; with several
+processes, a token revoked by another one is honoured within the TTL.
 """
+import time
 from datetime import datetime
 
+from flask import current_app
 from flask_jwt_extended import decode_token
 from sqlalchemy.orm.exc import NoResultFound
 
+from api.commons.cache import TTLCache
 from api.extensions import db
-from api.models import TokenBlocklist
+from api.models import TokenBlocklist, User
+
+REVOKED_CACHE = TTLCache()
+USER_CACHE = TTLCache()
+_last_purge = None
 
 
 def add_token_to_database(encoded_token, identity_claim):
@@ -34,6 +47,7 @@ def add_token_to_database(encoded_token, identity_claim):
     )
     db.session.add(db_token)
     db.session.commit()
+    purge_expired_tokens_periodically()
 
 
 def is_token_revoked(jwt_payload):
@@ -44,11 +58,17 @@ def is_token_revoked(jwt_payload):
     it was created.
     """
     jti = jwt_payload["jti"]
-    try:
-        token = TokenBlocklist.query.filter_by(jti=jti).one()
-        return token.revoked
-    except NoResultFound:
-        return True
+    revoked = REVOKED_CACHE.get(jti)
+    if revoked is None:
+        try:
+            token = TokenBlocklist.query.filter_by(jti=jti).one()
+            revoked = token.revoked
+        except NoResultFound:
+            revoked = True
+        REVOKED_CACHE.set(
+            jti, revoked, current_app.config["TOKEN_BLOCKLIST_CACHE_TTL_SECONDS"]
+        )
+    return revoked
 
 
 def revoke_token(token_jti, user):
@@ -61,5 +81,53 @@ def revoke_token(token_jti, user):
         token = TokenBlocklist.query.filter_by(jti=token_jti, user_id=user).one()
         token.revoked = True
         db.session.commit()
+        REVOKED_CACHE.pop(token_jti)
     except NoResultFound:
         raise Exception("Could not find the token {}".format(token_jti))
+
+
+def load_user(identity):
+    """Load the user for a token identity, `None` if there is no such user.
+
+    Cached users are kept detached and merged into the current session
+    without a query.
+    """
+    user = USER_CACHE.get(str(identity))
+    if user is None:
+        user = User.query.get(identity)
+        if user is None:
+            return None
+        db.session.expunge(user)
+        USER_CACHE.set(
+            str(identity), user, current_app.config["USER_CACHE_TTL_SECONDS"]
+        )
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user_id):
+    """Drop a user from the cache, e.g. when it is updated or deleted."""
+    USER_CACHE.pop(str(user_id))
+
+
+def purge_expired_tokens(now=None):
+    """Delete the blocklist entries of expired tokens.
+
+    Expired tokens are rejected before the blocklist is checked, so their
+    entries are of no further use. Returns the number of entries deleted.
+    """
+    now = now or datetime.now()
+    count = TokenBlocklist.query.filter(TokenBlocklist.expires < now).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+    return count
+
+
+def purge_expired_tokens_periodically():
+    """Purge expired tokens at most every `TOKEN_PURGE_INTERVAL_SECONDS`."""
+    global _last_purge
+    interval = current_app.config["TOKEN_PURGE_INTERVAL_SECONDS"]
+    if _last_purge is not None and time.monotonic() - _last_purge < interval:
+        return
+    _last_purge = time.monotonic()
+    purge_expired_tokens()
@@ -9,7 +9,12 @@ from flask_jwt_extended import (
 
 from api.models import User
 from api.extensions import pwd_context, jwt, apispec
-from api.auth.helpers import revoke_token, is_token_revoked, add_token_to_database
+from api.auth.helpers import (
+    revoke_token,
+    is_token_revoked,
+    add_token_to_database,
+    load_user,
+)
 
 
 blueprint = Blueprint("auth", __name__, url_prefix="/auth")
@@ -174,7 +179,7 @@ def revoke_refresh_token():
 @jwt.user_lookup_loader
 def user_loader_callback(jwt_headers, jwt_payload):
     identity = jwt_payload["sub"]
-    return User.query.get(identity)
+    return load_user(identity)
 
 
 @jwt.token_in_blocklist_loader
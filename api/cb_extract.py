@@ -1,23 +1,54 @@
 """City Bike API extraction."""
+import datetime
 import typing
 
 from dateutil.parser import parse
 import click
 import country_converter
 import grequests
-from sqlalchemy import exc
+from flask import current_app
+from sqlalchemy import case, exc, null, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
 
 from api.extensions import db
 from api.models.site import Site
 
+from api import checkpoints
 from api import dlq
 from api import etl_utils
+from api.commons import geo
 
 
 class MakeSiteError(Exception):
     """Exception raised when site create/update fails."""
 
 
+# Dialects supporting `INSERT ... ON CONFLICT DO UPDATE`
+UPSERT_DIALECTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+# Columns overwritten when a station already exists, `admin_area` is kept
+UPSERT_COLUMNS = (
+    "city",
+    "country",
+    "latitude",
+    "longitude",
+    "name",
+    "timestamp",
+    "used",
+    "available",
+    "geohash",
+)
+
+# Columns compared to find changed stations, the geohash follows the coordinates
+CHANGE_COLUMNS = tuple(column for column in UPSERT_COLUMNS if column != "geohash")
+
+# Maximum number of site IDs per `IN` clause when reading stored sites
+STORED_QUERY_BATCH_SIZE = 500
+
+
 def load_master_site_urls(uri: str) -> typing.Generator[str, None, None]:
     """Load master site URLs.
 
@@ -38,11 +69,13 @@ def load_master_site_urls(uri: str) -> typing.Generator[str, None, None]:
         return master_sites
 
 
-def make_sites(response: typing.Any):
+def make_sites(response: typing.Any) -> typing.List[str]:
     """Make site data.
 
     Given a request response, create or update a Site model. Converts the
-    ISO 3166 alpha 2 country code to ISO 3166 alpha 3.
+    ISO 3166 alpha 2 country code to ISO 3166 alpha 3. Only new and changed
+    stations are written, see `changed_sites`. Returns the IDs of the sites
+    written.
     """
     data = response.json()
     network = data["network"]
@@ -53,43 +86,124 @@ def make_sites(response: typing.Any):
     country = country_converter.convert(names=[country_alpha2], to="ISO3")
     stations = network["stations"]
     click.echo(f"Processing site at {response.url}: {len(stations)} station(s)")
-    for station in stations:
-        try:
-            site = Site(
-                id=f"{network_id}-{station['id']}",
-                city=city,
-                country=country,
-                latitude=station["latitude"],
-                longitude=station["longitude"],
-                name=station["name"],
-                timestamp=parse(station["timestamp"]),
-                used=station["empty_slots"],
-                available=station["free_bikes"],
+    rows = [
+        dict(
+            id=f"{network_id}-{station['id']}",
+            city=city,
+            country=country,
+            latitude=station["latitude"],
+            longitude=station["longitude"],
+            name=station["name"],
+            timestamp=parse_timestamp(station["timestamp"]),
+            used=station["empty_slots"],
+            available=station["free_bikes"],
+            geohash=geo.encode(station["latitude"], station["longitude"]),
+        )
+        for station in stations
+    ]
+    try:
+        rows = changed_sites(rows)
+        click.echo(f"{len(rows)} new or changed station(s)")
+        if rows:
+            upsert_sites(rows, current_app.config.get("SITE_UPSERT_BATCH_SIZE"))
+    except exc.SQLAlchemyError as e:
+        db.session.rollback()
+        raise MakeSiteError(f"Failed to save site: {e}")
+    return [row["id"] for row in rows]
+
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    """Parse a station timestamp as naive UTC, as it is stored."""
+    timestamp = parse(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def changed_sites(rows: typing.List[dict]) -> typing.List[dict]:
+    """Changed sites.
+
+    Returns the rows of new stations and of stations whose `CHANGE_COLUMNS`
+    differ from the stored site, reading stored sites
+    `STORED_QUERY_BATCH_SIZE` at a time.
+    """
+    site = Site.__table__
+    columns = [site.c[column] for column in CHANGE_COLUMNS]
+    stored = {}
+    for batch in etl_utils.chunk(iter(rows), STORED_QUERY_BATCH_SIZE):
+        site_ids = [row["id"] for row in batch]
+        query = select(site.c.id, *columns).where(site.c.id.in_(site_ids))
+        stored.update((row[0], tuple(row[1:])) for row in db.session.execute(query))
+    return [
+        row
+        for row in rows
+        if stored.get(row["id"]) != tuple(row[column] for column in CHANGE_COLUMNS)
+    ]
+
+
+def upsert_sites(rows: typing.List[dict], batch_size: int = 500):
+    """Upsert sites.
+
+    Writes a network's stations in batches of `batch_size` rows using
+    `INSERT ... ON CONFLICT DO UPDATE`, committing once for the whole network.
+    Existing stations keep their admin area unless their coordinates moved,
+    in which case it is cleared for `cb_transform` to resolve again. Dialects
+    without upsert support fall back to updating each site through the ORM.
+    """
+    site = Site.__table__
+    insert = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is None:
+        for row in rows:
+            stored = db.session.get(Site, row["id"])
+            if stored is None:
+                db.session.add(Site(**row))
+                continue
+            moved = (stored.latitude, stored.longitude) != (
+                row["latitude"],
+                row["longitude"],
             )
-            db.session.merge(site)
-            db.session.commit()
-        except exc.SQLAlchemyError as e:
-            db.session.rollback()
-            raise MakeSiteError(f"Failed to save site: {e}")
+            if moved:
+                stored.admin_area = None
+            for column, value in row.items():
+                setattr(stored, column, value)
+        db.session.commit()
+        return
+    for batch in etl_utils.chunk(iter(rows), batch_size):
+        stmt = insert(site).values(list(batch))
+        moved = or_(
+            site.c.latitude != stmt.excluded.latitude,
+            site.c.longitude != stmt.excluded.longitude,
+        )
+        set_ = {column: stmt.excluded[column] for column in UPSERT_COLUMNS}
+        set_["admin_area"] = case((moved, null()), else_=site.c.admin_area)
+        stmt = stmt.on_conflict_do_update(index_elements=[site.c.id], set_=set_)
+        db.session.execute(stmt)
+    db.session.commit()
 
 
-def process(response: typing.Any):
+def process(response: typing.Any) -> typing.List[str]:
     """Process a site.
 
     Given a request response, make a Site. If response fails add url to
-    dead letter queue.
+    dead letter queue. Returns the IDs of the sites written, if any.
     """
     if response is None:
-        return
+        return []
     if not response.ok:
         click.echo(f"Bad response {response.status_code} for {response.url}")
-        dlq.add_to_dlq(response.url)
-        return
+        dlq.add_to_dlq(response.url, f"HTTP {response.status_code}")
+        checkpoints.mark_failed(response.url, f"HTTP {response.status_code}")
+        return []
     try:
-        make_sites(response)
+        site_ids = make_sites(response)
     except (MakeSiteError, KeyError) as e:
         click.echo(f"Error processing site at {response.url}: {e}")
-        dlq.add_to_dlq(response.url)
+        dlq.add_to_dlq(response.url, e)
+        checkpoints.mark_failed(response.url, repr(e))
+        return []
+    dlq.remove_from_dlq(response.url)
+    checkpoints.mark_fetched(response.url)
+    return site_ids
 
 
 def extract_sites(urls: list, timeout: float = 0.5):
@@ -1,55 +1,348 @@
 """City Bike data transformation."""
+import collections
+import concurrent.futures
+import itertools
+import multiprocessing
+import operator
+import typing
+
 import click
-from flask import current_app
-from shapely.geometry import shape, Point
+from flask import Flask, current_app
+from shapely.geometry import Point
+from sqlalchemy import bindparam, update
 
 from api.extensions import db
 from api.models.site import Site
 
 from api import dlq
-from api import gb_extract
+from api import etl_utils
+from api import gb_index
+from api import resolutions
+
+
+# Maximum number of site IDs per `IN` clause when selecting pending sites
+PENDING_QUERY_BATCH_SIZE = 500
+
+# Settings a transform worker needs to load geoboundary geometries
+TRANSFORM_WORKER_CONFIG = (
+    "GEO_BOUNDARIES_URI",
+    "ADMIN_AREA_LEVEL",
+    "ADMIN_AREA_MIN_LEVEL",
+    "ADMIN_AREA_SNAP_DISTANCE_METRES",
+    "ADMIN_AREA_CELL_PRECISION",
+    "ADMIN_AREA_CELL_CACHE_SIZE",
+    "GEOMETRY_CACHE_MAX_VERTICES",
+    "GEOBOUNDARY_STORE_DIR",
+    "GEOBOUNDARY_STORE_FORMAT",
+    "GEOBOUNDARY_STORE_MAX_AGE_SECONDS",
+    "GEOBOUNDARY_DECODE_CACHE_SIZE",
+)
 
 
 def process_admin_areas():
-    """Process admin area for all sites."""
+    """Process admin area for all sites.
+
+    If `TRANSFORM_BATCH_MODE` is set, sites are grouped by country and each
+    group is resolved in a single vectorised pass, otherwise sites are handled
+    one at a time. Either way sites are first resolved from stored
+    resolutions where possible, see `api.resolutions`.
+    """
     click.echo("Processing admin areas from Site data")
-    sites = Site.query.filter_by(admin_area=None).all()
+    if current_app.config.get("TRANSFORM_BATCH_MODE"):
+        process_admin_areas_batch()
+        return
+    sites = Site.query.filter_by(admin_area=None).order_by(Site.country).all()
     click.echo(f"{len(sites)} sites identified with no admin area")
-    for site in sites:
-        if not identify_admin_area(site):
-            dlq.add_to_no_admin_dlq(site.id)
+    with AdminAreaWriter() as writer:
+        unknown = {
+            row[0]
+            for row in resolutions.apply_known(
+                [(s.id, s.country, s.latitude, s.longitude) for s in sites], writer
+            )
+        }
+        sites = [site for site in sites if site.id in unknown]
+        unidentified = [
+            site.id for site in sites if not identify_admin_area(site, writer)
+        ]
+    dlq.add_many(dlq.NO_ADMIN_DEAD_LETTER_QUEUE, unidentified)
+    resolutions.remember(site.id for site in sites)
+    log_cell_cache_stats()
+
+
+def process_admin_areas_batch():
+    """Process admin area for all sites, a country at a time.
+
+    If `TRANSFORM_WORKERS` is greater than one the countries are resolved in
+    parallel, see `resolve_countries_parallel`.
+    """
+    rows = pending_sites_query().all()
+    click.echo(f"{len(rows)} sites identified with no admin area")
+    with AdminAreaWriter() as writer:
+        rows = resolutions.apply_known(rows, writer)
+        shards = [
+            (country, *zip(*((row[0], row[2], row[3]) for row in group)))
+            for country, group in itertools.groupby(rows, key=operator.itemgetter(1))
+        ]
+        workers = current_app.config.get("TRANSFORM_WORKERS")
+        if workers > 1 and len(shards) > 1:
+            results = resolve_countries_parallel(shards, workers)
+        else:
+            results = (resolve_country(*shard) for shard in shards)
+        for result in results:
+            unidentified = record_admin_areas(*result, writer)
+            writer.flush()
+            dlq.add_many(dlq.NO_ADMIN_DEAD_LETTER_QUEUE, unidentified)
+            resolutions.remember(result[1])
+    log_cell_cache_stats()
+
+
+def log_cell_cache_stats():
+    """Log the admin area cell cache stats of this process.
+
+    Worker processes of `resolve_countries_parallel` keep their own caches,
+    which are not counted.
+    """
+    stats = gb_index.CELL_CACHE.stats()
+    click.echo(
+        f"Admin area cell cache: {stats['hits']} hit(s), {stats['misses']} "
+        f"miss(es), hit rate {stats['hit_rate']:.0%}, {stats['entries']} cell(s)"
+    )
+
+
+def pending_sites_query():
+    """Query all sites with no admin area.
+
+    Only the columns needed for the lookup are selected, so no ORM objects are
+    built for pending sites, and they are read in country order from the
+    partial `ix_site_unresolved` index.
+    """
+    return (
+        db.session.query(Site.id, Site.country, Site.latitude, Site.longitude)
+        .filter(Site.admin_area.is_(None))
+        .order_by(Site.country)
+    )
+
+
+def select_pending(site_ids: typing.Sequence[str]) -> typing.List[tuple]:
+    """Select pending sites.
+
+    Given site IDs, returns `(id, country, latitude, longitude)` rows for those
+    that have no admin area, ordered by country.
+    """
+    rows = []
+    for batch in etl_utils.chunk(iter(site_ids), PENDING_QUERY_BATCH_SIZE):
+        rows.extend(
+            db.session.query(Site.id, Site.country, Site.latitude, Site.longitude)
+            .filter(Site.id.in_(list(batch)), Site.admin_area.is_(None))
+            .all()
+        )
+    return sorted(rows, key=operator.itemgetter(1))
+
+
+def process_pending(rows: typing.Sequence[tuple], writer: "AdminAreaWriter"):
+    """Process admin areas for `(id, country, latitude, longitude)` rows.
+
+    Rows must be ordered by country. Results are queued on `writer`, which is
+    flushed at the end of each country.
+    """
+    rows = resolutions.apply_known(rows, writer)
+    for country, group in itertools.groupby(rows, key=operator.itemgetter(1)):
+        site_ids, latitudes, longitudes = zip(*((r[0], r[2], r[3]) for r in group))
+        result = resolve_country(country, site_ids, latitudes, longitudes)
+        unidentified = record_admin_areas(*result, writer)
+        writer.flush()
+        dlq.add_many(dlq.NO_ADMIN_DEAD_LETTER_QUEUE, unidentified)
+        resolutions.remember(site_ids)
+
 
+def resolve_country(
+    country: str,
+    site_ids: typing.Sequence[str],
+    latitudes: typing.Sequence[float],
+    longitudes: typing.Sequence[float],
+) -> typing.Tuple[
+    str,
+    typing.Sequence[str],
+    typing.List[typing.Optional[str]],
+    typing.List[typing.Optional[str]],
+]:
+    """Resolve admin areas for a country's sites.
 
-def update_site_admin_area(site: Site, shape_id: str):
-    """Save identified shape ID as Site admin area."""
-    site.admin_area = shape_id
-    db.session.merge(site)
+    Resolves every coordinate against the country's levelled spatial index,
+    one vectorised pass per admin level. Returns `(country, site_ids,
+    shape_ids, admin_levels)` where a shape ID and its level are `None` if no
+    admin area contains the site. Does not touch the database, so it can run
+    in a worker process.
+    """
+    click.echo(f"Identifying admin areas for {len(site_ids)} site(s) in {country}")
+    index = gb_index.get_levelled_index(country)
+    shape_ids, admin_levels = index.lookup_many(latitudes, longitudes)
+    return country, site_ids, list(shape_ids), list(admin_levels)
+
+
+def resolve_countries_parallel(
+    shards: typing.Sequence[tuple], workers: int
+) -> typing.Iterator[tuple]:
+    """Resolve admin areas for several countries across worker processes.
+
+    Each shard is a `resolve_country` argument tuple. Shards are submitted
+    largest first so a big country is not left running alone at the end, and
+    results are yielded as they complete. Every worker loads and indexes its
+    own geoboundary geometries; only the parent writes to the database.
+
+    Workers are spawned rather than forked: grequests monkeypatches the parent
+    with gevent, which breaks the executor's management thread in a fork.
+    `_init_transform_worker` gives them everything they need.
+    """
+    click.echo(f"Resolving {len(shards)} countries with {workers} workers")
+    shards = sorted(shards, key=lambda shard: len(shard[1]), reverse=True)
+    config = {key: current_app.config.get(key) for key in TRANSFORM_WORKER_CONFIG}
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_transform_worker,
+        initargs=(config,),
+    ) as executor:
+        futures = [executor.submit(resolve_country, *shard) for shard in shards]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def _init_transform_worker(config: dict):
+    """Give a transform worker process an app context carrying `config`."""
+    app = Flask("api")
+    app.config.update(config)
+    app.app_context().push()
+
+
+def record_admin_areas(
+    country: str,
+    site_ids: typing.Sequence[str],
+    shape_ids: typing.Sequence[typing.Optional[str]],
+    admin_levels: typing.Sequence[typing.Optional[str]],
+    writer: "AdminAreaWriter",
+) -> typing.List[str]:
+    """Record resolved admin areas for a country's sites.
+
+    Queues each site's shape ID and the admin level it was found at on
+    `writer`, or `NO_ADMIN_AREA` if none was found. Returns the IDs of sites
+    whose admin area could not be established, which are marked for
+    reprocessing.
+    """
+    no_admin_area = current_app.config.get("NO_ADMIN_AREA")
+    unidentified = []
+    for site_id, shape_id, admin_level in zip(site_ids, shape_ids, admin_levels):
+        if shape_id is None:
+            unidentified.append(site_id)
+        writer.add(site_id, shape_id or no_admin_area, admin_level)
+    by_level = collections.Counter(filter(None, admin_levels))
+    click.echo(
+        f"Identified admin areas in {country}: "
+        f"{len(site_ids) - len(unidentified)}/{len(site_ids)} "
+        + " ".join(f"{level}={count}" for level, count in sorted(by_level.items()))
+    )
+    return unidentified
+
+
+def save_admin_areas(
+    admin_areas: typing.Sequence[typing.Tuple[str, str, typing.Optional[str]]]
+):
+    """Save `(site_id, shape_id, admin_level)` rows with one executemany UPDATE."""
+    if not admin_areas:
+        return
+    db.session.execute(
+        update(Site.__table__)
+        .where(Site.__table__.c.id == bindparam("site_id"))
+        .values(
+            admin_area=bindparam("shape_id"), admin_level=bindparam("admin_level")
+        ),
+        [
+            {"site_id": site_id, "shape_id": shape_id, "admin_level": admin_level}
+            for site_id, shape_id, admin_level in admin_areas
+        ],
+    )
     db.session.commit()
 
 
+class AdminAreaWriter:
+    """Buffered admin area writer.
+
+    Collects resolved `(site_id, shape_id, admin_level)` rows, including
+    `NO_ADMIN_AREA` markers, and saves them in a single transaction every
+    `flush_size` rows (`ADMIN_AREA_FLUSH_SIZE` by default). Used as a context
+    manager, anything still pending is saved on exit.
+    """
+
+    def __init__(self, flush_size: typing.Optional[int] = None):
+        self.flush_size = flush_size or current_app.config.get(
+            "ADMIN_AREA_FLUSH_SIZE"
+        )
+        self.pending = []
+
+    def __enter__(self) -> "AdminAreaWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(
+        self, site_id: str, shape_id: str, admin_level: typing.Optional[str] = None
+    ):
+        """Queue an admin area, flushing once `flush_size` rows are pending."""
+        self.pending.append((site_id, shape_id, admin_level))
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Save all pending admin areas."""
+        save_admin_areas(self.pending)
+        self.pending = []
+
+
+def update_site_admin_area(
+    site: Site, shape_id: str, admin_level: typing.Optional[str] = None
+):
+    """Save identified shape ID as Site admin area.
+
+    Written with a single Core update; the instance's columns are expired
+    rather than set, so committing does not update the row a second time.
+    """
+    save_admin_areas([(site.id, shape_id, admin_level)])
+    db.session.expire(site, ["admin_area", "admin_level"])
+
+
 def poly_check(latitude: float, longitude: float, area: str) -> bool:
     """Check if a coordinate is within an area."""
     point = Point([longitude, latitude])  # Notice reverse Lat/Long order
     return point.within(area)
 
 
-def identify_admin_area(site: Site) -> bool:
+def identify_admin_area(
+    site: Site, writer: typing.Optional[AdminAreaWriter] = None
+) -> bool:
     """Identify admin area.
 
-    Iterates over extracted geoboundary features, builds a `shape` from the
-    feature geometry and checks if sites coords are within the feature area.
+    Queries the country's spatial indexes of geoboundary features, finest
+    admin level first, so only the features whose bounding box contains the
+    site's coords are checked.
     Mark sites whose admin area could not be established to enable reprocessing.
+    If a `writer` is given the result is queued on it, otherwise it is saved
+    immediately.
     """
     click.echo(f"Identifying admin area for Site: {site.id}")
-    features = gb_extract.load_geoboundary_data(site.country)
-    for feature in features:
-        shape_id = feature["properties"]["shapeID"]
-        area = shape(feature["geometry"])
-        if not poly_check(site.latitude, site.longitude, area):
-            continue
-        update_site_admin_area(site, shape_id)
-        click.echo(f"Identified admin area for Site {site.id}: {shape_id}")
-        return True
-    # Unable to identify admin area, annotate accordingly
-    update_site_admin_area(site, current_app.config.get("NO_ADMIN_AREA"))
-    return False
+    index = gb_index.get_levelled_index(site.country)
+    shape_id, admin_level = index.lookup(site.latitude, site.longitude)
+    identified = shape_id is not None
+    if identified:
+        click.echo(
+            f"Identified {admin_level} admin area for Site {site.id}: {shape_id}"
+        )
+    else:
+        # Unable to identify admin area, annotate accordingly
+        shape_id = current_app.config.get("NO_ADMIN_AREA")
+    if writer is None:
+        update_site_admin_area(site, shape_id, admin_level)
+    else:
+        writer.add(site.id, shape_id, admin_level)
+    return identified
@@ -0,0 +1,119 @@
+"""Load checkpoints.
+
+Records the progress of each network URL through a `load_sites` run in the
+`load_checkpoint` table, so a run that stopped halfway can be resumed
+(`load_sites --resume`) rather than started over.
+
+- pending: not processed yet.
+- fetched: stations loaded, admin areas not resolved yet.
+- transformed: done.
+- failed: the last attempt failed, see `last_error`. Retried on resume.
+
+Statuses are only recorded while a run is `recording`, so extraction used
+outside `load_sites` leaves the table alone.
+"""
+import contextlib
+import datetime
+import threading
+import typing
+
+import click
+from sqlalchemy import delete, func, insert, select, update
+
+from api.extensions import db
+from api.models import LoadCheckpoint
+
+PENDING = "pending"
+FETCHED = "fetched"
+TRANSFORMED = "transformed"
+FAILED = "failed"
+
+_recording = threading.Event()
+
+
+@contextlib.contextmanager
+def recording():
+    """Record checkpoints for the duration of the block."""
+    _recording.set()
+    try:
+        yield
+    finally:
+        _recording.clear()
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+def start_run(urls: typing.Iterable[str]) -> typing.List[str]:
+    """Start a new run over `urls`, discarding the previous run's checkpoints."""
+    table = LoadCheckpoint.__table__
+    urls = list(dict.fromkeys(urls))
+    db.session.execute(delete(table))
+    if urls:
+        now = _now()
+        db.session.execute(
+            insert(table),
+            [dict(url=url, status=PENDING, attempts=0, updated=now) for url in urls],
+        )
+    db.session.commit()
+    return urls
+
+
+def summary() -> typing.Dict[str, int]:
+    """Count checkpoints by status."""
+    table = LoadCheckpoint.__table__
+    query = select(table.c.status, func.count()).group_by(table.c.status)
+    return dict(db.session.execute(query).all())
+
+
+def resumable_urls() -> typing.List[str]:
+    """URLs still to fetch: pending ones and failed ones."""
+    table = LoadCheckpoint.__table__
+    query = (
+        select(table.c.url)
+        .where(table.c.status.in_((PENDING, FAILED)))
+        .order_by(table.c.url)
+    )
+    return list(db.session.execute(query).scalars())
+
+
+def _update(url: str, **values):
+    table = LoadCheckpoint.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.url == url)
+        .values(attempts=table.c.attempts + 1, updated=_now(), **values)
+    )
+    db.session.commit()
+
+
+def mark_fetched(url: str):
+    """Record that a URL's stations were loaded."""
+    if _recording.is_set():
+        _update(url, status=FETCHED, last_error=None)
+
+
+def mark_failed(url: str, error: typing.Any):
+    """Record that processing a URL failed."""
+    if _recording.is_set():
+        _update(url, status=FAILED, last_error=str(error))
+
+
+def mark_transformed():
+    """Record that the admin areas of every fetched URL's stations are resolved."""
+    if not _recording.is_set():
+        return
+    table = LoadCheckpoint.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.status == FETCHED)
+        .values(status=TRANSFORMED, updated=_now())
+    )
+    db.session.commit()
+
+
+def log_summary():
+    """Log checkpoint counts by status."""
+    counts = ", ".join(f"{status}={count}" for status, count in summary().items())
+    click.echo(f"Load checkpoints: {counts or 'none'}")
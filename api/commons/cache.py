@@ -0,0 +1,200 @@
+"""Response cache for read-only API endpoints
+
+Cached responses are keyed by endpoint, normalized query args and the current
+generation of the data they are built from. Bumping the generation (e.g. at
+the end of `flask api load_sites`) makes every older entry unreachable, so no
+explicit invalidation is needed; stale entries simply age out of the backend.
+
+Responses carry a strong `ETag` and a `Last-Modified` date, and conditional
+requests are answered with `304 Not Modified`.
+
+`TTLCache` is a small in process cache whose entries expire, used where the
+source of truth may change behind the cache's back (e.g. auth lookups).
+"""
+
+import collections
+import functools
+import hashlib
+import threading
+import time
+
+from flask import Response, request
+from werkzeug.utils import import_string
+
+
+class CacheBackend:
+    """Cache backend interface."""
+
+    def get(self, key):
+        """Get a cached value, `None` if missing."""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Cache a value."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all cached values."""
+        raise NotImplementedError
+
+
+class NullCacheBackend(CacheBackend):
+    """Backend caching nothing."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCacheBackend(CacheBackend):
+    """In process LRU backend holding at most `max_entries` values."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class TTLCache:
+    """In process LRU cache of at most `max_entries` values, each with a TTL.
+
+    `get` misses on values older than their TTL. A TTL of zero (or less)
+    disables caching, `set` is then a no-op.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._values = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        with self._lock:
+            expires, value = self._values.get(key, (0, self._MISSING))
+            if value is self._MISSING:
+                return default
+            if expires <= time.monotonic():
+                del self._values[key]
+                return default
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+CachedResponse = collections.namedtuple(
+    "CachedResponse", ["body", "mimetype", "etag", "last_modified"]
+)
+
+
+def cache_key(generation):
+    """Build a cache key from the request endpoint and normalized args."""
+    args = sorted(request.args.items(multi=True))
+    return (request.endpoint, generation.name, generation.value, tuple(args))
+
+
+class ResponseCache:
+    """Very simple response cache extension.
+
+    `RESPONSE_CACHE_BACKEND` is `lru` (default), `null`, or the import path
+    of a `CacheBackend` subclass. Backends are built with no arguments, except
+    the LRU backend which takes `RESPONSE_CACHE_MAX_ENTRIES`.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("RESPONSE_CACHE_BACKEND", "lru")
+        app.config.setdefault("RESPONSE_CACHE_MAX_ENTRIES", 1024)
+
+        backend = app.config["RESPONSE_CACHE_BACKEND"]
+        if backend == "lru":
+            self.backend = LRUCacheBackend(app.config["RESPONSE_CACHE_MAX_ENTRIES"])
+        elif backend == "null":
+            self.backend = NullCacheBackend()
+        else:
+            self.backend = import_string(backend)()
+
+    def cached(self, generation_name):
+        """Cache a view's successful responses for a data generation."""
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                from api.models import DataGeneration
+
+                generation = DataGeneration.current(generation_name)
+                key = cache_key(generation)
+                cached = self.backend.get(key)
+                if cached is None:
+                    response = view(*args, **kwargs)
+                    if (
+                        not isinstance(response, Response)
+                        or response.status_code != 200
+                    ):
+                        return response
+                    body = response.get_data()
+                    cached = CachedResponse(
+                        body,
+                        response.mimetype,
+                        hashlib.sha256(body).hexdigest(),
+                        generation.updated,
+                    )
+                    self.backend.set(key, cached)
+                response = Response(cached.body, mimetype=cached.mimetype)
+                response.set_etag(cached.etag)
+                response.last_modified = cached.last_modified
+                return response.make_conditional(request)
+
+            return wrapper
+
+        return decorator
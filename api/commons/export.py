@@ -0,0 +1,63 @@
+"""Simple helpers to stream query results as NDJSON or CSV
+"""
+import csv
+import io
+
+from flask import Response, stream_with_context
+from marshmallow import ValidationError
+
+from api.commons.serialization import RowSerializer, dumps
+
+DEFAULT_EXPORT_BATCH_SIZE = 1000
+
+
+def iter_rows(query, batch_size=DEFAULT_EXPORT_BATCH_SIZE):
+    """Iterate over a column query's rows as dicts, `batch_size` rows at a time.
+
+    Rows are fetched with `yield_per`, so only one batch is held in memory.
+    """
+    row_to_dict = RowSerializer.for_query(query).row_to_dict
+    for row in query.yield_per(batch_size):
+        yield row_to_dict(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield dumps(row) + b"\n"
+
+
+def csv_lines(rows, fieldnames):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def stream_export(query, export_format, batch_size=DEFAULT_EXPORT_BATCH_SIZE):
+    """Stream a column query as a NDJSON or CSV response.
+
+    Rows are written to the response as they are fetched, so memory stays flat
+    whatever the size of the result.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValidationError(
+            {"format": [f"Must be one of: {', '.join(EXPORT_FORMATS)}."]}
+        )
+    rows = iter_rows(query, batch_size)
+    if export_format == "csv":
+        fieldnames = [column["name"] for column in query.column_descriptions]
+        lines = csv_lines(rows, fieldnames)
+    else:
+        lines = ndjson_lines(rows)
+    return Response(stream_with_context(lines), mimetype=EXPORT_FORMATS[export_format])
@@ -0,0 +1,148 @@
+"""Geohash and great circle helpers for spatial site queries
+
+Sites store the geohash of their coordinates in an indexed column. A bounding
+box is covered by a handful of geohash cells, each cell a contiguous range of
+the index, so a spatial filter is a few index range scans, refined exactly on
+latitude/longitude (and great circle distance for radius queries).
+"""
+import math
+import sqlite3
+
+from sqlalchemy import and_, event, func, or_
+from sqlalchemy.engine import Engine
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+# One past the last base32 character, bounds a geohash prefix range. Relies on
+# byte order, the geohash column is collated "C" on PostgreSQL
+_PREFIX_END = "{"
+GEOHASH_PRECISION = 9
+MAX_COVER_CELLS = 32
+EARTH_RADIUS_KM = 6371.0088
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Geohash a coordinate to `precision` characters."""
+    ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+    values = (longitude, latitude)
+    chars = []
+    bit = 0
+    while len(chars) < precision:
+        char = 0
+        for _ in range(5):
+            low, high = ranges[bit % 2]
+            mid = (low + high) / 2
+            if values[bit % 2] >= mid:
+                char = char << 1 | 1
+                ranges[bit % 2][0] = mid
+            else:
+                char = char << 1
+                ranges[bit % 2][1] = mid
+            bit += 1
+        chars.append(BASE32[char])
+    return "".join(chars)
+
+
+def cell_size(precision):
+    """Return the `(height, width)` in degrees of geohash cells."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _cells(low, high, origin, size):
+    count = round(-2 * origin / size)
+    first = int((low - origin) // size)
+    last = min(int((high - origin) // size), count - 1)
+    return range(first, last + 1)
+
+
+def cover(min_lat, min_lon, max_lat, max_lon, max_cells=MAX_COVER_CELLS):
+    """Geohash cells covering a bounding box.
+
+    Returns the cells at the finest precision needing at most `max_cells`
+    cells. The box must not cross the antimeridian, see `split_bbox`.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = _cells(min_lat, max_lat, -90.0, height)
+        columns = _cells(min_lon, max_lon, -180.0, width)
+        if len(rows) * len(columns) <= max_cells or precision == 1:
+            break
+    return sorted(
+        {
+            encode(-90.0 + (i + 0.5) * height, -180.0 + (j + 0.5) * width, precision)
+            for i in rows
+            for j in columns
+        }
+    )
+
+
+def split_bbox(min_lat, min_lon, max_lat, max_lon):
+    """Split a bounding box crossing the antimeridian (`min_lon > max_lon`)."""
+    if min_lon > max_lon:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def bbox_around(latitude, longitude, radius_km):
+    """Bounding boxes containing every point within `radius_km` of a coordinate."""
+    angle = radius_km / EARTH_RADIUS_KM
+    min_lat = max(latitude - math.degrees(angle), -90.0)
+    max_lat = min(latitude + math.degrees(angle), 90.0)
+    cos_lat = math.cos(math.radians(latitude))
+    if min_lat == -90.0 or max_lat == 90.0 or math.sin(angle) >= cos_lat:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    delta = math.degrees(math.asin(math.sin(angle) / cos_lat))
+    min_lon = (longitude - delta + 180.0) % 360.0 - 180.0
+    max_lon = (longitude + delta + 180.0) % 360.0 - 180.0
+    return split_bbox(min_lat, min_lon, max_lat, max_lon)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great circle distance in km between two coordinates."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bbox_filter(model, boxes):
+    """Filter `model` rows within bounding boxes.
+
+    Each covering geohash cell becomes an index range on `model.geohash`,
+    refined on `model.latitude` and `model.longitude`.
+    """
+    terms = []
+    for min_lat, min_lon, max_lat, max_lon in boxes:
+        for cell in cover(min_lat, min_lon, max_lat, max_lon):
+            terms.append(
+                and_(
+                    model.geohash >= cell,
+                    model.geohash < cell + _PREFIX_END,
+                    model.latitude.between(min_lat, max_lat),
+                    model.longitude.between(min_lon, max_lon),
+                )
+            )
+    return or_(*terms)
+
+
+def radius_filter(model, latitude, longitude, radius_km):
+    """Filter `model` rows within `radius_km` of a coordinate."""
+    distance = func.haversine_km(model.latitude, model.longitude, latitude, longitude)
+    return and_(
+        bbox_filter(model, bbox_around(latitude, longitude, radius_km)),
+        distance <= radius_km,
+    )
+
+
+@event.listens_for(Engine, "connect")
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """Register `haversine_km` on SQLite connections.
+
+    On PostgreSQL the function is created by a migration.
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            "haversine_km", 4, haversine_km, deterministic=True
+        )
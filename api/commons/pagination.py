@@ -1,6 +1,10 @@
 """Simple helper to paginate query
 """
+import base64
+import json
+
 from flask import url_for, request
+from marshmallow import ValidationError
 
 DEFAULT_PAGE_SIZE = 50
 DEFAULT_PAGE_NUMBER = 1
@@ -37,3 +41,61 @@ def paginate(query, schema):
         "prev": prev,
         "results": schema.dump(page_obj.items),
     }
+
+
+def encode_cursor(last_id):
+    """Encode the last seen key as an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(last_id).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor to the last seen string key.
+
+    An empty cursor starts from the first row.
+    """
+    if not cursor:
+        return None
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        value = None
+    if not isinstance(value, str):
+        raise ValidationError({"cursor": ["Invalid cursor."]})
+    return value
+
+
+def paginate_cursor(query, schema, key):
+    """Paginate a query by keyset on a unique, ordered `key` column.
+
+    Pages are read with `WHERE key > :last ORDER BY key LIMIT n`, so every page
+    costs the same however deep. The total count can be skipped with
+    `?count=false`, leaving `total` null. `next` is null on the last page.
+    """
+    _, per_page, other_request_args = extract_pagination(**request.args)
+    if per_page < 1:
+        raise ValidationError({"per_page": ["Must be a positive integer."]})
+    cursor = decode_cursor(other_request_args.pop("cursor", None))
+    count = other_request_args.pop("count", "true").lower() != "false"
+
+    total = query.order_by(None).count() if count else None
+    if cursor is not None:
+        query = query.filter(key > cursor)
+    items = query.order_by(key).limit(per_page + 1).all()
+
+    next_ = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_ = url_for(
+            request.endpoint,
+            cursor=encode_cursor(getattr(items[-1], key.key)),
+            per_page=per_page,
+            count=str(count).lower(),
+            **other_request_args,
+            **request.view_args
+        )
+
+    return {
+        "total": total,
+        "next": next_,
+        "results": schema.dump(items),
+    }
@@ -18,10 +18,53 @@ GEO_BOUNDARIES_URI = os.getenv(
     "APP_GEO_BOUNDARIES_URI", "https://www.geoboundaries.org/gbRequest.html"
 )
 ADMIN_AREA_LEVEL = os.getenv("APP_ADMIN_AREA_LEVEL", "ADM3")
+# Coarsest admin level sites fall back to, ADM0 being the country itself
+ADMIN_AREA_MIN_LEVEL = os.getenv("APP_ADMIN_AREA_MIN_LEVEL", "ADM0")
+ADMIN_AREA_SNAP_DISTANCE_METRES = float(
+    os.getenv("APP_ADMIN_AREA_SNAP_DISTANCE_METRES", 0)
+)
+# Geohash precision of memoized admin area lookups, 7 is about 150m square.
+# Off (0) by default: stations rarely share a cell within a run, and resolved
+# coordinates are already persisted as admin area resolutions.
+ADMIN_AREA_CELL_PRECISION = int(os.getenv("APP_ADMIN_AREA_CELL_PRECISION", 0))
+ADMIN_AREA_CELL_CACHE_SIZE = int(
+    os.getenv("APP_ADMIN_AREA_CELL_CACHE_SIZE", 100000)
+)
 NO_ADMIN_AREA = os.getenv("APP_NO_ADMIN_AREA", "NO-ADMIN")
 SITE_CHUNK_SIZE = int(os.getenv("APP_SITE_CHUNK_SIZE", 10))
+SITE_UPSERT_BATCH_SIZE = int(os.getenv("APP_SITE_UPSERT_BATCH_SIZE", 500))
+TOKEN_BLOCKLIST_CACHE_TTL_SECONDS = float(
+    os.getenv("APP_TOKEN_BLOCKLIST_CACHE_TTL_SECONDS", 60)
+)
+USER_CACHE_TTL_SECONDS = float(os.getenv("APP_USER_CACHE_TTL_SECONDS", 60))
+TOKEN_PURGE_INTERVAL_SECONDS = float(
+    os.getenv("APP_TOKEN_PURGE_INTERVAL_SECONDS", 3600)
+)
+RESPONSE_CACHE_BACKEND = os.getenv("APP_RESPONSE_CACHE_BACKEND", "lru")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("APP_RESPONSE_CACHE_MAX_ENTRIES", 1024))
+EXPORT_BATCH_SIZE = int(os.getenv("APP_EXPORT_BATCH_SIZE", 1000))
 RESPONSE_TIMEOUT_SECONDS = float(os.getenv("APP_RESPONSE_TIMEOUT_SECONDS", 0.5))
 PROCESSING_RETRY_COUNT = int(os.getenv("APP_PROCESSING_RETRY_COUNT", 3))
+DLQ_RETRY_BASE_SECONDS = float(os.getenv("APP_DLQ_RETRY_BASE_SECONDS", 60))
+DLQ_RETRY_MAX_SECONDS = float(os.getenv("APP_DLQ_RETRY_MAX_SECONDS", 6 * 60 * 60))
+DLQ_RETRY_BATCH_SIZE = int(os.getenv("APP_DLQ_RETRY_BATCH_SIZE", 50))
+EXTRACT_ENGINE = os.getenv("APP_EXTRACT_ENGINE", "grequests")
+EXTRACT_CONCURRENCY = int(os.getenv("APP_EXTRACT_CONCURRENCY", 20))
+EXTRACT_RATE_PER_HOST = float(os.getenv("APP_EXTRACT_RATE_PER_HOST", 10))
+EXTRACT_MAX_RETRIES = int(os.getenv("APP_EXTRACT_MAX_RETRIES", 3))
+PIPELINE_QUEUE_SIZE = int(os.getenv("APP_PIPELINE_QUEUE_SIZE", 8))
+TRANSFORM_BATCH_MODE = os.getenv("APP_TRANSFORM_BATCH_MODE", "true").lower() == "true"
+TRANSFORM_WORKERS = int(os.getenv("APP_TRANSFORM_WORKERS", 0))
+ADMIN_AREA_FLUSH_SIZE = int(os.getenv("APP_ADMIN_AREA_FLUSH_SIZE", 1000))
+GEOMETRY_CACHE_MAX_VERTICES = int(
+    os.getenv("APP_GEOMETRY_CACHE_MAX_VERTICES", 5_000_000)
+)
+GEOBOUNDARY_STORE_DIR = os.getenv("APP_GEOBOUNDARY_STORE_DIR", "data")
+GEOBOUNDARY_STORE_FORMAT = os.getenv("APP_GEOBOUNDARY_STORE_FORMAT", "mmap")
+GEOBOUNDARY_DECODE_CACHE_SIZE = int(os.getenv("APP_GEOBOUNDARY_DECODE_CACHE_SIZE", 256))
+GEOBOUNDARY_STORE_MAX_AGE_SECONDS = int(
+    os.getenv("APP_GEOBOUNDARY_STORE_MAX_AGE_SECONDS", 30 * 24 * 60 * 60)
+)
 
 # Uncomment to enable ?jwt=TOKEN query string
 # JWT_TOKEN_LOCATION = ["headers", "query_string"]
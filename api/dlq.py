@@ -2,49 +2,226 @@
 
 - DEAD_LETTER_QUEUE: unprocessed URLs
 - NO_ADMIN_DEAD_LETTER_QUEUE: Untransformed Site ids.
+
+Queues are stored in the `dead_letter` table so they survive restarts. Each
+item records its attempt count, the class of its last error and when it is
+next eligible for a retry. Retries back off exponentially from
+`DLQ_RETRY_BASE_SECONDS` up to `DLQ_RETRY_MAX_SECONDS`, with jitter so
+retries of a throttled host are spread out. Items are retried at most
+`PROCESSING_RETRY_COUNT` times, see `flask api retry_dlq`.
 """
-import queue
+import datetime
+import random
 import typing
 
 import click
+from flask import current_app
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from api.extensions import db
+from api.models import DeadLetter
+
+
+DEAD_LETTER_QUEUE = "urls"
+NO_ADMIN_DEAD_LETTER_QUEUE = "no_admin"
+
+# Maximum number of items per `IN` clause, and of rows per upsert
+QUERY_BATCH_SIZE = 500
+
+UPSERT_DIALECTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+UPDATE_COLUMNS = ("attempts", "error_class", "last_error", "next_attempt", "updated")
+ERROR_COLUMNS = ("error_class", "last_error")
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
 
+def backoff_seconds(
+    attempts: int, base: float, cap: float, rng: random.Random = random
+) -> float:
+    """Delay before retrying an item that failed `attempts` times.
 
-DEAD_LETTER_QUEUE = queue.Queue()
-NO_ADMIN_DEAD_LETTER_QUEUE = queue.Queue()
+    Doubles with every attempt up to `cap`, half of it being random jitter.
+    """
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return delay / 2 + rng.uniform(0, delay / 2)
 
 
-def add_to_dlq(url: str):
+def _batches(values: typing.List) -> typing.Iterator[typing.List]:
+    for start in range(0, len(values), QUERY_BATCH_SIZE):
+        end = start + QUERY_BATCH_SIZE
+        yield values[start:end]
+
+
+def add(queue: str, item: str, error: typing.Any = None):
+    """Add an item to a queue, or count another failed attempt if queued."""
+    add_many(queue, [item], error)
+
+
+def add_many(queue: str, items: typing.Iterable[str], error: typing.Any = None):
+    """Add items to a queue, counting another failed attempt for queued ones.
+
+    Reads the queued items with one select per `QUERY_BATCH_SIZE` items and
+    writes them all with one upsert per batch, committing once.
+    """
+    items = list(dict.fromkeys(items))
+    if not items:
+        return
+    table = DeadLetter.__table__
+    attempts = {}
+    for batch in _batches(items):
+        query = select(table.c.item, table.c.attempts).where(
+            table.c.queue == queue, table.c.item.in_(batch)
+        )
+        attempts.update(db.session.execute(query).all())
+    now = _now()
+    base = current_app.config["DLQ_RETRY_BASE_SECONDS"]
+    cap = current_app.config["DLQ_RETRY_MAX_SECONDS"]
+    error_class = last_error = None
+    if error is not None:
+        error_class = error if isinstance(error, str) else type(error).__name__
+        last_error = str(error)
+    rows = []
+    for item in items:
+        count = attempts.get(item, 0) + 1
+        rows.append(
+            dict(
+                queue=queue,
+                item=item,
+                attempts=count,
+                error_class=error_class,
+                last_error=last_error,
+                next_attempt=now
+                + datetime.timedelta(seconds=backoff_seconds(count, base, cap)),
+                created=now,
+                updated=now,
+            )
+        )
+    insert = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is None:
+        for row in rows:
+            letter = db.session.get(DeadLetter, (queue, row["item"]))
+            if letter is None:
+                db.session.add(DeadLetter(**row))
+                continue
+            for column in UPDATE_COLUMNS:
+                if row[column] is not None or column not in ERROR_COLUMNS:
+                    setattr(letter, column, row[column])
+        db.session.commit()
+        return
+    for batch in _batches(rows):
+        stmt = insert(table).values(batch)
+        set_ = {column: stmt.excluded[column] for column in UPDATE_COLUMNS}
+        for column in ERROR_COLUMNS:
+            # Keep the last known error when failing without one
+            set_[column] = func.coalesce(stmt.excluded[column], table.c[column])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.queue, table.c.item], set_=set_
+        )
+        db.session.execute(stmt)
+    db.session.commit()
+
+
+def remove(queue: str, items: typing.Iterable[str]):
+    """Remove items from a queue."""
+    items = list(items)
+    if not items:
+        return
+    table = DeadLetter.__table__
+    db.session.execute(
+        delete(table).where(table.c.queue == queue, table.c.item.in_(items))
+    )
+    db.session.commit()
+
+
+def add_to_dlq(url: str, error: typing.Any = None):
     """Add item to DEAD_LETTER_QUEUE."""
     click.echo(f"Adding url to dead letter queue: {url}")
-    DEAD_LETTER_QUEUE.put(url)
+    add(DEAD_LETTER_QUEUE, url, error)
 
 
-def add_to_no_admin_dlq(site_id: str):
+def add_to_no_admin_dlq(site_id: str, error: typing.Any = None):
     """Add item to NO_ADMIN_DEAD_LETTER_QUEUE."""
     click.echo(f"Adding site to admin dead letter queue: {site_id}")
-    NO_ADMIN_DEAD_LETTER_QUEUE.put(site_id)
+    add(NO_ADMIN_DEAD_LETTER_QUEUE, site_id, error)
+
+
+def remove_from_dlq(url: str):
+    """Remove a processed URL from DEAD_LETTER_QUEUE, if queued.
+
+    URLs that were never queued cost a primary key lookup, without a write.
+    """
+    if db.session.get(DeadLetter, (DEAD_LETTER_QUEUE, url)) is not None:
+        remove(DEAD_LETTER_QUEUE, [url])
+
 
+def _eligible(queue: str):
+    table = DeadLetter.__table__
+    return (
+        table.c.queue == queue,
+        table.c.attempts <= current_app.config["PROCESSING_RETRY_COUNT"],
+    )
+
+
+def due(
+    queue: str,
+    limit: typing.Optional[int] = None,
+    exclude: typing.Collection[str] = (),
+    now: typing.Optional[datetime.datetime] = None,
+) -> typing.List[str]:
+    """Items of a queue eligible for a retry now, soonest due first."""
+    table = DeadLetter.__table__
+    query = (
+        select(table.c.item)
+        .where(*_eligible(queue), table.c.next_attempt <= (now or _now()))
+        .order_by(table.c.next_attempt)
+    )
+    if exclude:
+        query = query.where(table.c.item.notin_(list(exclude)))
+    if limit is not None:
+        query = query.limit(limit)
+    return list(db.session.execute(query).scalars())
 
-def unload_dlq(dlq: queue.Queue) -> typing.Generator[str, None, None]:
+
+def next_due(queue: str) -> typing.Optional[datetime.datetime]:
+    """When the next retry of a queue is due, `None` if none is left."""
+    table = DeadLetter.__table__
+    query = select(func.min(table.c.next_attempt)).where(*_eligible(queue))
+    return db.session.execute(query).scalar()
+
+
+def items(queue: str) -> typing.List[DeadLetter]:
+    """All items of a queue."""
+    return DeadLetter.query.filter_by(queue=queue).order_by(DeadLetter.item).all()
+
+
+def unload_dlq(queue: str) -> typing.Generator[str, None, None]:
     """Dequeue a DLQ to iterable."""
-    items = []
-    while True:
-        try:
-            items.append(dlq.get_nowait())
-        except queue.Empty:
-            break
-    return (item for item in items)
+    unloaded = [letter.item for letter in items(queue)]
+    remove(queue, unloaded)
+    return (item for item in unloaded)
+
+
+def _describe(letter: DeadLetter) -> str:
+    return f"{letter.item} (attempts={letter.attempts} error={letter.error_class})"
 
 
 def log_unprocessed_dlq():
     """Log all DEAD_LETTER_QUEUE items."""
-    retry_urls = "\n".join(list(unload_dlq(DEAD_LETTER_QUEUE)))
+    retry_urls = "\n".join(_describe(letter) for letter in items(DEAD_LETTER_QUEUE))
     click.echo(f"The following urls were not processed:\n{retry_urls}")
 
 
 def log_no_admin_dlq():
     """Log all NO_ADMIN_DEAD_LETTER_QUEUE items."""
-    no_admin_area_sites = "\n".join(list(unload_dlq(NO_ADMIN_DEAD_LETTER_QUEUE)))
+    no_admin_area_sites = "\n".join(
+        _describe(letter) for letter in items(NO_ADMIN_DEAD_LETTER_QUEUE)
+    )
     click.echo(
         f"Admin area could not be identified for these sites:\n{no_admin_area_sites}"
     )
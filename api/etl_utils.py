@@ -5,13 +5,15 @@ import typing
 import click
 import grequests
 
+from api import checkpoints
 from api import dlq
 
 
 def on_fail(request: grequests.AsyncRequest, exception: Exception):
     """Request fail callback."""
     click.echo(f"Request failed for {request.url}, reason:{exception}")
-    dlq.add_to_dlq(request.url)
+    dlq.add_to_dlq(request.url, exception)
+    checkpoints.mark_failed(request.url, repr(exception))
 
 
 def chunk(
@@ -10,6 +10,7 @@ from flask_marshmallow import Marshmallow
 from flask_migrate import Migrate
 
 from api.commons.apispec import APISpecExt
+from api.commons.cache import ResponseCache
 
 
 db = SQLAlchemy()
@@ -17,4 +18,5 @@ jwt = JWTManager()
 ma = Marshmallow()
 migrate = Migrate()
 apispec = APISpecExt()
+response_cache = ResponseCache()
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
@@ -0,0 +1,573 @@
+"""Geo Boundaries spatial index.
+
+Builds an STRtree over prepared geoboundary feature geometries so admin area
+lookups only test the few polygons whose envelope contains a site's coordinates.
+Indexes are cached per geoboundary resource URL by `GEOMETRY_CACHE`, bounded by
+the total number of vertices held rather than the number of resources.
+`LevelledAdminAreaIndex` falls back from the finest admin level to coarser
+ones, a site at a time, optionally snapping sites just outside every polygon
+to the nearest one. Its lookups are memoized per grid cell by `CELL_CACHE`.
+"""
+import collections
+import math
+import typing
+
+import click
+import numpy as np
+import shapely
+import shapely.ops
+from flask import current_app
+from shapely.geometry import Point
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from api import gb_extract
+from api import gb_store
+from api.commons import geo
+
+
+class AdminAreaIndex:
+    """Spatial index of geoboundary features for a single country."""
+
+    def __init__(self, shape_ids: typing.Sequence[str], geometries: typing.Sequence):
+        self.shape_ids = list(shape_ids)
+        self.geometries = list(geometries)
+        self.prepared = [prep(geometry) for geometry in self.geometries]
+        self.tree = STRtree(self.geometries)
+        self.vertex_count = int(shapely.get_num_coordinates(self.geometries).sum())
+
+    def __len__(self) -> int:
+        return len(self.shape_ids)
+
+    def geometry(self, i: int):
+        """Return the `i`th feature's geometry."""
+        return self.geometries[i]
+
+    def contains(self, i: int, point: Point) -> bool:
+        """Check if the `i`th feature contains a point."""
+        return self.prepared[i].contains(point)
+
+    def intersects(self, i: int, area) -> bool:
+        """Check if the `i`th feature intersects a geometry."""
+        return self.prepared[i].intersects(area)
+
+    def covering(self, area) -> typing.Optional[str]:
+        """Return the shape ID every point of `area` looks up to, if any.
+
+        That is the first feature intersecting `area`, provided it contains
+        the whole of it. `None` if points of `area` resolve to different
+        features, or to none.
+        """
+        for i in sorted(self.tree.query(area)):
+            if self.intersects(i, area):
+                return self.shape_ids[i] if self.contains(i, area) else None
+        return None
+
+    def intersecting(self, areas: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Return `(area_idx, feature_idx)` pairs of features intersecting areas."""
+        return self.tree.query(areas, predicate="intersects")
+
+    def covering_many(self, areas: np.ndarray) -> np.ndarray:
+        """Return the shape ID every point of each area looks up to.
+
+        Vectorised equivalent of `covering`. Returns an object array aligned
+        with `areas`, holding `None` where points of the area resolve to
+        different features, or to none.
+        """
+        shape_ids = np.full(len(areas), None, dtype=object)
+        if not len(self) or not len(areas):
+            return shape_ids
+        area_idx, feature_idx = self.intersecting(areas)
+        order = np.lexsort((feature_idx, area_idx))
+        area_idx, feature_idx = area_idx[order], feature_idx[order]
+        _, first = np.unique(area_idx, return_index=True)
+        area_idx, feature_idx = area_idx[first], feature_idx[first]
+        for i in np.unique(feature_idx):
+            candidates = area_idx[feature_idx == i]
+            covered = candidates[shapely.contains(self.geometry(i), areas[candidates])]
+            shape_ids[covered] = self.shape_ids[i]
+        return shape_ids
+
+    def query_many(
+        self, points: np.ndarray, longitudes: np.ndarray, latitudes: np.ndarray
+    ) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Return `(point_idx, feature_idx)` pairs of features containing points."""
+        return self.tree.query(points, predicate="within")
+
+    def lookup(self, latitude: float, longitude: float) -> typing.Optional[str]:
+        """Return the shape ID of the feature containing the coordinate.
+
+        Only features whose envelope contains the point are tested, in feature
+        order, so the first matching feature wins as with a linear scan.
+        """
+        point = Point([longitude, latitude])  # Notice reverse Lat/Long order
+        for i in sorted(self.tree.query(point)):
+            if self.contains(i, point):
+                return self.shape_ids[i]
+        return None
+
+    def lookup_many(
+        self, latitudes: typing.Sequence[float], longitudes: typing.Sequence[float]
+    ) -> np.ndarray:
+        """Return the shape IDs of the features containing each coordinate.
+
+        Vectorised equivalent of `lookup`: all points are queried against the
+        tree in a single pass. Returns an object array aligned with the input,
+        holding `None` where no feature contains the point.
+        """
+        shape_ids = np.full(len(latitudes), None, dtype=object)
+        if not len(self) or not len(shape_ids):
+            return shape_ids
+        longitudes = np.asarray(longitudes, dtype=float)
+        latitudes = np.asarray(latitudes, dtype=float)
+        points = shapely.points(longitudes, latitudes)
+        point_idx, feature_idx = self.query_many(points, longitudes, latitudes)
+        # Keep the lowest feature index per point so the first match wins
+        order = np.lexsort((feature_idx, point_idx))
+        point_idx, feature_idx = point_idx[order], feature_idx[order]
+        _, first = np.unique(point_idx, return_index=True)
+        shape_ids[point_idx[first]] = np.asarray(self.shape_ids, dtype=object)[
+            feature_idx[first]
+        ]
+        return shape_ids
+
+    def nearest(
+        self, latitude: float, longitude: float, max_distance_km: float
+    ) -> typing.Optional[str]:
+        """Return the shape ID of the feature closest to the coordinate.
+
+        Only features whose envelope lies within `max_distance_km` of the
+        coordinate are measured, by great circle distance to their nearest
+        point. Returns `None` if no feature is that close.
+        """
+        point = Point([longitude, latitude])  # Notice reverse Lat/Long order
+        closest = None
+        for min_lat, min_lon, max_lat, max_lon in geo.bbox_around(
+            latitude, longitude, max_distance_km
+        ):
+            envelope = shapely.box(min_lon, min_lat, max_lon, max_lat)
+            for i in self.tree.query(envelope):
+                nearest, _ = shapely.ops.nearest_points(self.geometry(i), point)
+                distance = geo.haversine_km(latitude, longitude, nearest.y, nearest.x)
+                if distance <= max_distance_km and (
+                    closest is None or (distance, i) < closest
+                ):
+                    closest = (distance, i)
+        return None if closest is None else self.shape_ids[closest[1]]
+
+
+class MappedAdminAreaIndex(AdminAreaIndex):
+    """Spatial index over a memory mapped `gb_store.MappedArchive`.
+
+    The tree is built from the archive's stored bounding boxes, and a feature
+    is only decoded when a query point falls inside its bounding box. Up to
+    `decode_cache_size` decoded geometries are kept, least recently used first
+    out, so memory stays flat however large the country. `vertex_count` counts
+    the vertices of the decoded geometries only, since the rest live in the
+    page cache rather than in the process.
+    """
+
+    def __init__(self, archive: gb_store.MappedArchive, decode_cache_size: int = 256):
+        self.archive = archive
+        self.shape_ids = archive.shape_ids
+        self.tree = STRtree(shapely.box(*archive.bboxes.T))
+        self.vertex_count = 0
+        self.decode_cache_size = decode_cache_size
+        self._decoded = collections.OrderedDict()
+
+    def geometry(self, i: int):
+        """Return the `i`th feature's geometry, decoding it if needed."""
+        i = int(i)
+        geometry = self._decoded.get(i)
+        if geometry is None:
+            geometry = self.archive.geometry(i)
+            shapely.prepare(geometry)
+            self._decoded[i] = geometry
+            self.vertex_count += int(shapely.get_num_coordinates(geometry))
+            if len(self._decoded) > self.decode_cache_size:
+                _, evicted = self._decoded.popitem(last=False)
+                self.vertex_count -= int(shapely.get_num_coordinates(evicted))
+        else:
+            self._decoded.move_to_end(i)
+        return geometry
+
+    def contains(self, i: int, point: Point) -> bool:
+        return self.geometry(i).contains(point)
+
+    def intersects(self, i: int, area) -> bool:
+        return self.geometry(i).intersects(area)
+
+    def intersecting(self, areas: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        area_idx, feature_idx = self.tree.query(areas)
+        hits = np.zeros(len(area_idx), dtype=bool)
+        for i in np.unique(feature_idx):
+            candidates = np.flatnonzero(feature_idx == i)
+            hits[candidates] = shapely.intersects(
+                self.geometry(i), areas[area_idx[candidates]]
+            )
+        return area_idx[hits], feature_idx[hits]
+
+    def query_many(
+        self, points: np.ndarray, longitudes: np.ndarray, latitudes: np.ndarray
+    ) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Return `(point_idx, feature_idx)` pairs of features containing points.
+
+        Bounding box hits are refined a feature at a time, so each candidate
+        feature is decoded once for all the points it may contain.
+        """
+        point_idx, feature_idx = self.tree.query(points)
+        hits = np.zeros(len(point_idx), dtype=bool)
+        for i in np.unique(feature_idx):
+            candidates = np.flatnonzero(feature_idx == i)
+            hits[candidates] = shapely.contains_xy(
+                self.geometry(i),
+                longitudes[point_idx[candidates]],
+                latitudes[point_idx[candidates]],
+            )
+        return point_idx[hits], feature_idx[hits]
+
+
+class LevelledAdminAreaIndex:
+    """Admin area indexes of a single country at successive ADM levels.
+
+    A coordinate resolves to the finest level with a feature containing it,
+    so a site in a gap or sliver of the ADM3 polygons still gets its ADM2 or
+    ADM1 area. A level is only loaded once a coordinate is left unmatched by
+    every finer level, through `load_admin_area_index` so levels share
+    `GEOMETRY_CACHE`. Levels without geoboundary data are skipped.
+
+    With a `snap_distance_km`, a coordinate no feature of a level contains is
+    snapped to the level's nearest feature within that distance, before
+    coarser levels are tried. This catches stations on piers, bridges and
+    coastlines just outside the simplified polygons.
+
+    With a `cell_precision`, results are memoized in `CELL_CACHE` by cells of
+    the size of geohashes of that precision, see `CellCache`.
+    """
+
+    def __init__(
+        self,
+        country_code: str,
+        levels: typing.Sequence[str],
+        snap_distance_km: float = 0.0,
+        cell_precision: int = 0,
+        cell_cache_size: int = 0,
+    ):
+        self.country_code = country_code
+        self.levels = list(levels)
+        self.snap_distance_km = snap_distance_km
+        self.cell_precision = cell_precision
+        self.cell_cache_size = cell_cache_size
+
+    def url(self, level: str) -> typing.Optional[str]:
+        """Return the geoboundary resource URL of a level, `None` if no data."""
+        try:
+            return gb_extract.fetch_geoboundary_level_url(self.country_code, level)
+        except (KeyError, AttributeError) as e:
+            click.echo(
+                f"Error '{e}' while loading {level} geoboundary data for: "
+                f"{self.country_code}"
+            )
+            return None
+
+    def index(self, level: str) -> typing.Optional[AdminAreaIndex]:
+        """Return the index of an admin level, `None` if it has no data."""
+        geo_resource_url = self.url(level)
+        if geo_resource_url is None:
+            return None
+        return load_admin_area_index(geo_resource_url)
+
+    def finest_level(self) -> typing.Optional[str]:
+        """Return the finest level with geoboundary data."""
+        return next((level for level in self.levels if self.url(level)), None)
+
+    def lookup(
+        self, latitude: float, longitude: float
+    ) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+        """Return the `(shape_id, level)` of the finest feature containing the
+        coordinate, `(None, None)` if no level has one.
+        """
+        finest_level = self.finest_level() if self.cell_precision else None
+        if finest_level is not None:
+            height, width = geo.cell_size(self.cell_precision)
+            cell = (
+                self.url(finest_level),
+                self.cell_precision,
+                math.floor((latitude + 90.0) / height),
+                math.floor((longitude + 180.0) / width),
+            )
+            cached = CELL_CACHE.get(cell)
+            if cached is not None:
+                return cached
+        for level in self.levels:
+            index = self.index(level)
+            if index is None:
+                continue
+            shape_id = index.lookup(latitude, longitude)
+            if shape_id is None and self.snap_distance_km:
+                shape_id = index.nearest(latitude, longitude, self.snap_distance_km)
+            if shape_id is not None:
+                break
+        else:
+            return None, None
+        if level == finest_level and index.covering(self._area(cell)) == shape_id:
+            CELL_CACHE.put(cell, (shape_id, level), self.cell_cache_size)
+        return shape_id, level
+
+    def lookup_many(
+        self, latitudes: typing.Sequence[float], longitudes: typing.Sequence[float]
+    ) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """Return the shape IDs and levels of the finest features containing
+        each coordinate.
+
+        Each level is queried once, for the coordinates finer levels left
+        unmatched. Returns two object arrays aligned with the input, holding
+        `None` where no feature matched.
+        """
+        shape_ids = np.full(len(latitudes), None, dtype=object)
+        levels = np.full(len(latitudes), None, dtype=object)
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        pending = np.arange(len(shape_ids))
+        finest_level = self.finest_level() if self.cell_precision else None
+        if finest_level is not None:
+            cells = self._cells(finest_level, latitudes, longitudes)
+            for i, cell in enumerate(cells):
+                cached = CELL_CACHE.get(cell)
+                if cached is not None:
+                    shape_ids[i], levels[i] = cached
+            pending = pending[np.equal(levels, None)]
+        resolved = pending
+        for level in self.levels:
+            if not len(pending):
+                break
+            index = self.index(level)
+            if index is None:
+                continue
+            found = index.lookup_many(latitudes[pending], longitudes[pending])
+            if self.snap_distance_km:
+                for i in (i for i, shape_id in enumerate(found) if shape_id is None):
+                    found[i] = index.nearest(
+                        latitudes[pending[i]],
+                        longitudes[pending[i]],
+                        self.snap_distance_km,
+                    )
+            matched = np.array([shape_id is not None for shape_id in found], dtype=bool)
+            shape_ids[pending[matched]] = found[matched]
+            levels[pending[matched]] = level
+            pending = pending[~matched]
+        if finest_level is not None:
+            self._cache_cells(
+                finest_level,
+                {cells[i]: shape_ids[i] for i in resolved if levels[i] == finest_level},
+            )
+        return shape_ids, levels
+
+    def _cells(
+        self,
+        level: str,
+        latitudes: typing.Sequence[float],
+        longitudes: typing.Sequence[float],
+    ) -> typing.List[tuple]:
+        """Return the `CELL_CACHE` keys of the cells holding coordinates."""
+        geo_resource_url = self.url(level)
+        height, width = geo.cell_size(self.cell_precision)
+        rows = np.floor((np.asarray(latitudes, dtype=float) + 90.0) / height)
+        columns = np.floor((np.asarray(longitudes, dtype=float) + 180.0) / width)
+        return [
+            (geo_resource_url, self.cell_precision, row, column)
+            for row, column in zip(
+                rows.astype(int).tolist(), columns.astype(int).tolist()
+            )
+        ]
+
+    def _area(self, cell: tuple):
+        """Return the box of a `CELL_CACHE` cell."""
+        _, precision, row, column = cell
+        height, width = geo.cell_size(precision)
+        return shapely.box(
+            column * width - 180.0,
+            row * height - 90.0,
+            (column + 1) * width - 180.0,
+            (row + 1) * height - 90.0,
+        )
+
+    def _cache_cells(self, level: str, cells: typing.Dict[tuple, str]):
+        """Cache the cells wholly inside the feature one of their points matched."""
+        if not cells:
+            return
+        areas = np.array([self._area(cell) for cell in cells], dtype=object)
+        covering = self.index(level).covering_many(areas)
+        for (cell, shape_id), covered in zip(cells.items(), covering):
+            if covered == shape_id:
+                CELL_CACHE.put(cell, (shape_id, level), self.cell_cache_size)
+
+
+class GeometryCache:
+    """LRU cache of admin area indexes keyed by geoboundary resource URL.
+
+    Eviction is driven by the total vertex count of the cached indexes, which
+    tracks memory use far better than an entry count when resources range from
+    a handful of ADM1 polygons to hundreds of thousands of ADM3 vertices. The
+    most recently used index is always kept, even if it alone exceeds the limit.
+    Mapped indexes grow as they decode geometries, so the total is summed afresh
+    and the limit of the last `put` enforced again on every `get`.
+    """
+
+    def __init__(self):
+        self._indexes = collections.OrderedDict()
+        self.max_vertices = None
+
+    def __len__(self) -> int:
+        return len(self._indexes)
+
+    def __contains__(self, geo_resource_url: str) -> bool:
+        return geo_resource_url in self._indexes
+
+    @property
+    def vertex_count(self) -> int:
+        """Total vertex count of the cached indexes."""
+        return sum(index.vertex_count for index in self._indexes.values())
+
+    def get(self, geo_resource_url: str) -> typing.Optional[AdminAreaIndex]:
+        """Get a cached index, marking it most recently used."""
+        index = self._indexes.get(geo_resource_url)
+        if index is not None:
+            self._indexes.move_to_end(geo_resource_url)
+            self._evict()
+        return index
+
+    def put(self, geo_resource_url: str, index: AdminAreaIndex, max_vertices: int):
+        """Cache an index, evicting least recently used ones over `max_vertices`."""
+        self.pop(geo_resource_url)
+        self._indexes[geo_resource_url] = index
+        self.max_vertices = max_vertices
+        self._evict()
+
+    def _evict(self):
+        if self.max_vertices is None:
+            return
+        vertex_count = self.vertex_count
+        while vertex_count > self.max_vertices and len(self._indexes) > 1:
+            evicted_url, evicted = self._indexes.popitem(last=False)
+            vertex_count -= evicted.vertex_count
+            click.echo(f"Evicted geometries for: {evicted_url}")
+
+    def pop(self, geo_resource_url: str) -> typing.Optional[AdminAreaIndex]:
+        """Remove an index from the cache."""
+        return self._indexes.pop(geo_resource_url, None)
+
+    def clear(self):
+        """Remove all cached indexes."""
+        self._indexes.clear()
+
+
+class CellCache:
+    """LRU cache of admin area lookups by geohash cell.
+
+    Keyed by `(geo_resource_url, precision, row, column)` of a grid of cells
+    the size of geohashes of `precision`, holding the `(shape_id, level)`
+    every coordinate in the cell resolves to. Only cells lying wholly inside
+    a single feature are cached, so a hit is exactly what a lookup would have
+    returned. Nearby stations of a dense network mostly share cells, and skip
+    geometry tests altogether. Hits and misses are counted for `stats`.
+    """
+
+    def __init__(self):
+        self._cells = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._cells)
+
+    def get(self, cell: tuple) -> typing.Optional[tuple]:
+        """Get a cached lookup, marking it most recently used."""
+        value = self._cells.get(cell)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._cells.move_to_end(cell)
+        return value
+
+    def put(self, cell: tuple, value: tuple, max_entries: int):
+        """Cache a lookup, evicting least recently used ones over `max_entries`."""
+        self._cells[cell] = value
+        self._cells.move_to_end(cell)
+        while len(self._cells) > max_entries:
+            self._cells.popitem(last=False)
+
+    def discard(self, geo_resource_url: str):
+        """Remove the cached lookups of a geoboundary resource."""
+        for cell in [cell for cell in self._cells if cell[0] == geo_resource_url]:
+            del self._cells[cell]
+
+    def stats(self) -> typing.Dict[str, float]:
+        """Return hit and miss counts, and the hit rate."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._cells),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        """Remove all cached lookups and reset the counts."""
+        self._cells.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+GEOMETRY_CACHE = GeometryCache()
+CELL_CACHE = CellCache()
+
+
+def load_admin_area_index(geo_resource_url: str) -> AdminAreaIndex:
+    """Load admin area index.
+
+    Given a geoboundary resource URL, returns the cached index or builds one
+    from `gb_store`. With the `mmap` store format the index maps the stored
+    archive and decodes geometries lazily, otherwise every geometry is loaded
+    and prepared exactly once.
+    """
+    index = GEOMETRY_CACHE.get(geo_resource_url)
+    if index is None:
+        click.echo(f"Building admin area index for: {geo_resource_url}")
+        if current_app.config.get("GEOBOUNDARY_STORE_FORMAT") == "mmap":
+            index = MappedAdminAreaIndex(
+                gb_store.open_archive(geo_resource_url),
+                current_app.config.get("GEOBOUNDARY_DECODE_CACHE_SIZE"),
+            )
+        else:
+            index = AdminAreaIndex(*gb_store.load_geometries(geo_resource_url))
+        click.echo(f"Indexed {len(index)} feature(s), {index.vertex_count} vertices")
+        CELL_CACHE.discard(geo_resource_url)
+        GEOMETRY_CACHE.put(
+            geo_resource_url,
+            index,
+            max_vertices=current_app.config.get("GEOMETRY_CACHE_MAX_VERTICES"),
+        )
+    return index
+
+
+def get_levelled_index(country_code: str) -> LevelledAdminAreaIndex:
+    """Get levelled admin area index.
+
+    Levels run from `ADMIN_AREA_LEVEL` down to `ADMIN_AREA_MIN_LEVEL`, finest
+    first, snapping to features within `ADMIN_AREA_SNAP_DISTANCE_METRES` (off
+    if 0). Lookups are memoized by cells the size of geohashes of
+    `ADMIN_AREA_CELL_PRECISION` (off if 0), up to `ADMIN_AREA_CELL_CACHE_SIZE`
+    cells. No geometries are loaded until the index is queried.
+    """
+    return LevelledAdminAreaIndex(
+        country_code,
+        gb_extract.admin_levels(
+            current_app.config.get("ADMIN_AREA_LEVEL"),
+            current_app.config.get("ADMIN_AREA_MIN_LEVEL"),
+        ),
+        current_app.config.get("ADMIN_AREA_SNAP_DISTANCE_METRES") / 1000,
+        current_app.config.get("ADMIN_AREA_CELL_PRECISION"),
+        current_app.config.get("ADMIN_AREA_CELL_CACHE_SIZE"),
+    )
@@ -0,0 +1,394 @@
+"""Geo Boundaries store.
+
+Persists geoboundary resources in `GEOBOUNDARY_STORE_DIR` as packed WKB rather
+than raw GeoJSON, so loading a country only decodes binary geometries instead
+of parsing a JSON document that can run to hundreds of MB. Each resource has a
+JSON manifest next to it recording the source URL, ADM level, ETag/Last-Modified,
+feature count and a checksum of the packed data. Resources older than
+`GEOBOUNDARY_STORE_MAX_AGE_SECONDS` are revalidated with a conditional request
+and only re-downloaded if they have changed.
+
+`GEOBOUNDARY_STORE_FORMAT` selects how packed data is written:
+
+- `mmap`: uncompressed, opened with `mmap` as a `MappedArchive` so only the
+  index is read up front and geometries are decoded on demand. Processes
+  mapping the same archive share the page cache.
+- `gzip`: compressed, smaller on disk but always decoded in full.
+
+Layout of a packed resource (little endian):
+
+    magic       b"GBS1"
+    count       uint32, number of features
+    ids_size    uint32, size of the shape ID block in bytes
+    bboxes      float64[count][4], (minx, miny, maxx, maxy) per feature
+    offsets     uint64[count + 1], offset of each geometry in the WKB block
+    shape_ids   utf-8, newline separated
+    wkb         concatenated WKB geometries
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import struct
+import typing
+
+import click
+import grequests
+import numpy as np
+import shapely
+from flask import current_app
+from shapely.geometry import shape
+
+from api import etl_utils
+
+
+MAGIC = b"GBS1"
+HEADER = struct.Struct("<4sII")
+
+
+class StoreError(Exception):
+    """Exception raised when a stored resource is missing or corrupt."""
+
+
+def pack(shape_ids: typing.Sequence[str], geometries: typing.Sequence) -> bytes:
+    """Pack shape IDs and geometries into the store layout."""
+    wkbs = shapely.to_wkb(np.asarray(geometries, dtype=object))
+    offsets = np.zeros(len(wkbs) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(wkb) for wkb in wkbs])
+    bboxes = shapely.bounds(np.asarray(geometries, dtype=object)).astype("<f8")
+    ids = "\n".join(shape_ids).encode()
+    return b"".join(
+        [
+            HEADER.pack(MAGIC, len(shape_ids), len(ids)),
+            bboxes.reshape(-1, 4).tobytes(),
+            offsets.tobytes(),
+            ids,
+            *wkbs,
+        ]
+    )
+
+
+def unpack_index(data: typing.Union[bytes, memoryview]) -> tuple:
+    """Unpack the index part of a packed resource.
+
+    Returns `(shape_ids, bboxes, offsets, wkb_start)`, where `wkb_start` is the
+    position of the WKB block within `data`. Geometries are not decoded.
+    """
+    magic, count, ids_size = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise StoreError(f"Not a packed geoboundary resource: {magic!r}")
+    position = HEADER.size
+    bboxes = np.frombuffer(data, dtype="<f8", count=count * 4, offset=position)
+    position += bboxes.nbytes
+    offsets = np.frombuffer(data, dtype="<u8", count=count + 1, offset=position)
+    position += offsets.nbytes
+    ids = bytes(data[position:position + ids_size]).decode()
+    shape_ids = ids.split("\n") if count else []
+    return shape_ids, bboxes.reshape(count, 4), offsets, position + ids_size
+
+
+def unpack(data: bytes) -> typing.Tuple[typing.List[str], typing.List]:
+    """Unpack shape IDs and geometries from the store layout."""
+    shape_ids, _, offsets, wkb_start = unpack_index(data)
+    wkbs = [
+        data[wkb_start + start:wkb_start + end]
+        for start, end in zip(offsets[:-1], offsets[1:])
+    ]
+    return shape_ids, list(shapely.from_wkb(wkbs)) if wkbs else []
+
+
+def features_to_geometries(
+    features: typing.Iterable[dict],
+) -> typing.Tuple[typing.List[str], typing.List]:
+    """Convert geoboundary GeoJSON features to shape IDs and geometries."""
+    shape_ids, geometries = [], []
+    for feature in features:
+        shape_ids.append(feature["properties"]["shapeID"])
+        geometries.append(shape(feature["geometry"]))
+    return shape_ids, geometries
+
+
+class MappedArchive:
+    """Memory mapped packed resource.
+
+    Only the index (shape IDs, bboxes and offsets) is materialised, as views
+    onto the mapping; each geometry's WKB is read and decoded on request.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.shape_ids, self.bboxes, self.offsets, self._wkb_start = unpack_index(
+            self._mmap
+        )
+
+    def __len__(self) -> int:
+        return len(self.shape_ids)
+
+    def wkb(self, i: int) -> bytes:
+        """Return the WKB of the `i`th geometry."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self._mmap[self._wkb_start + start:self._wkb_start + end]
+
+    def geometry(self, i: int):
+        """Decode the `i`th geometry."""
+        return shapely.from_wkb(self.wkb(i))
+
+
+def _resource_stem(geo_resource_url: str) -> str:
+    return etl_utils.get_resource_name(geo_resource_url).rsplit(".", 1)[0]
+
+
+def data_path(geo_resource_url: str, compression: typing.Optional[str]) -> str:
+    """Return the packed data path for a resource."""
+    store_dir = current_app.config.get("GEOBOUNDARY_STORE_DIR")
+    extension = "gbs.gz" if compression == "gzip" else "gbs"
+    return os.path.join(store_dir, f"{_resource_stem(geo_resource_url)}.{extension}")
+
+
+def manifest_path(geo_resource_url: str) -> str:
+    """Return the manifest path for a resource."""
+    store_dir = current_app.config.get("GEOBOUNDARY_STORE_DIR")
+    return os.path.join(store_dir, f"{_resource_stem(geo_resource_url)}.manifest.json")
+
+
+def read_manifest(geo_resource_url: str) -> typing.Optional[dict]:
+    """Read a resource's manifest, `None` if the resource is not stored."""
+    try:
+        with open(manifest_path(geo_resource_url)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(geo_resource_url: str, manifest: dict):
+    """Atomically write a resource's manifest."""
+    _atomic_write(
+        manifest_path(geo_resource_url), json.dumps(manifest, indent=2).encode()
+    )
+
+
+def _atomic_write(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def save(
+    geo_resource_url: str, features: typing.Sequence[dict], headers: typing.Mapping
+) -> dict:
+    """Save a resource.
+
+    Packs the GeoJSON features and writes them in `GEOBOUNDARY_STORE_FORMAT`
+    with a fresh manifest. Returns the manifest.
+    """
+    shape_ids, geometries = features_to_geometries(features)
+    data = pack(shape_ids, geometries)
+    compression = write_data(geo_resource_url, data)
+    manifest = {
+        "source_url": geo_resource_url,
+        "adm_level": features[0]["properties"].get("shapeType") if features else None,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "feature_count": len(shape_ids),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "compression": compression,
+        "path": os.path.basename(data_path(geo_resource_url, compression)),
+        "fetched": _now(),
+        "checked": _now(),
+    }
+    write_manifest(geo_resource_url, manifest)
+    click.echo(f"Stored {len(shape_ids)} feature(s) for: {geo_resource_url}")
+    return manifest
+
+
+def write_data(geo_resource_url: str, data: bytes) -> typing.Optional[str]:
+    """Write packed data in `GEOBOUNDARY_STORE_FORMAT`, returning its compression."""
+    compression = (
+        "gzip" if current_app.config.get("GEOBOUNDARY_STORE_FORMAT") == "gzip" else None
+    )
+    if compression == "gzip":
+        data = gzip.compress(data, compresslevel=6)
+    _atomic_write(data_path(geo_resource_url, compression), data)
+    return compression
+
+
+def read(geo_resource_url: str, manifest: dict) -> bytes:
+    """Read a resource's packed data, verifying it against its manifest."""
+    path = data_path(geo_resource_url, manifest.get("compression", "gzip"))
+    try:
+        with (gzip.open if path.endswith(".gz") else open)(path, "rb") as f:
+            data = f.read()
+    except (FileNotFoundError, OSError, EOFError) as e:
+        raise StoreError(f"Could not read {path}: {e}")
+    if hashlib.sha256(data).hexdigest() != manifest["sha256"]:
+        raise StoreError(f"Checksum mismatch for {path}")
+    return data
+
+
+def map_archive(
+    geo_resource_url: str, manifest: dict, verify: bool = False
+) -> MappedArchive:
+    """Map a resource's uncompressed packed data.
+
+    Opening only checks the size and layout of the data against the manifest,
+    so it stays cheap however large the resource. With `verify` the checksum
+    is also computed over the mapping, paging the file in once without copying
+    it into Python memory; `open_archive` does so once after a download or
+    import rather than on every open.
+    """
+    path = data_path(geo_resource_url, None)
+    try:
+        archive = MappedArchive(path)
+    except (FileNotFoundError, OSError, ValueError, struct.error) as e:
+        raise StoreError(f"Could not map {path}: {e}")
+    size = len(archive._mmap)
+    if (
+        size != manifest["size"]
+        or len(archive) != manifest["feature_count"]
+        or archive._wkb_start + int(archive.offsets[-1]) != size
+    ):
+        raise StoreError(f"Size mismatch for {path}")
+    if verify and hashlib.sha256(archive._mmap).hexdigest() != manifest["sha256"]:
+        raise StoreError(f"Checksum mismatch for {path}")
+    return archive
+
+
+def request_resource(geo_resource_url: str, headers: typing.Mapping) -> typing.Any:
+    """Request a geoboundary resource, raising on transport failure."""
+    request = grequests.get(geo_resource_url, headers=dict(headers)).send()
+    if getattr(request, "exception", None) is not None:
+        raise request.exception
+    return request.response
+
+
+def download(geo_resource_url: str, manifest: typing.Optional[dict] = None) -> dict:
+    """Download a resource into the store.
+
+    If a `manifest` is given the request is conditional on its ETag and
+    Last-Modified, and a `304 Not Modified` only refreshes the manifest's
+    check time. Returns the current manifest.
+    """
+    headers = {}
+    if manifest and manifest.get("etag"):
+        headers["If-None-Match"] = manifest["etag"]
+    if manifest and manifest.get("last_modified"):
+        headers["If-Modified-Since"] = manifest["last_modified"]
+    click.echo(f"Fetching geoboundary features from: {geo_resource_url}")
+    response = request_resource(geo_resource_url, headers)
+    if manifest and response.status_code == 304:
+        click.echo(f"Geoboundary resource not modified: {geo_resource_url}")
+        manifest["checked"] = _now()
+        write_manifest(geo_resource_url, manifest)
+        return manifest
+    if not response.ok:
+        raise StoreError(
+            f"Failed to fetch {geo_resource_url}: {response.status_code}"
+        )
+    return save(geo_resource_url, response.json()["features"], response.headers)
+
+
+def is_stale(manifest: dict) -> bool:
+    """Check if a stored resource is due for revalidation."""
+    max_age = current_app.config.get("GEOBOUNDARY_STORE_MAX_AGE_SECONDS")
+    if not max_age:
+        return False
+    checked = datetime.datetime.fromisoformat(manifest["checked"])
+    age = datetime.datetime.utcnow() - checked
+    return age.total_seconds() > max_age
+
+
+def import_legacy(geo_resource_url: str) -> typing.Optional[dict]:
+    """Import a raw GeoJSON copy of a resource cached by `gb_extract`."""
+    store_dir = current_app.config.get("GEOBOUNDARY_STORE_DIR")
+    legacy_path = os.path.join(
+        store_dir, etl_utils.get_resource_name(geo_resource_url)
+    )
+    try:
+        with open(legacy_path) as f:
+            features = json.load(f)["features"]
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+    click.echo(f"Importing cached GeoJSON: {legacy_path}")
+    manifest = save(geo_resource_url, features, {})
+    os.remove(legacy_path)
+    return manifest
+
+
+def ensure(geo_resource_url: str) -> dict:
+    """Ensure a resource is stored and current, returning its manifest.
+
+    Revalidation failures are logged and the stored copy is used.
+    """
+    manifest = read_manifest(geo_resource_url)
+    if manifest is None:
+        return import_legacy(geo_resource_url) or download(geo_resource_url)
+    if is_stale(manifest):
+        try:
+            return download(geo_resource_url, manifest)
+        except Exception as e:
+            click.echo(f"Revalidation failed for {geo_resource_url}: {e!r}")
+    return manifest
+
+
+def load_geometries(
+    geo_resource_url: str,
+) -> typing.Tuple[typing.List[str], typing.List]:
+    """Load geometries.
+
+    Returns the shape IDs and geometries of a resource, downloading it into
+    the store first if needed. A corrupt stored copy is downloaded again.
+    """
+    manifest = ensure(geo_resource_url)
+    try:
+        data = read(geo_resource_url, manifest)
+    except StoreError as e:
+        click.echo(f"{e}, downloading again")
+        data = read(geo_resource_url, download(geo_resource_url))
+    return unpack(data)
+
+
+def open_archive(geo_resource_url: str) -> MappedArchive:
+    """Open archive.
+
+    Returns a `MappedArchive` of a resource, downloading it into the store
+    first if needed. A resource stored compressed is unpacked to an
+    uncompressed archive once, and a corrupt stored copy is downloaded again.
+    Archives are only checksummed when newly downloaded, see `map_archive`.
+    """
+    stored = read_manifest(geo_resource_url)
+    manifest = ensure(geo_resource_url)
+    verify = stored is None or stored.get("fetched") != manifest.get("fetched")
+    if manifest.get("compression", "gzip") is not None:
+        try:
+            data = read(geo_resource_url, manifest)
+        except StoreError as e:
+            click.echo(f"{e}, downloading again")
+            manifest = download(geo_resource_url)
+            data = read(geo_resource_url, manifest)
+        if manifest.get("compression") is not None:
+            click.echo(f"Unpacking archive for: {geo_resource_url}")
+            os.remove(data_path(geo_resource_url, "gzip"))
+            _atomic_write(data_path(geo_resource_url, None), data)
+            manifest.update(
+                compression=None,
+                size=len(data),
+                path=os.path.basename(data_path(geo_resource_url, None)),
+            )
+            write_manifest(geo_resource_url, manifest)
+        # `read` has checksummed the data just written
+        verify = False
+    try:
+        return map_archive(geo_resource_url, manifest, verify)
+    except StoreError as e:
+        click.echo(f"{e}, downloading again")
+        return map_archive(geo_resource_url, download(geo_resource_url), True)
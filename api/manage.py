@@ -1,8 +1,14 @@
+import datetime
+import time
+import typing
+
 import click
 from flask import current_app
 from flask.cli import with_appcontext
 
-from api import cb_extract, cb_transform, dlq
+from api import async_extract, cb_extract, cb_transform, checkpoints, dlq
+from api import pipeline, rollups
+from api.models import DataGeneration
 
 
 @click.group()
@@ -25,8 +31,18 @@ def init():
 
 
 @cli.command("load_sites")
+@click.option(
+    "--pipeline",
+    is_flag=True,
+    help="Fetch, load and transform concurrently as a streaming pipeline.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Continue the previous run from its checkpoints.",
+)
 @with_appcontext
-def load_sites():
+def load_sites(pipeline, resume):
     """Load sites.
 
     Extracts all the networks from `CITY_BIKE_URI` endpoint, and for each
@@ -45,10 +61,11 @@ def load_sites():
     https://www.geoboundaries.org/gbRequest.html?ISO=GBR&ADM=ADM3
 
     A check is made for a cached GeoBoundaries dataset, otherwise a dataset is
-    downloaded. Once loaded, for each `feature` in the GeoBoundaries dataset,
-    if a Site's coordinates are within the feature shape's boundary then the
-    Site's admin_area field is set accordingly, otherwise the next `feature`
-    is checked.
+    downloaded. Once loaded, the dataset's features are indexed in an STRtree
+    (built once per country) and only the features whose bounding box contains
+    a Site's coordinates are checked. If a Site's coordinates are within the
+    feature shape's boundary then the Site's admin_area field is set
+    accordingly.
 
     Processing is as follows:
         - Get all the Master Site URLs.
@@ -56,41 +73,220 @@ def load_sites():
           mitigates being throttled (HTTP 429) by the `CITY_BIKE_URI` endpoint.
         - For each URL in a chunk, determine admin area and save to Site model.
 
-    Any failures are pushed to a dead letter queue using `add_to_dlq`.
-    Once all Master Site URL chunks are exhausted the DLQ is processed.
-    Reprocessing of the DLQ is repeated `PROCESSING_RETRY_COUNT` times.
+    If `EXTRACT_ENGINE` is `asyncio` the Master Site URLs are instead fetched
+    continuously by `async_extract`, with at most `EXTRACT_CONCURRENCY`
+    requests in flight and per host rate limiting, and admin areas are
+    determined once extraction completes.
+
+    With `--pipeline` the fetch, station upsert and admin area resolution run
+    as concurrent stages connected by bounded queues (see `api.pipeline`), so
+    only the stations just loaded are sent for admin area resolution.
+
+    Any failures are pushed to a dead letter queue using `add_to_dlq`, to be
+    retried with backoff by `flask api retry_dlq`.
 
     Similarly, if an admin area cannot be established for a Site, the Site's ID
-    is pushed to a 'no admin' dead letter queue using `add_to_no_admin_dlq`.
+    is pushed to a 'no admin' dead letter queue, a country at a time.
+
+    Each network URL's progress is checkpointed (see `api.checkpoints`). With
+    `--resume` the master site list is not fetched again: sites already loaded
+    have their admin areas resolved, then only the network URLs still pending
+    or failed are processed.
+
+    On exit, the details of any remaining items in both DLQs are logged, the
+    site rollups are rebuilt and the "sites" data generation is bumped,
+    invalidating cached API responses.
+    """
+    with checkpoints.recording():
+        if resume and checkpoints.summary():
+            click.echo("Resuming from checkpoints...")
+            checkpoints.log_summary()
+            if checkpoints.summary().get(checkpoints.FETCHED):
+                cb_transform.process_admin_areas()
+                checkpoints.mark_transformed()
+            master_site_urls = checkpoints.resumable_urls()
+        else:
+            click.echo("Loading master site data...")
+            master_site_urls = checkpoints.start_run(
+                cb_extract.load_master_site_urls(
+                    current_app.config.get("CITY_BIKE_URI")
+                )
+            )
+        extract = run_pipeline if pipeline else extract_sites
+        extract(iter(master_site_urls))
+        dlq.log_unprocessed_dlq()
+        dlq.log_no_admin_dlq()
+        checkpoints.log_summary()
+    publish_sites()
+
+
+@cli.command("retry_dlq")
+@click.option(
+    "--batch-size",
+    type=int,
+    default=None,
+    help="URLs retried concurrently per batch [default: DLQ_RETRY_BATCH_SIZE].",
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="Sleep until items not due yet are, until the queues are drained.",
+)
+@with_appcontext
+def retry_dlq(batch_size, wait):
+    """Retry dead letter queues.
+
+    URLs in the dead letter queue that are due for a retry are extracted again
+    in batches of `DLQ_RETRY_BATCH_SIZE`, each batch fetched concurrently by
+    the configured `EXTRACT_ENGINE`. Then sites in the 'no admin' dead letter
+    queue that are due have their admin areas resolved again.
+
+    Items that fail again are rescheduled with exponential backoff, and are
+    given up on after `PROCESSING_RETRY_COUNT` retries. Without `--wait` only
+    the items due now are retried.
+    """
+    batch_size = batch_size or current_app.config.get("DLQ_RETRY_BATCH_SIZE")
+    retried = 0
+    with checkpoints.recording():
+        while True:
+            retried += retry_due_urls(batch_size) + retry_due_no_admin_sites()
+            next_due = [
+                due
+                for due in map(
+                    dlq.next_due,
+                    (dlq.DEAD_LETTER_QUEUE, dlq.NO_ADMIN_DEAD_LETTER_QUEUE),
+                )
+                if due is not None
+            ]
+            if not wait or not next_due:
+                break
+            delay = (min(next_due) - datetime.datetime.utcnow()).total_seconds()
+            if delay > 0:
+                click.echo(f"Next retry due in {delay:.0f}s")
+                time.sleep(delay)
+        dlq.log_unprocessed_dlq()
+        dlq.log_no_admin_dlq()
+    if retried:
+        publish_sites()
 
-    On exit, the details of any remaining items in both DLQs are logged.
+
+@cli.command("bench_sites")
+@click.option(
+    "--page-size",
+    "page_sizes",
+    type=int,
+    multiple=True,
+    default=(50, 500, 5000),
+    show_default=True,
+)
+@click.option("--repeat", type=int, default=5, show_default=True)
+@with_appcontext
+def bench_sites(page_sizes, repeat):
+    """Benchmark Site listing serialization.
+
+    Times a page of sites read as ORM instances and dumped with `SiteSchema`
+    against the lean column rows path used by `SiteList`, best of `repeat`
+    runs. Run it against a loaded database.
     """
-    click.echo("Loading master site data...")
-    master_site_urls = cb_extract.load_master_site_urls(
-        current_app.config.get("CITY_BIKE_URI")
+    import json
+    import timeit
+
+    from api.api.resources.site import SITE_COLUMNS, SITE_SERIALIZER
+    from api.api.schemas import SiteSchema
+    from api.commons.serialization import dumps
+    from api.extensions import db
+    from api.models import Site
+
+    schema = SiteSchema(many=True)
+    for page_size in page_sizes:
+
+        def schema_path():
+            sites = Site.query.order_by(Site.id).limit(page_size).all()
+            body = json.dumps(schema.dump(sites))
+            db.session.expunge_all()
+            return body
+
+        def lean_path():
+            query = db.session.query(*SITE_COLUMNS).order_by(Site.id)
+            return dumps(SITE_SERIALIZER.dump(query.limit(page_size).all()))
+
+        if json.loads(schema_path()) != json.loads(lean_path()):
+            raise click.ClickException(f"Outputs differ at page size {page_size}")
+        count = len(json.loads(lean_path()))
+        schema_time = min(timeit.repeat(schema_path, number=1, repeat=repeat))
+        lean_time = min(timeit.repeat(lean_path, number=1, repeat=repeat))
+        click.echo(
+            f"page-size={page_size} rows={count} schema={schema_time * 1000:.2f}ms "
+            f"lean={lean_time * 1000:.2f}ms speedup={schema_time / lean_time:.1f}x"
+        )
+
+
+def retry_due_urls(batch_size: int) -> int:
+    """Extract the due URLs of the dead letter queue, returns how many."""
+    retried = set()
+    while urls := dlq.due(dlq.DEAD_LETTER_QUEUE, limit=batch_size, exclude=retried):
+        click.echo(f"Retrying {len(urls)} url(s) from the dead letter queue")
+        retried.update(urls)
+        extract_sites(iter(urls))
+    return len(retried)
+
+
+def retry_due_no_admin_sites() -> int:
+    """Resolve the due sites of the 'no admin' queue again, returns how many."""
+    from api.extensions import db
+    from api.models import Site
+
+    site_ids = dlq.due(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)
+    if not site_ids:
+        return 0
+    click.echo(f"Retrying {len(site_ids)} site(s) from the admin dead letter queue")
+    no_admin_area = current_app.config.get("NO_ADMIN_AREA")
+    Site.query.filter(
+        Site.id.in_(site_ids), Site.admin_area == no_admin_area
+    ).update({"admin_area": None}, synchronize_session=False)
+    db.session.commit()
+    cb_transform.process_admin_areas()
+    unresolved = {
+        site_id
+        for (site_id,) in db.session.query(Site.id).filter(
+            Site.id.in_(site_ids), Site.admin_area == no_admin_area
+        )
+    }
+    dlq.remove(
+        dlq.NO_ADMIN_DEAD_LETTER_QUEUE,
+        (site_id for site_id in site_ids if site_id not in unresolved),
     )
+    return len(site_ids)
+
+
+def publish_sites():
+    """Refresh site rollups and bump the sites data generation."""
+    click.echo("Refreshing site rollups...")
+    rollups.refresh_rollups()
+    generation = DataGeneration.bump("sites")
+    click.echo(f"Sites data generation {generation.value}")
+
+
+def extract_sites(urls: typing.Iterator[str]):
+    """Extract and transform sites using the configured `EXTRACT_ENGINE`."""
     timeout = current_app.config.get("RESPONSE_TIMEOUT_SECONDS")
+    if current_app.config.get("EXTRACT_ENGINE") == "asyncio":
+        click.echo(f"Extracting site data, engine=asyncio timeout={timeout}")
+        async_extract.extract_sites(urls, timeout)
+        cb_transform.process_admin_areas()
+        checkpoints.mark_transformed()
+        return
     chunk_size = current_app.config.get("SITE_CHUNK_SIZE")
     click.echo(f"Extracting site data, chunk-size={chunk_size} timeout={timeout}")
-    while cb_extract.process_chunk(
-        master_site_urls, chunk_size=chunk_size, timeout=timeout
-    ):
+    while cb_extract.process_chunk(urls, chunk_size=chunk_size, timeout=timeout):
         cb_transform.process_admin_areas()
+        checkpoints.mark_transformed()
 
-    # DLQ processing
-    dlq_retries = current_app.config.get("PROCESSING_RETRY_COUNT")
-    retry_urls = dlq.unload_dlq(dlq.DEAD_LETTER_QUEUE)
-    for retry in range(dlq_retries):
-        while cb_extract.process_chunk(
-            retry_urls, chunk_size=chunk_size, timeout=timeout
-        ):
-            cb_transform.process_admin_areas()
-        else:
-            click.echo("DLQ cleared!")
-            break
-    else:
-        dlq.log_unprocessed_dlq()
-    dlq.log_no_admin_dlq()
+
+def run_pipeline(urls: typing.Iterator[str]):
+    """Extract and transform sites with the streaming load pipeline."""
+    pipeline.run(urls, current_app.config.get("RESPONSE_TIMEOUT_SECONDS"))
+    checkpoints.mark_transformed()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,20 @@
 from api.models.user import User
 from api.models.site import Site
 from api.models.blocklist import TokenBlocklist
+from api.models.generation import DataGeneration
+from api.models.rollup import SiteRollup
+from api.models.checkpoint import LoadCheckpoint
+from api.models.dead_letter import DeadLetter
+from api.models.resolution import AdminAreaResolution
 
 
-__all__ = ["User", "Site", "TokenBlocklist"]
+__all__ = [
+    "User",
+    "Site",
+    "TokenBlocklist",
+    "DataGeneration",
+    "SiteRollup",
+    "LoadCheckpoint",
+    "DeadLetter",
+    "AdminAreaResolution",
+]
@@ -0,0 +1,15 @@
+from api.extensions import db
+
+
+class LoadCheckpoint(db.Model):
+    """Load checkpoint.
+
+    Progress of a network URL through the latest `load_sites` run, see
+    `api.checkpoints`.
+    """
+
+    url = db.Column(db.String(512), primary_key=True)
+    status = db.Column(db.String(16), nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    updated = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,18 @@
+from api.extensions import db
+
+
+class DeadLetter(db.Model):
+    """Dead letter.
+
+    An item (network URL or site ID) that failed processing, queued for retry
+    once `next_attempt` has passed. See `api.dlq`.
+    """
+
+    queue = db.Column(db.String(16), primary_key=True)
+    item = db.Column(db.String(512), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error_class = db.Column(db.String(80), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt = db.Column(db.DateTime, nullable=False, index=True)
+    created = db.Column(db.DateTime, nullable=False)
+    updated = db.Column(db.DateTime, nullable=False)
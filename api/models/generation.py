@@ -0,0 +1,32 @@
+import datetime
+
+from api.extensions import db
+
+
+class DataGeneration(db.Model):
+    """Data generation counter.
+
+    Counts the loads of a named dataset, so anything derived from it (e.g.
+    cached API responses) can tell when it is stale.
+    """
+
+    name = db.Column(db.String(80), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=True)
+
+    @classmethod
+    def current(cls, name):
+        """Get a dataset's generation, an unsaved generation 0 if never bumped."""
+        return db.session.get(cls, name) or cls(name=name, value=0)
+
+    @classmethod
+    def bump(cls, name, now=None):
+        """Increment a dataset's generation and commit."""
+        generation = db.session.get(cls, name)
+        if generation is None:
+            generation = cls(name=name, value=0)
+            db.session.add(generation)
+        generation.value += 1
+        generation.updated = now or datetime.datetime.utcnow()
+        db.session.commit()
+        return generation
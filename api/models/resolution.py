@@ -0,0 +1,18 @@
+from api.extensions import db
+
+
+class AdminAreaResolution(db.Model):
+    """Admin area resolution.
+
+    Admin area a station's coordinates resolved to against a version of its
+    country's geoboundary dataset, see `api.resolutions`.
+    """
+
+    country = db.Column(db.String(3), primary_key=True)
+    latitude = db.Column(db.Float, primary_key=True)
+    longitude = db.Column(db.Float, primary_key=True)
+    # Hash of the geoboundary dataset and settings the resolution was made with
+    version = db.Column(db.String(64), nullable=False)
+    shape_id = db.Column(db.String(255), nullable=False)
+    admin_level = db.Column(db.String(4), nullable=True)
+    updated = db.Column(db.DateTime, nullable=False)
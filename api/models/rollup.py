@@ -0,0 +1,19 @@
+from api.extensions import db
+
+
+class SiteRollup(db.Model):
+    """Site rollup.
+
+    Station count and bike totals of the sites in a country (`level` is
+    `country`, `key` the country code) or in an admin area of a country
+    (`level` is `admin_area`, `key` the admin area). Rebuilt at publish time
+    by `api.rollups`.
+    """
+
+    level = db.Column(db.String(16), primary_key=True)
+    country = db.Column(db.String(3), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    site_count = db.Column(db.Integer, nullable=False)
+    available = db.Column(db.Integer, nullable=False)
+    used = db.Column(db.Integer, nullable=False)
+    updated = db.Column(db.DateTime, nullable=False)
@@ -1,11 +1,46 @@
+from sqlalchemy.dialects import postgresql
+
+from api.commons import geo
 from api.extensions import db
 
+# Byte ordered on every dialect, geohash prefix ranges must not depend on the
+# database locale (SQLite already compares bytes)
+GEOHASH_TYPE = db.String(12).with_variant(
+    postgresql.VARCHAR(12, collation="C"), "postgresql"
+)
+
+
+def default_geohash(context):
+    params = context.get_current_parameters()
+    return geo.encode(params["latitude"], params["longitude"])
+
 
 class Site(db.Model):
     """Site model.
 
     Defines a City bikes station.
     """
+    __table_args__ = (
+        # Sites by admin area, unresolved sites are covered by the index below
+        db.Index(
+            "ix_site_admin_area",
+            "admin_area",
+            sqlite_where=db.text("admin_area IS NOT NULL"),
+            postgresql_where=db.text("admin_area IS NOT NULL"),
+        ),
+        # Sites by country and admin area
+        db.Index("ix_site_country_admin_area", "country", "admin_area"),
+        # Spatial prefilter, see `api.commons.geo`
+        db.Index("ix_site_geohash", "geohash"),
+        # Sites still awaiting admin area resolution, by country
+        db.Index(
+            "ix_site_unresolved",
+            "country",
+            sqlite_where=db.text("admin_area IS NULL"),
+            postgresql_where=db.text("admin_area IS NULL"),
+        ),
+    )
+
     # id is concatenation of parent network location ID and the station ID
     id = db.Column(db.String(255), primary_key=True)
     # Parent network location city
@@ -26,3 +61,7 @@ class Site(db.Model):
     available = db.Column(db.Integer, default=0)
     # GeoBoundaries admin area as determined by this service
     admin_area = db.Column(db.String(255), nullable=True)
+    # GeoBoundaries admin level (ADM3...ADM0) the admin area was found at
+    admin_level = db.Column(db.String(4), nullable=True)
+    # Geohash of the station coordinates, set from them when not given
+    geohash = db.Column(GEOHASH_TYPE, nullable=True, default=default_geohash)
@@ -0,0 +1,134 @@
+"""Streaming load pipeline.
+
+Runs extraction and transformation as concurrent stages connected by bounded
+queues, so network I/O overlaps with geometry work:
+
+- fetch: the asyncio extraction engine pulls network URLs.
+- load: each network response is parsed and its stations upserted.
+- transform: admin areas are resolved for the stations just loaded.
+
+Each stage only handles what the previous stage produced, the transform stage
+never scans the whole `site` table. A full queue blocks the stage feeding it,
+so a slow stage throttles the ones upstream rather than buffering without
+bound. If any stage fails the others are stopped and the error is re-raised.
+"""
+import asyncio
+import queue
+import threading
+import typing
+
+import click
+from flask import current_app
+
+from api import async_extract
+from api import cb_extract
+from api import cb_transform
+
+
+class PipelineAborted(Exception):
+    """Exception raised in a stage when another stage has failed."""
+
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class Stage(threading.Thread):
+    """A pipeline stage running `target` in its own thread and app context."""
+
+    def __init__(self, name: str, target: typing.Callable, abort: threading.Event):
+        super().__init__(name=f"pipeline-{name}", daemon=True)
+        self.app = current_app._get_current_object()
+        self.target = target
+        self.abort = abort
+        self.error = None
+
+    def run(self):
+        with self.app.app_context():
+            try:
+                self.target()
+            except PipelineAborted:
+                pass
+            except Exception as e:
+                click.echo(f"Pipeline stage {self.name} failed: {e!r}")
+                self.error = e
+                self.abort.set()
+
+
+def put(q: queue.Queue, item: typing.Any, abort: threading.Event):
+    """Put an item on a bounded queue, giving up if the pipeline is aborted."""
+    while not abort.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+    raise PipelineAborted()
+
+
+def get(q: queue.Queue, abort: threading.Event) -> typing.Iterator[typing.Any]:
+    """Iterate over a queue until the upstream stage is done."""
+    while not abort.is_set():
+        try:
+            item = q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if item is _DONE:
+            return
+        yield item
+    raise PipelineAborted()
+
+
+def run(urls: typing.Iterable[str], timeout: float = 1.0):
+    """Run the load pipeline over network `urls`.
+
+    Queues between stages hold at most `PIPELINE_QUEUE_SIZE` items. Extraction
+    settings are shared with `async_extract.extract_sites`.
+    """
+    config = current_app.config
+    queue_size = config.get("PIPELINE_QUEUE_SIZE")
+    responses = queue.Queue(maxsize=queue_size)
+    loaded = queue.Queue(maxsize=queue_size)
+    abort = threading.Event()
+
+    def fetch():
+        asyncio.run(
+            async_extract.extract(
+                urls,
+                lambda response: put(responses, response, abort),
+                concurrency=config.get("EXTRACT_CONCURRENCY"),
+                rate_per_host=config.get("EXTRACT_RATE_PER_HOST"),
+                timeout=timeout,
+                max_retries=config.get("EXTRACT_MAX_RETRIES"),
+            )
+        )
+        put(responses, _DONE, abort)
+
+    def load():
+        for response in get(responses, abort):
+            site_ids = cb_extract.process(response)
+            pending = cb_transform.select_pending(site_ids)
+            if pending:
+                put(loaded, pending, abort)
+        put(loaded, _DONE, abort)
+
+    def transform():
+        with cb_transform.AdminAreaWriter() as writer:
+            for pending in get(loaded, abort):
+                click.echo(f"{len(pending)} loaded site(s) with no admin area")
+                cb_transform.process_pending(pending, writer)
+        cb_transform.log_cell_cache_stats()
+
+    stages = [
+        Stage("fetch", fetch, abort),
+        Stage("load", load, abort),
+        Stage("transform", transform, abort),
+    ]
+    click.echo(f"Running load pipeline, queue-size={queue_size} timeout={timeout}")
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
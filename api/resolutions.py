@@ -0,0 +1,162 @@
+"""Admin area resolutions.
+
+Persists the admin area each station's coordinates resolved to in the
+`admin_area_resolution` table. `cb_transform` consults it before any geometry
+is loaded, and only resolves coordinates it has not seen against geoboundary
+features. Station coordinates rarely change between `load_sites` runs, so a
+steady state run resolves nearly every pending site from the table.
+
+Resolutions are stamped with the `dataset_version` of their country. A new
+geoboundary release, or a change of the settings resolution depends on, gives
+the country a new version; its stored resolutions are then ignored, and
+replaced as sites are resolved again. Sites left with `NO_ADMIN_AREA` are not
+stored, so they are retried as before.
+"""
+import datetime
+import hashlib
+import itertools
+import json
+import operator
+import typing
+
+import click
+from sqlalchemy import and_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from api.extensions import db
+from api.models import AdminAreaResolution, Site
+
+from api import etl_utils
+from api import gb_index
+from api import gb_store
+
+# Maximum number of site IDs per `IN` clause, and of rows per upsert
+QUERY_BATCH_SIZE = 500
+
+UPSERT_DIALECTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert,
+}
+
+
+def dataset_version(country: str) -> typing.Optional[str]:
+    """Version of a country's geoboundary dataset, `None` if it has none.
+
+    Hashes the checksum of the stored finest level resource, as recorded in
+    its `gb_store` manifest, with the levels and snapping distance lookups use.
+    geoBoundaries releases the levels of a country together, so the finest
+    level stands for all of them.
+    """
+    index = gb_index.get_levelled_index(country)
+    level = index.finest_level()
+    if level is None:
+        return None
+    manifest = gb_store.ensure(index.url(level))
+    key = [manifest["sha256"], index.levels, index.snap_distance_km]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def apply_known(rows: typing.Sequence[tuple], writer) -> typing.List[tuple]:
+    """Resolve `(id, country, latitude, longitude)` rows from stored resolutions.
+
+    Queues the admin areas of rows whose coordinates were resolved against
+    the current dataset version on `writer` (a `cb_transform.AdminAreaWriter`),
+    and returns the other rows, in order, to be resolved against geometries.
+    """
+    site = Site.__table__
+    resolution = AdminAreaResolution.__table__
+    known = {}
+    for country, group in itertools.groupby(rows, key=operator.itemgetter(1)):
+        version = dataset_version(country)
+        if version is None:
+            continue
+        site_ids = (row[0] for row in group)
+        for batch in etl_utils.chunk(site_ids, QUERY_BATCH_SIZE):
+            query = (
+                select(site.c.id, resolution.c.shape_id, resolution.c.admin_level)
+                .join(
+                    resolution,
+                    and_(
+                        resolution.c.country == site.c.country,
+                        resolution.c.latitude == site.c.latitude,
+                        resolution.c.longitude == site.c.longitude,
+                    ),
+                )
+                .where(site.c.id.in_(list(batch)), resolution.c.version == version)
+            )
+            for site_id, shape_id, admin_level in db.session.execute(query):
+                known[site_id] = (shape_id, admin_level)
+    for site_id, (shape_id, admin_level) in known.items():
+        writer.add(site_id, shape_id, admin_level)
+    if rows:
+        click.echo(f"Resolved {len(known)}/{len(rows)} site(s) from stored resolutions")
+    return [row for row in rows if row[0] not in known]
+
+
+def remember(site_ids: typing.Iterable[str]):
+    """Store the resolutions of sites whose admin area was resolved.
+
+    Must run once the sites' admin areas are saved.
+    """
+    site = Site.__table__
+    rows = []
+    for batch in etl_utils.chunk(iter(site_ids), QUERY_BATCH_SIZE):
+        rows.extend(
+            db.session.execute(
+                select(
+                    site.c.country,
+                    site.c.latitude,
+                    site.c.longitude,
+                    site.c.admin_area,
+                    site.c.admin_level,
+                ).where(site.c.id.in_(list(batch)), site.c.admin_level.isnot(None))
+            )
+        )
+    versions = {country: dataset_version(country) for country in {r[0] for r in rows}}
+    now = datetime.datetime.utcnow()
+    # Keyed by primary key, stations sharing coordinates are stored once
+    values = {
+        (country, latitude, longitude): dict(
+            country=country,
+            latitude=latitude,
+            longitude=longitude,
+            version=versions[country],
+            shape_id=shape_id,
+            admin_level=admin_level,
+            updated=now,
+        )
+        for country, latitude, longitude, shape_id, admin_level in rows
+        if versions[country] is not None
+    }
+    if values:
+        save(list(values.values()))
+
+
+def save(values: typing.List[dict]):
+    """Upsert resolution rows and commit.
+
+    Dialects without upsert support fall back to merging each row through the
+    ORM.
+    """
+    resolution = AdminAreaResolution.__table__
+    insert = UPSERT_DIALECTS.get(db.engine.dialect.name)
+    if insert is None:
+        for value in values:
+            db.session.merge(AdminAreaResolution(**value))
+        db.session.commit()
+        return
+    for batch in etl_utils.chunk(iter(values), QUERY_BATCH_SIZE):
+        stmt = insert(resolution).values(list(batch))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                resolution.c.country,
+                resolution.c.latitude,
+                resolution.c.longitude,
+            ],
+            set_={
+                column: stmt.excluded[column]
+                for column in ("version", "shape_id", "admin_level", "updated")
+            },
+        )
+        db.session.execute(stmt)
+    db.session.commit()
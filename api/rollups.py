@@ -0,0 +1,65 @@
+"""Site rollups.
+
+Maintains `SiteRollup`, station counts and bike totals per country and per
+admin area, so aggregate reads never scan the `site` table.
+
+Rollups are refreshed at publish time only: `refresh_rollups()` rebuilds them
+when `load_sites` publishes its run, together with the "sites" data generation
+bump that invalidates cached responses. Until then they reflect the previous
+published run; site changes made in between, by the loader or otherwise, are
+not counted.
+"""
+import datetime
+import typing
+
+from sqlalchemy import delete, func, insert, literal, select
+
+from api.extensions import db
+from api.models import Site, SiteRollup
+
+LEVELS = ("country", "admin_area")
+
+
+def rollup_select(level: str, countries: typing.Optional[typing.Collection[str]]):
+    """Select the `level` rollups of all sites, or of sites in `countries`."""
+    site = Site.__table__
+    key = site.c.country if level == "country" else site.c.admin_area
+    query = (
+        select(
+            literal(level),
+            site.c.country,
+            key,
+            func.count(),
+            func.coalesce(func.sum(site.c.available), 0),
+            func.coalesce(func.sum(site.c.used), 0),
+            literal(datetime.datetime.utcnow()),
+        )
+        .where(key.isnot(None))
+        .group_by(site.c.country, key)
+    )
+    if countries is not None:
+        query = query.where(site.c.country.in_(countries))
+    return query
+
+
+def refresh_rollups(
+    countries: typing.Optional[typing.Collection[str]] = None, session=None
+):
+    """Rebuild the rollups of `countries`, or all rollups if `None`.
+
+    Runs in `session` (`db.session` by default) without committing.
+    """
+    session = session or db.session
+    rollup = SiteRollup.__table__
+    columns = [column.name for column in rollup.columns]
+    clear = delete(rollup)
+    if countries is not None:
+        countries = sorted(countries)
+        if not countries:
+            return
+        clear = clear.where(rollup.c.country.in_(countries))
+    session.execute(clear)
+    for level in LEVELS:
+        session.execute(
+            insert(rollup).from_select(columns, rollup_select(level, countries))
+        )
@@ -0,0 +1,34 @@
+"""site rollup
+
+Revision ID: 2f8b6e0d4a13
+Revises: e41a9d6c3f27
+Create Date: 2026-10-18 15:47:09.662180
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8b6e0d4a13'
+down_revision = 'e41a9d6c3f27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'site_rollup',
+        sa.Column('level', sa.String(length=16), nullable=False),
+        sa.Column('country', sa.String(length=3), nullable=False),
+        sa.Column('key', sa.String(length=255), nullable=False),
+        sa.Column('site_count', sa.Integer(), nullable=False),
+        sa.Column('available', sa.Integer(), nullable=False),
+        sa.Column('used', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('level', 'country', 'key'),
+    )
+
+
+def downgrade():
+    op.drop_table('site_rollup')
@@ -0,0 +1,44 @@
+"""site indexes
+
+Revision ID: 5d2e7a1c9b40
+Revises: 8c345f960376
+Create Date: 2026-10-18 09:12:44.108311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e7a1c9b40'
+down_revision = '8c345f960376'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_site_admin_area',
+        'site',
+        ['admin_area'],
+        unique=False,
+        sqlite_where=sa.text('admin_area IS NOT NULL'),
+        postgresql_where=sa.text('admin_area IS NOT NULL'),
+    )
+    op.create_index(
+        'ix_site_country_admin_area', 'site', ['country', 'admin_area'], unique=False
+    )
+    op.create_index(
+        'ix_site_unresolved',
+        'site',
+        ['country'],
+        unique=False,
+        sqlite_where=sa.text('admin_area IS NULL'),
+        postgresql_where=sa.text('admin_area IS NULL'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_site_unresolved', table_name='site')
+    op.drop_index('ix_site_country_admin_area', table_name='site')
+    op.drop_index('ix_site_admin_area', table_name='site')
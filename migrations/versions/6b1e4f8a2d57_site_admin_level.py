@@ -0,0 +1,24 @@
+"""site admin level
+
+Revision ID: 6b1e4f8a2d57
+Revises: c3d7e9f15a62
+Create Date: 2026-10-18 19:05:37.240918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1e4f8a2d57'
+down_revision = 'c3d7e9f15a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('site', sa.Column('admin_level', sa.String(length=4), nullable=True))
+
+
+def downgrade():
+    op.drop_column('site', 'admin_level')
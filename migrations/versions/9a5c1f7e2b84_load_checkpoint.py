@@ -0,0 +1,36 @@
+"""load checkpoint
+
+Revision ID: 9a5c1f7e2b84
+Revises: 2f8b6e0d4a13
+Create Date: 2026-10-18 17:05:33.418027
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a5c1f7e2b84'
+down_revision = '2f8b6e0d4a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'load_checkpoint',
+        sa.Column('url', sa.String(length=512), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('url'),
+    )
+    op.create_index(
+        'ix_load_checkpoint_status', 'load_checkpoint', ['status'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_load_checkpoint_status', table_name='load_checkpoint')
+    op.drop_table('load_checkpoint')
@@ -0,0 +1,30 @@
+"""data generation
+
+Revision ID: b7f3c2d81e65
+Revises: 5d2e7a1c9b40
+Create Date: 2026-10-18 11:02:17.531904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f3c2d81e65'
+down_revision = '5d2e7a1c9b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'data_generation',
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('value', sa.Integer(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade():
+    op.drop_table('data_generation')
@@ -0,0 +1,39 @@
+"""dead letter
+
+Revision ID: c3d7e9f15a62
+Revises: 9a5c1f7e2b84
+Create Date: 2026-10-18 18:31:12.904551
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d7e9f15a62'
+down_revision = '9a5c1f7e2b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dead_letter',
+        sa.Column('queue', sa.String(length=16), nullable=False),
+        sa.Column('item', sa.String(length=512), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('error_class', sa.String(length=80), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_attempt', sa.DateTime(), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('queue', 'item'),
+    )
+    op.create_index(
+        'ix_dead_letter_next_attempt', 'dead_letter', ['next_attempt'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_dead_letter_next_attempt', table_name='dead_letter')
+    op.drop_table('dead_letter')
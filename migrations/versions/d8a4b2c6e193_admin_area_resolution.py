@@ -0,0 +1,34 @@
+"""admin area resolution
+
+Revision ID: d8a4b2c6e193
+Revises: 6b1e4f8a2d57
+Create Date: 2026-10-18 19:48:16.730524
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8a4b2c6e193'
+down_revision = '6b1e4f8a2d57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'admin_area_resolution',
+        sa.Column('country', sa.String(length=3), nullable=False),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.Column('version', sa.String(length=64), nullable=False),
+        sa.Column('shape_id', sa.String(length=255), nullable=False),
+        sa.Column('admin_level', sa.String(length=4), nullable=True),
+        sa.Column('updated', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('country', 'latitude', 'longitude'),
+    )
+
+
+def downgrade():
+    op.drop_table('admin_area_resolution')
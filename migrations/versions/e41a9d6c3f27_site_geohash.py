@@ -0,0 +1,68 @@
+"""site geohash
+
+Revision ID: e41a9d6c3f27
+Revises: b7f3c2d81e65
+Create Date: 2026-10-18 14:20:51.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from api.commons import geo
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a9d6c3f27'
+down_revision = 'b7f3c2d81e65'
+branch_labels = None
+depends_on = None
+
+site = sa.table(
+    'site',
+    sa.column('id', sa.String),
+    sa.column('latitude', sa.Float),
+    sa.column('longitude', sa.Float),
+    sa.column('geohash', sa.String),
+)
+
+
+def upgrade():
+    op.add_column('site', sa.Column('geohash', sa.String(length=12), nullable=True))
+
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(site.c.id, site.c.latitude, site.c.longitude))
+    updates = [
+        {'site_id': id_, 'site_geohash': geo.encode(latitude, longitude)}
+        for id_, latitude, longitude in rows
+    ]
+    if updates:
+        bind.execute(
+            site.update()
+            .where(site.c.id == sa.bindparam('site_id'))
+            .values(geohash=sa.bindparam('site_geohash')),
+            updates,
+        )
+    op.create_index('ix_site_geohash', 'site', ['geohash'], unique=False)
+
+    if bind.dialect.name == 'postgresql':
+        op.execute(
+            """
+            CREATE FUNCTION haversine_km(
+                lat1 double precision, lon1 double precision,
+                lat2 double precision, lon2 double precision
+            ) RETURNS double precision AS $$
+                SELECT 2 * 6371.0088 * asin(least(1.0, sqrt(
+                    sin(radians(lat2 - lat1) / 2) ^ 2
+                    + cos(radians(lat1)) * cos(radians(lat2))
+                    * sin(radians(lon2 - lon1) / 2) ^ 2
+                )))
+            $$ LANGUAGE sql IMMUTABLE STRICT
+            """
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP FUNCTION haversine_km')
+    op.drop_index('ix_site_geohash', table_name='site')
+    op.drop_column('site', 'geohash')
@@ -0,0 +1,43 @@
+"""site geohash collation
+
+Revision ID: f2b7c4e9a061
+Revises: d8a4b2c6e193
+Create Date: 2026-10-18 21:05:37.412968
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7c4e9a061'
+down_revision = 'd8a4b2c6e193'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Geohash prefix ranges compare bytes, SQLite already does. Changing the
+    # collation rebuilds ix_site_geohash.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.alter_column(
+        'site',
+        'geohash',
+        existing_type=sa.String(length=12),
+        type_=postgresql.VARCHAR(length=12, collation='C'),
+        existing_nullable=True,
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.alter_column(
+        'site',
+        'geohash',
+        existing_type=postgresql.VARCHAR(length=12, collation='C'),
+        type_=sa.String(length=12),
+        existing_nullable=True,
+    )
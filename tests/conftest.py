@@ -1,16 +1,23 @@
 import datetime
+import functools
 import json
 import pytest
 from pytest_factoryboy import register
 from unittest.mock import Mock
 
+import httpx
 from dotenv import load_dotenv
 from shapely.geometry import shape, Point
 
 from api.models import User, Site
 from api.app import create_app
 from api.extensions import db as _db
+from api.extensions import response_cache
+from api.auth import helpers as auth_helpers
+from api import async_extract as ae
 from api import gb_extract as gbe
+from api import gb_index as gbi
+from api import gb_store as gbs
 
 from tests.factories import UserFactory, SiteFactory
 
@@ -31,6 +38,9 @@ def db(app):
 
     with app.app_context():
         _db.create_all()
+    response_cache.backend.clear()
+    auth_helpers.REVOKED_CACHE.clear()
+    auth_helpers.USER_CACHE.clear()
 
     yield _db
 
@@ -158,7 +168,86 @@ def features(coords):
 
 
 @pytest.fixture
-def fake_load_geoboundary_data(monkeypatch, features):
-    def mock_meth(*args, **kwargs):
-        return features
-    monkeypatch.setattr(gbe, "load_geoboundary_data", mock_meth)
+def store_dir(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, "GEOBOUNDARY_STORE_DIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def fake_request_resource(monkeypatch, features):
+    requests = []
+
+    def mock_request(url, headers):
+        requests.append(headers)
+        if headers.get("If-None-Match") == '"v1"':
+            return Mock(ok=False, status_code=304)
+        response = Mock(ok=True, status_code=200, headers={"ETag": '"v1"'})
+        response.json.return_value = {"features": features}
+        return response
+
+    monkeypatch.setattr(gbs, "request_resource", mock_request)
+    return requests
+
+
+@pytest.fixture
+def fake_load_geoboundary_data(
+    monkeypatch, features, store_dir, fake_request_resource
+):
+    def mock_url(country_code, admin_area_level):
+        if admin_area_level == "ADM3":
+            return f"https://foo.com/{country_code}.geojson"
+        return f"https://foo.com/{country_code}-{admin_area_level}.geojson"
+    monkeypatch.setattr(gbe, "fetch_geoboundary_level_url", mock_url)
+    gbi.GEOMETRY_CACHE.clear()
+    gbi.CELL_CACHE.clear()
+    yield
+    gbi.GEOMETRY_CACHE.clear()
+    gbi.CELL_CACHE.clear()
+
+
+@pytest.fixture
+def network_data():
+    return {
+        "network": {
+            "id": "velib",
+            "location": {"city": "Paris", "country": "FR"},
+            "stations": [
+                {
+                    "id": f"station-{i}",
+                    "latitude": 48.85 + i / 1000,
+                    "longitude": 2.35,
+                    "name": f"Station {i}",
+                    "timestamp": "2021-12-06T08:30:36.942438Z",
+                    "empty_slots": i,
+                    "free_bikes": 10 - i,
+                }
+                for i in range(5)
+            ],
+        }
+    }
+
+
+@pytest.fixture
+def network_response(network_data):
+    response = Mock(ok=True, status_code=200, url="https://foo.com/velib")
+    response.json.return_value = network_data
+    return response
+
+
+@pytest.fixture
+def fake_networks(monkeypatch, network_data):
+    stations = network_data["network"]["stations"]
+    for i, station in enumerate(stations):
+        station["latitude"], station["longitude"] = 1.0 + i / 1000, 9.0
+    stations[-1]["latitude"] = -1.0  # Outside coords fixture
+
+    def handler(request):
+        if request.url.path == "/broken":
+            return httpx.Response(500)
+        return httpx.Response(200, json=network_data)
+
+    monkeypatch.setattr(
+        ae,
+        "extract",
+        functools.partial(ae.extract, transport=httpx.MockTransport(handler)),
+    )
@@ -0,0 +1,72 @@
+import asyncio
+
+import httpx
+
+from api import async_extract as ae
+from api import dlq
+
+
+def run_extract(urls, handler, **kwargs):
+    responses = []
+    asyncio.run(
+        ae.extract(
+            urls, responses.append, transport=httpx.MockTransport(handler), **kwargs
+        )
+    )
+    return responses
+
+
+def test_extract_feeds_responses():
+    def handler(request):
+        return httpx.Response(200, json={"url": str(request.url)})
+
+    urls = [f"https://foo.com/networks/{i}" for i in range(25)]
+    responses = run_extract(urls, handler, concurrency=5)
+    assert sorted(r.url for r in responses) == sorted(urls)
+    assert all(r.ok and r.json()["url"] == r.url for r in responses)
+
+
+def test_extract_bounded_concurrency():
+    in_flight, peak = 0, 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200)
+
+    run_extract([f"https://foo.com/{i}" for i in range(20)], handler, concurrency=3)
+    assert peak == 3
+
+
+def test_extract_backs_off_on_429():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url)
+        if len(attempts) < 3:
+            return httpx.Response(429, headers={"Retry-After": "0.01"})
+        return httpx.Response(200)
+
+    responses = run_extract(["https://foo.com/a"], handler, max_retries=3)
+    assert len(attempts) == 3
+    assert [r.status_code for r in responses] == [200]
+
+
+def test_extract_gives_up_after_retries():
+    def handler(request):
+        return httpx.Response(429, headers={"Retry-After": "0"})
+
+    responses = run_extract(["https://foo.com/a"], handler, max_retries=2)
+    assert [(r.status_code, r.ok) for r in responses] == [(429, False)]
+
+
+def test_extract_transport_error_to_dlq(db):
+    def handler(request):
+        raise httpx.ConnectError("boom", request=request)
+
+    assert run_extract(["https://foo.com/a"], handler) == []
+    [letter] = dlq.items(dlq.DEAD_LETTER_QUEUE)
+    assert (letter.item, letter.error_class) == ("https://foo.com/a", "ConnectError")
@@ -1,3 +1,10 @@
+import datetime
+from unittest.mock import patch
+
+from api.auth import helpers
+from api.models import TokenBlocklist, User
+
+
 def test_revoke_access_token(client, admin_headers):
     resp = client.delete("/auth/revoke_access", headers=admin_headers)
     assert resp.status_code == 200
@@ -12,3 +19,44 @@ def test_revoke_refresh_token(client, admin_refresh_headers):
 
     resp = client.post("/auth/refresh", headers=admin_refresh_headers)
     assert resp.status_code == 401
+
+
+def test_token_and_user_cached(client, db, admin_user, admin_headers):
+    resp = client.get("/api/v1/users", headers=admin_headers)
+    assert resp.status_code == 200
+    assert len(helpers.REVOKED_CACHE) == 1
+    assert helpers.USER_CACHE.get(str(admin_user.id)) is not None
+
+    # Cached lookups answer without touching the blocklist or user tables
+    with patch.object(TokenBlocklist, "query") as blocklist_query, patch.object(
+        User, "query"
+    ) as user_query:
+        resp = client.get("/api/v1/sites", headers=admin_headers)
+    assert resp.status_code == 200
+    assert not blocklist_query.mock_calls
+    assert not user_query.mock_calls
+
+    resp = client.put(
+        f"/api/v1/users/{admin_user.id}", json={"email": "new@admin.com"},
+        headers=admin_headers,
+    )
+    assert resp.status_code == 200
+    assert helpers.USER_CACHE.get(str(admin_user.id)) is None
+
+
+def test_purge_expired_tokens(db, admin_user):
+    now = datetime.datetime.now()
+    for jti, expires in [("expired", -1), ("valid", 1)]:
+        db.session.add(
+            TokenBlocklist(
+                jti=jti,
+                token_type="access",
+                user_id=admin_user.id,
+                revoked=False,
+                expires=now + datetime.timedelta(hours=expires),
+            )
+        )
+    db.session.commit()
+
+    assert helpers.purge_expired_tokens(now) == 1
+    assert [token.jti for token in TokenBlocklist.query.all()] == ["valid"]
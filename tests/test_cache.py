@@ -0,0 +1,82 @@
+import pytest
+from flask import url_for
+
+from api.commons.cache import CacheBackend, LRUCacheBackend
+from api.extensions import response_cache
+from api.models import DataGeneration
+
+
+class FakeCacheBackend(CacheBackend):
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+
+    def get(self, key):
+        value = self.values.get(key)
+        self.hits += value is not None
+        return value
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def clear(self):
+        self.values.clear()
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    backend = FakeCacheBackend()
+    monkeypatch.setattr(response_cache, "backend", backend)
+    return backend
+
+
+def test_lru_cache_backend():
+    backend = LRUCacheBackend(max_entries=2)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    assert backend.get("a") == 1
+    backend.set("c", 3)
+    assert backend.get("b") is None
+    assert (backend.get("a"), backend.get("c")) == (1, 3)
+    backend.clear()
+    assert len(backend) == 0
+
+
+def test_sites_response_cache(client, db, site, fake_backend, admin_headers):
+    db.session.add(site)
+    db.session.commit()
+    DataGeneration.bump("sites")
+
+    rep = client.get(
+        url_for('api.sites', admin_area="AREA-51", per_page=10), headers=admin_headers
+    )
+    assert rep.status_code == 200
+    assert rep.last_modified is not None
+    etag, _ = rep.get_etag()
+    assert etag
+    assert len(rep.get_json()["results"]) == 1
+
+    # Same query in another arg order is served from cache, and is not modified
+    rep = client.get(
+        url_for('api.sites', per_page=10, admin_area="AREA-51"),
+        headers={**admin_headers, "If-None-Match": f'"{etag}"'},
+    )
+    assert rep.status_code == 304
+    assert fake_backend.hits == 1
+    assert len(fake_backend.values) == 1
+
+    # A load bumps the generation, the cached response is no longer used
+    site.admin_area = "AREA-52"
+    db.session.commit()
+    DataGeneration.bump("sites")
+    rep = client.get(
+        url_for('api.sites', admin_area="AREA-51", per_page=10),
+        headers={**admin_headers, "If-None-Match": f'"{etag}"'},
+    )
+    assert rep.status_code == 200
+    assert rep.get_etag()[0] != etag
+    assert rep.get_json()["results"] == []
+
+    # Caching never bypasses authentication
+    rep = client.get(url_for('api.sites', admin_area="AREA-51", per_page=10))
+    assert rep.status_code == 401
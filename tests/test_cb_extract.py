@@ -1,14 +1,76 @@
 from api import cb_extract as cbe
 from api import dlq
+from api.commons import geo
+from api.models import Site
 
 
-def test_process_chunk(request, capsys, chunkable_generator_str):
-    def cleanup():
-        assert len(list(dlq.unload_dlq(dlq.DEAD_LETTER_QUEUE))) == 14
-    request.addfinalizer(cleanup)
+def test_process_chunk(db, capsys, chunkable_generator_str):
     assert cbe.process_chunk(chunkable_generator_str, chunk_size=5)
     assert cbe.process_chunk(chunkable_generator_str, chunk_size=5)
     assert cbe.process_chunk(chunkable_generator_str, chunk_size=5)
     assert not cbe.process_chunk(chunkable_generator_str, chunk_size=5)
     captured = capsys.readouterr()
     assert "Chunks exhausted!" in captured.out
+    [letter] = dlq.items(dlq.DEAD_LETTER_QUEUE)
+    assert (letter.item, letter.attempts) == ("url", 14)
+
+
+def test_make_sites(db, network_response):
+    cbe.make_sites(network_response)
+    sites = Site.query.order_by(Site.id).all()
+    assert [s.id for s in sites] == [f"velib-station-{i}" for i in range(5)]
+    assert all(s.country == "FRA" and s.city == "Paris" for s in sites)
+    assert [s.available for s in sites] == [10, 9, 8, 7, 6]
+    assert all(s.geohash == geo.encode(s.latitude, s.longitude) for s in sites)
+
+
+def test_make_sites_updates_existing(db, network_response, network_data):
+    cbe.make_sites(network_response)
+    Site.query.filter_by(id="velib-station-0").update({"admin_area": "AREA-51"})
+    db.session.commit()
+
+    network_data["network"]["stations"][0]["free_bikes"] = 3
+    assert cbe.make_sites(network_response) == ["velib-station-0"]
+
+    db.session.expire_all()
+    assert Site.query.count() == 5
+    site = Site.query.get("velib-station-0")
+    assert site.available == 3
+    assert site.admin_area == "AREA-51"
+
+
+def test_make_sites_skips_unchanged(db, network_response, network_data):
+    assert len(cbe.make_sites(network_response)) == 5
+    Site.query.update({"admin_area": "AREA-51"})
+    db.session.commit()
+
+    assert cbe.make_sites(network_response) == []
+
+    # A station that moved needs its admin area resolving again
+    network_data["network"]["stations"][1]["latitude"] += 0.01
+    network_data["network"]["stations"][2]["timestamp"] = "2021-12-06T09:30:00Z"
+    assert cbe.make_sites(network_response) == ["velib-station-1", "velib-station-2"]
+
+    db.session.expire_all()
+    sites = {s.id: s for s in Site.query}
+    assert sites["velib-station-1"].admin_area is None
+    assert sites["velib-station-1"].geohash == geo.encode(48.861, 2.35)
+    assert sites["velib-station-2"].admin_area == "AREA-51"
+
+
+def test_upsert_sites_batches(db):
+    rows = [
+        dict(
+            id=f"site-{i}",
+            city="Paris",
+            country="FRA",
+            latitude=48.85,
+            longitude=2.35,
+            used=0,
+            available=i,
+        )
+        for i in range(7)
+    ]
+    cbe.upsert_sites(rows, batch_size=3)
+    assert Site.query.count() == 7
+    assert {s.geohash for s in Site.query} == {geo.encode(48.85, 2.35)}
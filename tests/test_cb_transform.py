@@ -1,10 +1,45 @@
+import pytest
+from sqlalchemy import event
+
 from api import cb_transform as cbt
+from api import dlq
+from api import gb_extract as gbe
+from api import gb_index as gbi
+from api import gb_store as gbs
 from api.models import Site
 
+init_transform_worker = cbt._init_transform_worker
+
+
+def fake_level_url(country_code, admin_area_level):
+    if admin_area_level == "ADM3":
+        return f"https://foo.com/{country_code}.geojson"
+    return f"https://foo.com/{country_code}-{admin_area_level}.geojson"
+
+
+def init_fake_transform_worker(config):
+    """Spawned workers import modules afresh, without the test's mocks.
+
+    Their geoboundary resources are stored by the test beforehand.
+    """
+    gbe.fetch_geoboundary_level_url = fake_level_url
+    init_transform_worker(config)
+
 
 def test_update_site_admin_area(site, db):
     assert site.admin_area == "AREA-51"
-    cbt.update_site_admin_area(site, "ROSWELL")
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        cbt.update_site_admin_area(site, "ROSWELL", "ADM3")
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    assert len([s for s in statements if s.startswith("UPDATE site ")]) == 1
+    assert (site.admin_area, site.admin_level) == ("ROSWELL", "ADM3")
     assert Site.query.get(site.id).admin_area == "ROSWELL"
 
 
@@ -23,3 +58,137 @@ def test_identify_admin_area_fail_outside(site, fake_load_geoboundary_data):
     site.latitude = -1.0  # Outside coords fixture
     site.longitude = 11.0
     assert not cbt.identify_admin_area(site)
+
+
+def test_process_admin_areas_batch(db, site_factory, fake_load_geoboundary_data):
+    inside = site_factory.create_batch(3, country="ITA", latitude=1.0, longitude=9.0)
+    outside = site_factory(country="ITA", latitude=-1.0, longitude=11.0)
+    db.session.add_all(inside + [outside])
+    db.session.commit()
+
+    cbt.process_admin_areas_batch()
+
+    db.session.expire_all()
+    for site in inside:
+        site = Site.query.get(site.id)
+        assert (site.admin_area, site.admin_level) == ("ITA-ADM3-3_0_0-B1", "ADM3")
+    outside = Site.query.get(outside.id)
+    assert (outside.admin_area, outside.admin_level) == ("NO-ADMIN", None)
+    assert list(dlq.unload_dlq(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)) == [outside.id]
+
+
+def test_process_admin_areas_batch_queues_no_admin_once(
+    db, site_factory, fake_load_geoboundary_data, monkeypatch
+):
+    outside = site_factory.create_batch(5, country="ITA", latitude=-1.0, longitude=11.0)
+    db.session.add_all(outside)
+    db.session.commit()
+    commits = []
+    commit = db.session.commit
+    monkeypatch.setattr(db.session, "commit", lambda: commits.append(1) or commit())
+
+    cbt.process_admin_areas_batch()
+
+    # Once for the admin areas, once for the queued sites
+    assert len(commits) == 2
+    letters = dlq.items(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)
+    assert sorted(letter.item for letter in letters) == sorted(s.id for s in outside)
+
+
+def test_admin_area_writer_flushes(db, site_factory):
+    sites = site_factory.create_batch(5)
+    db.session.add_all(sites)
+    db.session.commit()
+
+    with cbt.AdminAreaWriter(flush_size=2) as writer:
+        for site in sites:
+            writer.add(site.id, "ROSWELL")
+        assert len(writer.pending) == 1
+        db.session.expire_all()
+        assert Site.query.filter_by(admin_area="ROSWELL").count() == 4
+    assert not writer.pending
+    assert Site.query.filter_by(admin_area="ROSWELL").count() == 5
+
+
+def test_process_admin_areas_single(
+    app, db, site_factory, fake_load_geoboundary_data, monkeypatch
+):
+    monkeypatch.setitem(app.config, "TRANSFORM_BATCH_MODE", False)
+    inside = site_factory(country="ITA", latitude=1.0, longitude=9.0)
+    outside = site_factory(country="ITA", latitude=-1.0, longitude=11.0)
+    db.session.add_all([inside, outside])
+    db.session.commit()
+
+    cbt.process_admin_areas()
+
+    db.session.expire_all()
+    assert Site.query.get(inside.id).admin_area == "ITA-ADM3-3_0_0-B1"
+    assert Site.query.get(outside.id).admin_area == "NO-ADMIN"
+    assert list(dlq.unload_dlq(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)) == [outside.id]
+
+
+def test_process_admin_areas_country_level_only(
+    db, site_factory, fake_load_geoboundary_data, monkeypatch
+):
+    # Only the country outline is published, sites fall back to it by default
+    def country_level_url(country_code, admin_area_level):
+        if admin_area_level == "ADM0":
+            return f"https://foo.com/{country_code}-ADM0.geojson"
+        return None
+
+    monkeypatch.setattr(gbe, "fetch_geoboundary_level_url", country_level_url)
+    site = site_factory(country="ITA", latitude=1.0, longitude=9.0)
+    db.session.add(site)
+    db.session.commit()
+
+    cbt.process_admin_areas_batch()
+
+    db.session.expire_all()
+    stored = Site.query.get(site.id)
+    assert (stored.admin_area, stored.admin_level) == ("ITA-ADM3-3_0_0-B1", "ADM0")
+    assert list(dlq.unload_dlq(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)) == []
+
+
+@pytest.mark.filterwarnings("error::pytest.PytestUnhandledThreadExceptionWarning")
+def test_process_admin_areas_parallel(
+    app, db, site_factory, fake_load_geoboundary_data, monkeypatch
+):
+    monkeypatch.setitem(app.config, "TRANSFORM_WORKERS", 2)
+    monkeypatch.setattr(cbt, "_init_transform_worker", init_fake_transform_worker)
+    for country in ("ITA", "FRA", "DEU"):
+        index = gbi.get_levelled_index(country)
+        for level in index.levels:
+            gbs.ensure(index.url(level))
+    sites = [
+        site_factory(country=country, latitude=1.0, longitude=9.0)
+        for country in ("ITA", "ITA", "FRA", "DEU")
+    ]
+    outside = site_factory(country="FRA", latitude=-1.0, longitude=11.0)
+    db.session.add_all(sites + [outside])
+    db.session.commit()
+
+    cbt.process_admin_areas_batch()
+
+    db.session.expire_all()
+    for site in sites:
+        assert Site.query.get(site.id).admin_area == "ITA-ADM3-3_0_0-B1"
+    assert Site.query.get(outside.id).admin_area == "NO-ADMIN"
+    assert list(dlq.unload_dlq(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)) == [outside.id]
+
+
+def test_process_admin_areas_snaps(
+    app, db, site_factory, fake_load_geoboundary_data, monkeypatch
+):
+    monkeypatch.setitem(app.config, "ADMIN_AREA_SNAP_DISTANCE_METRES", 100)
+    pier = site_factory(country="ITA", latitude=-0.0005, longitude=5.0)
+    offshore = site_factory(country="ITA", latitude=-0.01, longitude=5.0)
+    db.session.add_all([pier, offshore])
+    db.session.commit()
+
+    cbt.process_admin_areas_batch()
+
+    db.session.expire_all()
+    pier = Site.query.get(pier.id)
+    assert (pier.admin_area, pier.admin_level) == ("ITA-ADM3-3_0_0-B1", "ADM3")
+    assert Site.query.get(offshore.id).admin_area == "NO-ADMIN"
+    assert list(dlq.unload_dlq(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)) == [offshore.id]
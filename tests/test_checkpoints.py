@@ -0,0 +1,78 @@
+import pytest
+
+from api import cb_extract as cbe
+from api import checkpoints
+from api.manage import load_sites
+from api.models import LoadCheckpoint, Site
+
+URLS = ["https://foo.com/velib", "https://foo.com/broken", "https://foo.com/bixi"]
+
+
+@pytest.fixture
+def load_config(app, monkeypatch):
+    monkeypatch.setitem(app.config, "EXTRACT_ENGINE", "asyncio")
+    monkeypatch.setitem(app.config, "PROCESSING_RETRY_COUNT", 1)
+
+
+def checkpoint_rows():
+    return {
+        c.url: (c.status, c.attempts, c.last_error) for c in LoadCheckpoint.query
+    }
+
+
+def test_checkpoints_only_recorded_while_recording(db):
+    checkpoints.start_run(URLS)
+    checkpoints.mark_fetched(URLS[0])
+    assert checkpoints.summary() == {checkpoints.PENDING: 3}
+
+    with checkpoints.recording():
+        checkpoints.mark_fetched(URLS[0])
+        checkpoints.mark_failed(URLS[1], "HTTP 500")
+    assert checkpoints.summary() == {
+        checkpoints.PENDING: 1,
+        checkpoints.FETCHED: 1,
+        checkpoints.FAILED: 1,
+    }
+    assert checkpoints.resumable_urls() == sorted(URLS[1:])
+
+
+def test_load_sites_resume(
+    app, db, fake_networks, fake_load_geoboundary_data, load_config, monkeypatch
+):
+    # A previous run loaded the first network's stations, then stopped
+    checkpoints.start_run(URLS)
+    with checkpoints.recording():
+        checkpoints.mark_fetched(URLS[0])
+    Site.query.delete()
+    db.session.commit()
+
+    def master_site_urls(uri):
+        raise AssertionError("master site list fetched on resume")
+
+    monkeypatch.setattr(cbe, "load_master_site_urls", master_site_urls)
+    result = app.test_cli_runner().invoke(load_sites, ["--resume"])
+    assert result.exit_code == 0, result.output
+
+    db.session.expire_all()
+    assert checkpoint_rows() == {
+        URLS[0]: (checkpoints.TRANSFORMED, 1, None),
+        URLS[1]: (checkpoints.FAILED, 1, "HTTP 500"),
+        URLS[2]: (checkpoints.TRANSFORMED, 1, None),
+    }
+    assert Site.query.filter(Site.admin_area.is_(None)).count() == 0
+
+
+def test_load_sites_starts_new_run(
+    app, db, fake_networks, fake_load_geoboundary_data, load_config, monkeypatch
+):
+    checkpoints.start_run(["https://foo.com/stale"])
+    monkeypatch.setattr(cbe, "load_master_site_urls", lambda uri: iter(URLS[:2]))
+
+    result = app.test_cli_runner().invoke(load_sites, [])
+    assert result.exit_code == 0, result.output
+
+    db.session.expire_all()
+    assert checkpoint_rows() == {
+        URLS[0]: (checkpoints.TRANSFORMED, 1, None),
+        URLS[1]: (checkpoints.FAILED, 1, "HTTP 500"),
+    }
@@ -1,30 +1,155 @@
+import datetime
+import random
+
+import pytest
+
 from api import dlq
+from api.manage import retry_dlq
+from api.models import Site
 
+URLS = ["https://foo.com/velib", "https://foo.com/broken"]
 
-def test_add_to_dlq():
-    dlq.add_to_dlq("url")
-    assert dlq.DEAD_LETTER_QUEUE.get_nowait() == "url"
+
+def test_add_to_dlq(db):
+    dlq.add_to_dlq("url", ValueError("boom"))
+    dlq.add_to_dlq("url", "HTTP 500")
+    [letter] = dlq.items(dlq.DEAD_LETTER_QUEUE)
+    assert (letter.item, letter.attempts) == ("url", 2)
+    assert (letter.error_class, letter.last_error) == ("HTTP 500", "HTTP 500")
+    assert letter.next_attempt > letter.created
 
 
-def test_add_to_no_admin_dlq():
+def test_add_to_no_admin_dlq(db):
     dlq.add_to_no_admin_dlq("site-id")
-    assert dlq.NO_ADMIN_DEAD_LETTER_QUEUE.get_nowait() == "site-id"
+    assert [letter.item for letter in dlq.items(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)] == [
+        "site-id"
+    ]
+    assert dlq.items(dlq.DEAD_LETTER_QUEUE) == []
 
 
-def test_unload_dlq():
+def test_add_many(db, monkeypatch):
+    dlq.add_to_dlq("queued", "HTTP 500")
+    commits = []
+    monkeypatch.setattr(db.session, "commit", lambda: commits.append(1))
+    dlq.add_many(dlq.DEAD_LETTER_QUEUE, ["queued", "new", "new"])
+    assert len(commits) == 1
+    letters = {letter.item: letter for letter in dlq.items(dlq.DEAD_LETTER_QUEUE)}
+    assert {item: letter.attempts for item, letter in letters.items()} == {
+        "new": 1,
+        "queued": 2,
+    }
+    # Failing again without an error keeps the last known one
+    assert letters["queued"].error_class == "HTTP 500"
+    assert letters["new"].error_class is None
+
+
+def test_remove_from_dlq(db):
     dlq.add_to_dlq("url")
-    assert list(dlq.unload_dlq(dlq.DEAD_LETTER_QUEUE)) == ["url"]
+    dlq.remove_from_dlq("other")
+    dlq.remove_from_dlq("url")
+    assert dlq.items(dlq.DEAD_LETTER_QUEUE) == []
 
 
-def test_log_unprocessed_dlq(capsys):
+def test_unload_dlq(db):
     dlq.add_to_dlq("url")
+    assert list(dlq.unload_dlq(dlq.DEAD_LETTER_QUEUE)) == ["url"]
+    assert dlq.items(dlq.DEAD_LETTER_QUEUE) == []
+
+
+def test_backoff_seconds():
+    rng = random.Random(0)
+    delays = [dlq.backoff_seconds(n, 60, 600, rng) for n in range(1, 7)]
+    for attempts, delay in enumerate(delays, 1):
+        cap = min(600, 60 * 2 ** (attempts - 1))
+        assert cap / 2 <= delay <= cap
+
+
+def test_due(app, db, monkeypatch):
+    monkeypatch.setitem(app.config, "PROCESSING_RETRY_COUNT", 2)
+    for url in ("a", "b", "c"):
+        dlq.add_to_dlq(url)
+    for _ in range(2):
+        dlq.add_to_dlq("c")
+
+    assert dlq.due(dlq.DEAD_LETTER_QUEUE) == []
+    later = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    assert sorted(dlq.due(dlq.DEAD_LETTER_QUEUE, now=later)) == ["a", "b"]
+    assert dlq.due(dlq.DEAD_LETTER_QUEUE, now=later, exclude=["a"]) == ["b"]
+    assert len(dlq.due(dlq.DEAD_LETTER_QUEUE, now=later, limit=1)) == 1
+    assert dlq.next_due(dlq.DEAD_LETTER_QUEUE) < later
+
+
+def test_log_unprocessed_dlq(db, capsys):
+    dlq.add_to_dlq("url", "HTTP 500")
     dlq.log_unprocessed_dlq()
     captured = capsys.readouterr()
-    assert "The following urls were not processed:\nurl" in captured.out
+    assert (
+        "The following urls were not processed:\nurl (attempts=1 error=HTTP 500)"
+        in captured.out
+    )
+    assert [letter.item for letter in dlq.items(dlq.DEAD_LETTER_QUEUE)] == ["url"]
 
 
-def test_log_no_admin_dlq(capsys):
+def test_log_no_admin_dlq(db, capsys):
     dlq.add_to_no_admin_dlq("site-id")
     dlq.log_no_admin_dlq()
     captured = capsys.readouterr()
-    assert "Admin area could not be identified for these sites:\nsite-id" in captured.out
+    assert (
+        "Admin area could not be identified for these sites:\nsite-id (attempts=1"
+        in captured.out
+    )
+
+
+@pytest.fixture
+def retry_config(app, monkeypatch):
+    monkeypatch.setitem(app.config, "EXTRACT_ENGINE", "asyncio")
+    monkeypatch.setitem(app.config, "PROCESSING_RETRY_COUNT", 1)
+    monkeypatch.setitem(app.config, "DLQ_RETRY_BASE_SECONDS", 0)
+
+
+def test_retry_dlq(
+    app, db, fake_networks, fake_load_geoboundary_data, retry_config, capsys
+):
+    for url in URLS:
+        dlq.add_to_dlq(url, "HTTP 500")
+
+    result = app.test_cli_runner().invoke(retry_dlq, [])
+    assert result.exit_code == 0, result.output
+
+    db.session.expire_all()
+    assert Site.query.count() == 5
+    assert Site.query.filter(Site.admin_area.is_(None)).count() == 0
+    [broken] = dlq.items(dlq.DEAD_LETTER_QUEUE)
+    assert (broken.item, broken.attempts) == (URLS[1], 2)
+    # The site outside every admin area is retried once more, then given up on
+    [no_admin] = dlq.items(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)
+    assert (no_admin.item, no_admin.attempts) == ("velib-station-4", 2)
+    assert dlq.due(dlq.DEAD_LETTER_QUEUE) == []
+    assert dlq.due(dlq.NO_ADMIN_DEAD_LETTER_QUEUE) == []
+
+
+def test_retry_dlq_resolves_no_admin_sites(
+    app, db, fake_networks, fake_load_geoboundary_data, retry_config
+):
+    db.session.add(
+        Site(
+            id="site-id",
+            city="Paris",
+            country="FRA",
+            latitude=1.0,
+            longitude=9.0,
+            admin_area=app.config["NO_ADMIN_AREA"],
+        )
+    )
+    db.session.commit()
+    dlq.add_to_no_admin_dlq("site-id")
+
+    result = app.test_cli_runner().invoke(retry_dlq, [])
+    assert result.exit_code == 0, result.output
+
+    db.session.expire_all()
+    assert Site.query.get("site-id").admin_area not in (
+        None,
+        app.config["NO_ADMIN_AREA"],
+    )
+    assert dlq.items(dlq.NO_ADMIN_DEAD_LETTER_QUEUE) == []
@@ -11,3 +11,11 @@ def test_decrement_adm():
         assert gbe.decrement_adm("ADM0")
     with pytest.raises(KeyError):
         assert gbe.decrement_adm("ADM4")
+
+
+def test_admin_levels():
+    assert gbe.admin_levels("ADM3", "ADM1") == ["ADM3", "ADM2", "ADM1"]
+    assert gbe.admin_levels("ADM2", "ADM2") == ["ADM2"]
+    with pytest.raises(KeyError):
+        gbe.admin_levels("ADM1", "ADM2")
+
@@ -0,0 +1,277 @@
+import pytest
+import shapely
+from shapely.geometry import box
+
+from api import gb_extract as gbe
+from api import gb_index as gbi
+from api import gb_store as gbs
+
+
+def test_admin_area_index_features(features):
+    index = gbi.AdminAreaIndex(*gbs.features_to_geometries(features))
+    assert len(index) == 3
+    assert index.lookup(5.0, 5.0) == "ITA-ADM3-3_0_0-B1"
+    assert index.lookup(5.0, 11.0) is None
+
+
+def test_admin_area_index_first_match_wins():
+    index = gbi.AdminAreaIndex(
+        ["OUTER", "INNER", "ELSEWHERE"],
+        [box(0, 0, 10, 10), box(4, 4, 6, 6), box(20, 20, 30, 30)],
+    )
+    assert index.lookup(5.0, 5.0) == "OUTER"
+    assert index.lookup(25.0, 25.0) == "ELSEWHERE"
+    assert index.lookup(15.0, 15.0) is None
+
+
+def test_admin_area_index_envelope_only_match():
+    # Triangle whose bounding box contains the point but the shape does not
+    triangle = {
+        "properties": {"shapeID": "TRIANGLE"},
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[[0, 0], [10, 0], [0, 10], [0, 0]]],
+        },
+    }
+    index = gbi.AdminAreaIndex(*gbs.features_to_geometries([triangle]))
+    assert index.lookup(1.0, 1.0) == "TRIANGLE"
+    assert index.lookup(9.0, 9.0) is None
+
+
+def test_load_admin_area_index_cached(fake_load_geoboundary_data, app, monkeypatch):
+    monkeypatch.setitem(app.config, "GEOBOUNDARY_STORE_FORMAT", "gzip")
+    index = gbi.load_admin_area_index("https://foo.com/ITA.geojson")
+    assert type(index) is gbi.AdminAreaIndex
+    assert gbi.load_admin_area_index("https://foo.com/ITA.geojson") is index
+    assert "https://foo.com/ITA.geojson" in gbi.GEOMETRY_CACHE
+    assert gbi.GEOMETRY_CACHE.vertex_count == index.vertex_count == 15
+
+
+def test_load_admin_area_index_mapped(fake_load_geoboundary_data):
+    index = gbi.load_admin_area_index("https://foo.com/ITA.geojson")
+    assert type(index) is gbi.MappedAdminAreaIndex
+    assert gbi.GEOMETRY_CACHE.vertex_count == index.vertex_count == 0
+    assert index.lookup(5.0, 5.0) == "ITA-ADM3-3_0_0-B1"
+    # Only the first feature was decoded
+    assert gbi.GEOMETRY_CACHE.vertex_count == index.vertex_count == 5
+    assert list(index.lookup_many([5.0, -1.0], [5.0, 5.0])) == [
+        "ITA-ADM3-3_0_0-B1",
+        None,
+    ]
+
+
+def test_mapped_admin_area_index_decodes_lazily(store_dir, monkeypatch):
+    index = gbi.AdminAreaIndex(
+        ["OUTER", "INNER", "ELSEWHERE", "TRIANGLE"],
+        [
+            box(0, 0, 10, 10),
+            box(4, 4, 6, 6),
+            box(20, 20, 30, 30),
+            shapely.Polygon([(40, 40), (50, 40), (40, 50)]),
+        ],
+    )
+    path = store_dir / "archive.gbs"
+    path.write_bytes(gbs.pack(index.shape_ids, index.geometries))
+    mapped = gbi.MappedAdminAreaIndex(gbs.MappedArchive(str(path)), 2)
+
+    latitudes = [5.0, 25.0, 15.0, 1.0, 41.0, 49.0]
+    longitudes = [5.0, 25.0, 15.0, 9.0, 41.0, 49.0]
+    assert list(mapped.lookup_many(latitudes, longitudes)) == list(
+        index.lookup_many(latitudes, longitudes)
+    )
+    assert [mapped.lookup(lat, lon) for lat, lon in zip(latitudes, longitudes)] == [
+        index.lookup(lat, lon) for lat, lon in zip(latitudes, longitudes)
+    ]
+    assert len(mapped._decoded) == 2
+    # A box and the triangle
+    assert mapped.vertex_count == 9
+
+
+def test_geometry_cache_evicts_by_vertex_count():
+    cache = gbi.GeometryCache()
+    small = gbi.AdminAreaIndex(["A"], [box(0, 0, 1, 1)])  # 5 vertices
+    cache.put("a", small, max_vertices=12)
+    cache.put("b", gbi.AdminAreaIndex(["B"], [box(0, 0, 1, 1)]), max_vertices=12)
+    assert cache.get("a") is small  # "b" is now least recently used
+    cache.put("c", gbi.AdminAreaIndex(["C"], [box(0, 0, 1, 1)]), max_vertices=12)
+    assert "a" in cache and "c" in cache and "b" not in cache
+    assert cache.vertex_count == 10
+    cache.put("d", gbi.AdminAreaIndex(["D"] * 3, [box(0, 0, 1, 1)] * 3), 12)
+    assert len(cache) == 1 and "d" in cache
+    assert cache.vertex_count == 15
+
+
+def test_geometry_cache_evicts_grown_indexes(store_dir):
+    path = store_dir / "archive.gbs"
+    path.write_bytes(gbs.pack(["A", "B"], [box(0, 0, 1, 1), box(2, 2, 3, 3)]))
+    mapped = gbi.MappedAdminAreaIndex(gbs.MappedArchive(str(path)))
+    cache = gbi.GeometryCache()
+    cache.put("mapped", mapped, max_vertices=12)
+    cache.put("small", gbi.AdminAreaIndex(["C"], [box(0, 0, 1, 1)]), 12)
+    assert cache.get("mapped") is mapped
+    assert mapped.lookup(0.5, 0.5) == "A"
+    assert mapped.lookup(2.5, 2.5) == "B"
+    assert cache.vertex_count == 15
+    # Decoding grew the mapped index past the limit, "small" goes on next use
+    assert cache.get("mapped") is mapped
+    assert "small" not in cache and cache.vertex_count == 10
+
+
+def test_admin_area_index_lookup_many():
+    index = gbi.AdminAreaIndex(
+        ["OUTER", "INNER", "ELSEWHERE"],
+        [box(0, 0, 10, 10), box(4, 4, 6, 6), box(20, 20, 30, 30)],
+    )
+    latitudes = [5.0, 25.0, 15.0, 1.0]
+    longitudes = [5.0, 25.0, 15.0, 9.0]
+    shape_ids = index.lookup_many(latitudes, longitudes)
+    assert list(shape_ids) == ["OUTER", "ELSEWHERE", None, "OUTER"]
+    assert list(shape_ids) == [
+        index.lookup(lat, lon) for lat, lon in zip(latitudes, longitudes)
+    ]
+
+
+def test_admin_area_index_lookup_many_empty():
+    assert list(gbi.AdminAreaIndex([], []).lookup_many([1.0], [1.0])) == [None]
+    assert list(gbi.AdminAreaIndex(["A"], [box(0, 0, 1, 1)]).lookup_many([], [])) == []
+
+
+@pytest.fixture
+def level_urls(app, monkeypatch):
+    """ADM3 covers the west half of the box ADM1 covers, there is no ADM2."""
+    urls = {"ADM3": "https://foo.com/ITA-ADM3", "ADM1": "https://foo.com/ITA-ADM1"}
+    requested = []
+
+    def mock_level_url(country_code, admin_area_level):
+        requested.append(admin_area_level)
+        return urls.get(admin_area_level)
+
+    monkeypatch.setattr(gbe, "fetch_geoboundary_level_url", mock_level_url)
+    gbi.GEOMETRY_CACHE.clear()
+    gbi.CELL_CACHE.clear()
+    for level, shape_ids, geometries in (
+        ("ADM3", ["ADM3-A"], [box(0, 0, 5, 10)]),
+        ("ADM1", ["ADM1-A"], [box(0, 0, 10, 10)]),
+    ):
+        gbi.GEOMETRY_CACHE.put(
+            urls[level], gbi.AdminAreaIndex(shape_ids, geometries), 1000
+        )
+    yield requested
+    gbi.GEOMETRY_CACHE.clear()
+    gbi.CELL_CACHE.clear()
+
+
+def test_levelled_index_falls_back(level_urls):
+    index = gbi.LevelledAdminAreaIndex("ITA", ["ADM3", "ADM2", "ADM1"])
+    assert index.lookup(1.0, 1.0) == ("ADM3-A", "ADM3")
+    assert level_urls == ["ADM3"]  # Coarser levels are only loaded when needed
+    assert index.lookup(1.0, 7.0) == ("ADM1-A", "ADM1")
+    assert index.lookup(20.0, 20.0) == (None, None)
+
+
+def test_levelled_index_lookup_many(level_urls):
+    index = gbi.LevelledAdminAreaIndex("ITA", ["ADM3", "ADM2", "ADM1"])
+    latitudes = [1.0, 1.0, 20.0]
+    longitudes = [1.0, 7.0, 20.0]
+    shape_ids, levels = index.lookup_many(latitudes, longitudes)
+    assert list(zip(shape_ids, levels)) == [
+        index.lookup(lat, lon) for lat, lon in zip(latitudes, longitudes)
+    ]
+
+    level_urls.clear()
+    shape_ids, levels = index.lookup_many([1.0], [1.0])
+    assert list(levels) == ["ADM3"] and level_urls == ["ADM3"]
+
+
+def test_get_levelled_index(app):
+    index = gbi.get_levelled_index("ITA")
+    assert index.levels == ["ADM3", "ADM2", "ADM1", "ADM0"]
+    assert index.cell_precision == 0  # Cell cache off by default
+
+
+def test_admin_area_index_nearest(store_dir):
+    index = gbi.AdminAreaIndex(["A", "B"], [box(0, 0, 1, 1), box(1.002, 0, 2, 1)])
+    # About 111m east of "A" and 111m west of "B", closer to "A"
+    assert index.nearest(0.5, 1.0009, 0.2) == "A"
+    assert index.nearest(0.5, 1.0011, 0.2) == "B"
+    assert index.nearest(0.5, -0.001, 0.1) is None
+    assert index.nearest(0.5, -0.001, 0.2) == "A"
+
+    path = store_dir / "archive.gbs"
+    path.write_bytes(gbs.pack(index.shape_ids, index.geometries))
+    mapped = gbi.MappedAdminAreaIndex(gbs.MappedArchive(str(path)))
+    assert mapped.nearest(0.5, 1.0009, 0.2) == "A"
+
+
+def test_levelled_index_snaps(level_urls):
+    index = gbi.LevelledAdminAreaIndex("ITA", ["ADM3", "ADM2", "ADM1"], 0.1)
+    # Just east of ADM1, too far from ADM3
+    assert index.lookup(1.0, 10.0005) == ("ADM1-A", "ADM1")
+    # Just east of ADM3, snapped to it rather than falling back to ADM1
+    assert index.lookup(1.0, 5.0005) == ("ADM3-A", "ADM3")
+    assert index.lookup(1.0, 10.01) == (None, None)
+
+    latitudes, longitudes = [1.0, 1.0, 1.0], [10.0005, 5.0005, 10.01]
+    shape_ids, levels = index.lookup_many(latitudes, longitudes)
+    assert list(zip(shape_ids, levels)) == [
+        index.lookup(lat, lon) for lat, lon in zip(latitudes, longitudes)
+    ]
+    assert gbi.LevelledAdminAreaIndex("ITA", ["ADM1"]).lookup(1.0, 10.0005) == (
+        None,
+        None,
+    )
+
+
+def test_admin_area_index_covering_many(store_dir):
+    index = gbi.AdminAreaIndex(
+        ["OUTER", "INNER", "EAST"],
+        [box(0, 0, 10, 10), box(4, 4, 6, 6), box(10, 0, 20, 10)],
+    )
+    areas = shapely.box([1, 4.5, 9, 25, 12], [1, 4.5, 1, 1, 1], [2, 5, 11, 26, 13], 2)
+    # First match wins for INNER, the third area straddles OUTER and EAST
+    expected = ["OUTER", "OUTER", None, None, "EAST"]
+    assert list(index.covering_many(areas)) == expected
+
+    path = store_dir / "archive.gbs"
+    path.write_bytes(gbs.pack(index.shape_ids, index.geometries))
+    mapped = gbi.MappedAdminAreaIndex(gbs.MappedArchive(str(path)))
+    assert list(mapped.covering_many(areas)) == expected
+
+
+def test_cell_cache():
+    cache = gbi.CellCache()
+    cache.put(("url", "a"), ("A", "ADM3"), max_entries=2)
+    cache.put(("url", "b"), ("B", "ADM3"), max_entries=2)
+    assert cache.get(("url", "a")) == ("A", "ADM3")
+    cache.put(("other", "c"), ("C", "ADM3"), max_entries=2)
+    assert cache.get(("url", "b")) is None  # Least recently used, evicted
+    cache.discard("url")
+    assert len(cache) == 1
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_levelled_index_cell_cache(level_urls):
+    index = gbi.LevelledAdminAreaIndex(
+        "ITA", ["ADM3", "ADM2", "ADM1"], cell_precision=7, cell_cache_size=100
+    )
+    # Nearby points inside ADM3, the second resolved from the cell cache
+    assert index.lookup(1.0, 1.0) == ("ADM3-A", "ADM3")
+    assert gbi.CELL_CACHE.stats()["hits"] == 0
+    assert index.lookup(1.0001, 1.0001) == ("ADM3-A", "ADM3")
+    assert gbi.CELL_CACHE.stats()["hits"] == 1
+
+    # Cells straddling the ADM3 edge, or matched at a coarser level, are not
+    # cached
+    assert index.lookup(1.0, 4.9999) == ("ADM3-A", "ADM3")
+    assert index.lookup(1.0, 5.0001) == ("ADM1-A", "ADM1")
+    assert index.lookup(1.0, 7.0) == ("ADM1-A", "ADM1")
+    assert len(gbi.CELL_CACHE) == 1
+
+    latitudes, longitudes = [1.0, 1.0, 1.0, 20.0], [1.0, 4.9999, 5.0001, 20.0]
+    shape_ids, levels = index.lookup_many(latitudes, longitudes)
+    assert list(zip(shape_ids, levels)) == [
+        ("ADM3-A", "ADM3"),
+        ("ADM3-A", "ADM3"),
+        ("ADM1-A", "ADM1"),
+        (None, None),
+    ]
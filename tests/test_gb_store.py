@@ -0,0 +1,101 @@
+import json
+
+import pytest
+from shapely.geometry import box
+
+from api import gb_store as gbs
+
+URL = "https://foo.com/geoBoundaries-ITA-ADM3.geojson"
+
+
+@pytest.fixture(params=["gzip", "mmap"])
+def store_format(app, request, monkeypatch):
+    monkeypatch.setitem(app.config, "GEOBOUNDARY_STORE_FORMAT", request.param)
+    return request.param
+
+
+def test_pack_unpack():
+    geometries = [box(0, 0, 1, 1), box(2, 2, 4, 5)]
+    shape_ids, unpacked = gbs.unpack(gbs.pack(["A", "B"], geometries))
+    assert shape_ids == ["A", "B"]
+    assert [g.equals(u) for g, u in zip(geometries, unpacked)] == [True, True]
+    _, bboxes, _, _ = gbs.unpack_index(gbs.pack(["A", "B"], geometries))
+    assert bboxes.tolist() == [[0, 0, 1, 1], [2, 2, 4, 5]]
+    assert gbs.unpack(gbs.pack([], [])) == ([], [])
+
+
+def test_load_geometries_downloads_once(
+    store_dir, store_format, fake_request_resource
+):
+    shape_ids, geometries = gbs.load_geometries(URL)
+    assert shape_ids == ["ITA-ADM3-3_0_0-B1"] * 3
+    assert geometries[0].bounds == (0.0, 0.0, 10.0, 10.0)
+
+    manifest = json.loads((store_dir / "geoBoundaries-ITA-ADM3.manifest.json").read_text())
+    assert manifest["source_url"] == URL
+    assert manifest["adm_level"] == "ADM3"
+    assert manifest["etag"] == '"v1"'
+    assert manifest["feature_count"] == 3
+    assert (store_dir / manifest["path"]).exists()
+
+    assert gbs.load_geometries(URL)[0] == shape_ids
+    assert len(fake_request_resource) == 1
+
+
+def test_load_geometries_revalidates_stale(
+    app, store_dir, fake_request_resource, monkeypatch
+):
+    gbs.load_geometries(URL)
+    monkeypatch.setitem(app.config, "GEOBOUNDARY_STORE_MAX_AGE_SECONDS", -1)
+    assert len(gbs.load_geometries(URL)[0]) == 3
+    assert fake_request_resource[-1] == {"If-None-Match": '"v1"'}
+
+
+def test_load_geometries_corrupt(store_dir, store_format, fake_request_resource):
+    manifest = gbs.load_geometries(URL) and gbs.read_manifest(URL)
+    (store_dir / manifest["path"]).write_bytes(b"garbage")
+    assert len(gbs.load_geometries(URL)[0]) == 3
+    assert len(fake_request_resource) == 2
+
+
+def test_load_geometries_imports_legacy(store_dir, fake_request_resource, features):
+    legacy = store_dir / "geoBoundaries-ITA-ADM3.geojson"
+    legacy.write_text(json.dumps({"features": features}))
+    assert len(gbs.load_geometries(URL)[0]) == 3
+    assert not fake_request_resource
+    assert not legacy.exists()
+
+
+def test_open_archive(store_dir, store_format, fake_request_resource):
+    archive = gbs.open_archive(URL)
+    assert len(archive) == 3
+    assert archive.shape_ids == ["ITA-ADM3-3_0_0-B1"] * 3
+    assert archive.bboxes.tolist() == [[0.0, 0.0, 10.0, 10.0]] * 3
+    assert archive.geometry(1).bounds == (0.0, 0.0, 10.0, 10.0)
+    manifest = gbs.read_manifest(URL)
+    assert manifest["compression"] is None
+    assert manifest["path"] == "geoBoundaries-ITA-ADM3.gbs"
+    assert not (store_dir / "geoBoundaries-ITA-ADM3.gbs.gz").exists()
+    assert len(fake_request_resource) == 1
+
+
+def test_open_archive_corrupt(store_dir, fake_request_resource):
+    gbs.open_archive(URL)
+    (store_dir / "geoBoundaries-ITA-ADM3.gbs").write_bytes(b"garbage")
+    assert len(gbs.open_archive(URL)) == 3
+    assert len(fake_request_resource) == 2
+
+
+def test_map_archive_verifies_on_request(store_dir, fake_request_resource):
+    gbs.open_archive(URL)
+    manifest = gbs.read_manifest(URL)
+    path = store_dir / "geoBoundaries-ITA-ADM3.gbs"
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF  # Same size and layout, different geometry bytes
+    path.write_bytes(bytes(data))
+    assert len(gbs.map_archive(URL, manifest)) == 3
+    with pytest.raises(gbs.StoreError, match="Checksum"):
+        gbs.map_archive(URL, manifest, verify=True)
+    path.write_bytes(bytes(data[:-1]))
+    with pytest.raises(gbs.StoreError, match="Size"):
+        gbs.map_archive(URL, manifest)
@@ -0,0 +1,33 @@
+import random
+
+import pytest
+
+from api.commons import geo
+
+
+def test_encode():
+    assert geo.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geo.encode(-90, -180, 3) == "000"
+
+
+@pytest.mark.parametrize(
+    "latitude, longitude, radius_km",
+    [(55.67, 12.56, 5), (0.0, 179.99, 50), (89.99, 0.0, 20), (-33.9, 18.4, 800)],
+)
+def test_radius_cover(latitude, longitude, radius_km):
+    boxes = geo.bbox_around(latitude, longitude, radius_km)
+    cells = [
+        cell for box in boxes for cell in geo.cover(*box, max_cells=geo.MAX_COVER_CELLS)
+    ]
+    rng = random.Random(0)
+    for _ in range(2000):
+        lat = rng.uniform(-90, 90) if radius_km > 500 else latitude + rng.uniform(-1, 1)
+        lon = rng.uniform(-180, 180) if radius_km > 500 else longitude + rng.uniform(-1, 1)
+        lat, lon = max(-90, min(90, lat)), (lon + 180) % 360 - 180
+        if geo.haversine_km(latitude, longitude, lat, lon) > radius_km:
+            continue
+        assert any(
+            min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+            for min_lat, min_lon, max_lat, max_lon in boxes
+        )
+        assert any(geo.encode(lat, lon).startswith(cell) for cell in cells)
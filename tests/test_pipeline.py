@@ -0,0 +1,44 @@
+import pytest
+
+from api import dlq
+from api import pipeline
+from api.models import Site
+
+
+def test_pipeline_run(db, fake_networks, fake_load_geoboundary_data):
+    pipeline.run(["https://foo.com/velib", "https://foo.com/broken"])
+
+    db.session.expire_all()
+    admin_areas = dict(db.session.query(Site.id, Site.admin_area))
+    assert admin_areas == {
+        "velib-station-0": "ITA-ADM3-3_0_0-B1",
+        "velib-station-1": "ITA-ADM3-3_0_0-B1",
+        "velib-station-2": "ITA-ADM3-3_0_0-B1",
+        "velib-station-3": "ITA-ADM3-3_0_0-B1",
+        "velib-station-4": "NO-ADMIN",
+    }
+    assert list(dlq.unload_dlq(dlq.DEAD_LETTER_QUEUE)) == ["https://foo.com/broken"]
+    assert list(dlq.unload_dlq(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)) == ["velib-station-4"]
+
+
+def test_pipeline_only_transforms_loaded_sites(
+    db, site, fake_networks, fake_load_geoboundary_data
+):
+    site.admin_area = None
+    db.session.commit()
+
+    pipeline.run(["https://foo.com/velib"])
+
+    db.session.expire_all()
+    assert Site.query.get(site.id).admin_area is None
+    # Only the loaded station outside every admin area is queued
+    assert list(dlq.unload_dlq(dlq.NO_ADMIN_DEAD_LETTER_QUEUE)) == ["velib-station-4"]
+
+
+def test_pipeline_stage_failure(db, fake_networks, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(pipeline.cb_transform, "process_pending", fail)
+    with pytest.raises(RuntimeError, match="boom"):
+        pipeline.run([f"https://foo.com/velib/{i}" for i in range(50)])
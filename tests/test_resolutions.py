@@ -0,0 +1,87 @@
+import pytest
+
+from api import cb_transform as cbt
+from api import gb_index as gbi
+from api import gb_store as gbs
+from api import resolutions
+from api.models import AdminAreaResolution, Site
+
+
+@pytest.fixture
+def sites(db, site_factory, fake_load_geoboundary_data):
+    inside = [
+        site_factory(country="ITA", latitude=1.0 + i / 1000, longitude=9.0)
+        for i in range(3)
+    ]
+    outside = site_factory(country="ITA", latitude=-1.0, longitude=11.0)
+    db.session.add_all(inside + [outside])
+    db.session.commit()
+    return inside, outside
+
+
+def unresolve(db):
+    Site.query.update({"admin_area": None, "admin_level": None})
+    db.session.commit()
+
+
+def no_geometries(geo_resource_url):
+    raise AssertionError(f"geometries loaded for: {geo_resource_url}")
+
+
+@pytest.mark.parametrize("batch_mode", [True, False])
+def test_steady_state_skips_geometries(app, db, sites, monkeypatch, batch_mode):
+    monkeypatch.setitem(app.config, "TRANSFORM_BATCH_MODE", batch_mode)
+    inside, outside = sites
+    cbt.process_admin_areas()
+    assert AdminAreaResolution.query.count() == 3
+
+    unresolve(db)
+    gbi.GEOMETRY_CACHE.clear()
+    monkeypatch.setattr(gbi, "load_admin_area_index", no_geometries)
+    resolved = []
+
+    def resolve_country(country, site_ids, *args):
+        resolved.extend(site_ids)
+        return country, site_ids, [None] * len(site_ids), [None] * len(site_ids)
+
+    def identify_admin_area(site, writer):
+        resolved.append(site.id)
+        return False
+
+    monkeypatch.setattr(cbt, "resolve_country", resolve_country)
+    monkeypatch.setattr(cbt, "identify_admin_area", identify_admin_area)
+    cbt.process_admin_areas()
+
+    # Only the site no admin area contains is resolved against geometries
+    assert resolved == [outside.id]
+    db.session.expire_all()
+    for site in inside:
+        site = Site.query.get(site.id)
+        assert (site.admin_area, site.admin_level) == ("ITA-ADM3-3_0_0-B1", "ADM3")
+
+
+def test_stale_resolutions_replaced(db, sites):
+    cbt.process_admin_areas()
+    version = resolutions.dataset_version("ITA")
+    assert {r.version for r in AdminAreaResolution.query} == {version}
+
+    AdminAreaResolution.query.update({"version": "stale", "shape_id": "OLD"})
+    db.session.commit()
+    unresolve(db)
+    cbt.process_admin_areas()
+
+    db.session.expire_all()
+    assert {(r.version, r.shape_id) for r in AdminAreaResolution.query} == {
+        (version, "ITA-ADM3-3_0_0-B1")
+    }
+    assert Site.query.filter_by(admin_area="OLD").count() == 0
+
+
+def test_dataset_version_follows_manifest(app, db, fake_load_geoboundary_data):
+    version = resolutions.dataset_version("ITA")
+    assert resolutions.dataset_version("ITA") == version
+
+    url = "https://foo.com/ITA.geojson"
+    manifest = gbs.read_manifest(url)
+    gbs.write_manifest(url, dict(manifest, sha256="0" * 64))
+    assert resolutions.dataset_version("ITA") != version
@@ -0,0 +1,106 @@
+from flask import url_for
+
+from api import cb_extract as cbe
+from api import rollups
+from api.models import SiteRollup
+
+
+def rollup_rows(level):
+    return {
+        (r.country, r.key): (r.site_count, r.available, r.used)
+        for r in SiteRollup.query.filter_by(level=level)
+    }
+
+
+def refresh(db):
+    rollups.refresh_rollups()
+    db.session.commit()
+
+
+def test_rollups_refresh_at_publish(db, site_factory):
+    sites = [
+        site_factory(country="DNK", admin_area="A", available=1, used=2),
+        site_factory(country="DNK", admin_area="A", available=3, used=4),
+        site_factory(country="DNK", admin_area=None, available=5, used=6),
+        site_factory(country="SWE", admin_area="B", available=7, used=8),
+    ]
+    db.session.add_all(sites)
+    db.session.commit()
+    assert rollup_rows("country") == {}  # Not counted until published
+
+    refresh(db)
+    assert rollup_rows("country") == {
+        ("DNK", "DNK"): (3, 9, 12),
+        ("SWE", "SWE"): (1, 7, 8),
+    }
+    assert rollup_rows("admin_area") == {("DNK", "A"): (2, 4, 6), ("SWE", "B"): (1, 7, 8)}
+
+    sites[2].admin_area = "C"
+    sites[3].country = "NOR"
+    db.session.commit()
+    db.session.delete(sites[0])
+    db.session.commit()
+    assert rollup_rows("country") == {
+        ("DNK", "DNK"): (3, 9, 12),
+        ("SWE", "SWE"): (1, 7, 8),
+    }
+
+    refresh(db)
+    assert rollup_rows("country") == {
+        ("DNK", "DNK"): (2, 8, 10),
+        ("NOR", "NOR"): (1, 7, 8),
+    }
+    assert rollup_rows("admin_area") == {
+        ("DNK", "A"): (1, 3, 4),
+        ("DNK", "C"): (1, 5, 6),
+        ("NOR", "B"): (1, 7, 8),
+    }
+
+
+def test_refresh_rollups(db):
+    rows = [
+        dict(
+            id=f"site-{i}",
+            city="Paris",
+            country="FRA",
+            latitude=48.85,
+            longitude=2.35,
+            used=1,
+            available=i,
+        )
+        for i in range(4)
+    ]
+    # Rollups are only rebuilt when the loader publishes
+    cbe.upsert_sites(rows)
+    assert rollup_rows("country") == {}
+
+    refresh(db)
+    assert rollup_rows("country") == {("FRA", "FRA"): (4, 6, 4)}
+    assert rollup_rows("admin_area") == {}
+
+
+def test_get_site_aggregates(client, db, site, site_factory, admin_headers):
+    other = site_factory(country="DNK", admin_area="AREA-52")
+    db.session.add_all([site, other])
+    db.session.commit()
+    refresh(db)
+
+    rep = client.get(url_for('api.site_aggregates'), headers=admin_headers)
+    assert rep.status_code == 200
+    results = rep.get_json()["results"]
+    assert [(r["key"], r["site_count"]) for r in results] == [
+        ("AREA-51", 1),
+        ("AREA-52", 1),
+    ]
+
+    rep = client.get(
+        url_for('api.site_aggregates', level="country", country="DNK"),
+        headers=admin_headers,
+    )
+    [result] = rep.get_json()["results"]
+    assert result["key"] == "DNK"
+    assert result["site_count"] == 2
+    assert result["available"] == site.available + other.available
+
+    rep = client.get(url_for('api.site_aggregates', level="city"), headers=admin_headers)
+    assert rep.status_code == 400
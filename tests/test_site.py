@@ -1,4 +1,15 @@
+import csv
+import io
+import json
+
 from flask import url_for
+from sqlalchemy import text
+
+from api import cb_transform as cbt
+from api.api.schemas import SiteSchema
+from api.commons import geo
+from api.commons.pagination import encode_cursor
+from api.models import Site
 
 
 def test_get_sites(client, db, site_factory, admin_headers):
@@ -29,3 +40,148 @@ def test_get_sites_by_admin(client, db, site, site_factory, admin_headers):
 
     results = rep.get_json()
     assert len(results["results"]) == 1
+
+
+def test_get_sites_matches_schema(client, db, site_factory, admin_headers):
+    sites = site_factory.create_batch(5)
+    sites[0].timestamp = None
+    sites[1].admin_area = "AREA-51"
+    db.session.add_all(sites)
+    db.session.commit()
+
+    rep = client.get(url_for('api.sites'), headers=admin_headers)
+    assert rep.status_code == 200
+    results = rep.get_json()["results"]
+    expected = SiteSchema(many=True).dump(Site.query.all())
+    assert sorted(results, key=lambda s: s["id"]) == sorted(
+        expected, key=lambda s: s["id"]
+    )
+
+
+def test_get_sites_by_cursor(client, db, site_factory, admin_headers):
+    sites = site_factory.create_batch(7)
+    db.session.add_all(sites)
+    db.session.commit()
+
+    url = url_for('api.sites', cursor="", per_page=3)
+    seen = []
+    while url:
+        rep = client.get(url, headers=admin_headers)
+        assert rep.status_code == 200
+        results = rep.get_json()
+        assert results["total"] == 7
+        assert len(results["results"]) <= 3
+        seen.extend(s["id"] for s in results["results"])
+        url = results["next"]
+    assert seen == sorted(site.id for site in sites)
+
+    rep = client.get(
+        url_for('api.sites', cursor="", count="false"), headers=admin_headers
+    )
+    results = rep.get_json()
+    assert results["total"] is None
+    assert results["next"] is None
+    assert len(results["results"]) == 7
+
+    rep = client.get(url_for('api.sites', cursor="!nope"), headers=admin_headers)
+    assert rep.status_code == 400
+
+    # Valid JSON, but not a key
+    cursor = encode_cursor([1])
+    rep = client.get(url_for('api.sites', cursor=cursor), headers=admin_headers)
+    assert rep.status_code == 400
+
+    rep = client.get(url_for('api.sites', cursor="", per_page=0), headers=admin_headers)
+    assert rep.status_code == 400
+
+
+def test_get_sites_spatial(client, db, site_factory, admin_headers):
+    # Copenhagen centre, Malmo (~27 km away) and two sites either side of
+    # the antimeridian
+    coordinates = [(55.6761, 12.5683), (55.6050, 13.0038), (-16.5, 179.9), (-16.5, -179.9)]
+    sites = [
+        site_factory(latitude=latitude, longitude=longitude)
+        for latitude, longitude in coordinates
+    ]
+    db.session.add_all(sites)
+    db.session.commit()
+
+    def ids(**args):
+        rep = client.get(url_for('api.sites', **args), headers=admin_headers)
+        assert rep.status_code == 200, rep.get_json()
+        return {s["id"] for s in rep.get_json()["results"]}
+
+    assert ids(near="55.68,12.57", radius_km=5) == {sites[0].id}
+    assert ids(near="55.68,12.57", radius_km=30) == {sites[0].id, sites[1].id}
+    assert ids(near="-16.5,180", radius_km=20) == {sites[2].id, sites[3].id}
+    assert ids(bbox="12,55,13,56") == {sites[0].id}
+    assert ids(bbox="179,-17,-179,-16") == {sites[2].id, sites[3].id}
+
+    for args in [
+        {"bbox": "1,2,3"},
+        {"bbox": "12,56,13,55"},
+        {"near": "55.68,12.57"},
+        {"near": "95,12.57", "radius_km": 5},
+        {"near": "55.68,12.57", "radius_km": "nan"},
+        {"near": "55.68,12.57", "radius_km": "inf"},
+        {"bbox": "12,55,nan,56"},
+    ]:
+        rep = client.get(url_for('api.sites', **args), headers=admin_headers)
+        assert rep.status_code == 400
+
+
+def query_plan(db, query):
+    statement = query.statement.compile(
+        db.engine, compile_kwargs={"literal_binds": True}
+    )
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {statement}"))
+    return [row[-1] for row in rows]
+
+
+def test_site_query_plans(db):
+    plans = {
+        "admin_area": query_plan(db, Site.query.filter_by(admin_area="AREA-51")),
+        "country_admin_area": query_plan(
+            db, Site.query.filter_by(country="DNK", admin_area="AREA-51")
+        ),
+        "unresolved": query_plan(db, cbt.pending_sites_query()),
+        "near": query_plan(
+            db, Site.query.filter(geo.radius_filter(Site, 55.68, 12.57, 5))
+        ),
+    }
+    assert any("ix_site_admin_area" in p for p in plans["admin_area"])
+    assert any("ix_site_country_admin_area" in p for p in plans["country_admin_area"])
+    assert any("ix_site_unresolved" in p for p in plans["unresolved"])
+    assert all("ix_site_geohash" in p for p in plans["near"] if "site" in p)
+    for name, plan in plans.items():
+        # Walking the partial index is fine, scanning the whole table is not
+        assert "SCAN site" not in plan, (name, plan)
+        assert not any("TEMP B-TREE" in p for p in plan), (name, plan)
+
+
+def test_export_sites(client, db, site, site_factory, admin_headers):
+    sites = site_factory.create_batch(5)
+    db.session.add_all(sites)
+    db.session.add(site)
+    db.session.commit()
+
+    rep = client.get(url_for('api.sites_export'), headers=admin_headers)
+    assert rep.status_code == 200
+    assert rep.mimetype == "application/x-ndjson"
+    rows = [json.loads(line) for line in rep.get_data(as_text=True).splitlines()]
+    assert [row["id"] for row in rows] == sorted(s.id for s in sites + [site])
+    listed = client.get(url_for('api.sites'), headers=admin_headers).get_json()
+    assert sorted(rows, key=lambda row: row["id"]) == sorted(
+        listed["results"], key=lambda row: row["id"]
+    )
+
+    rep = client.get(
+        url_for('api.sites_export', format="csv", admin_area="AREA-51"),
+        headers=admin_headers,
+    )
+    assert rep.mimetype == "text/csv"
+    rows = list(csv.DictReader(io.StringIO(rep.get_data(as_text=True))))
+    assert [row["id"] for row in rows] == [site.id]
+
+    rep = client.get(url_for('api.sites_export', format="xml"), headers=admin_headers)
+    assert rep.status_code == 400